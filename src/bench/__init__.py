@@ -0,0 +1,10 @@
+"""
+离线基准测试
+
+fake_server: 本地模拟pixiv的http服务器，按fixtures目录中的文件回放接口与图片，可注入延迟、带宽限制、错误和429
+fixtures: fixtures目录的格式以及生成合成数据
+run_bench: 启动模拟服务器，用临时配置(PIXIV_CRAWLER_CONFIG)和sqlite逐个运行爬取模式，输出吞吐量、延迟与内存
+
+在src目录下运行:
+python -m bench.run_bench --modes artwork,user,rank,pixivision --latency 0.02 --throttle-rate 0.01
+"""
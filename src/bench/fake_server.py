@@ -0,0 +1,186 @@
+"""
+模拟pixiv的本地http服务器
+
+请求路径的第一段为原始host，如 /www.pixiv.net/ajax/illust/1000?lang=zh，
+与配置中transport.hosts的替换规则对应(见hosts())，响应按fixtures目录中的文件回放
+图片响应带ETag并支持Range/If-Range(206、416)，truncate_rate可以模拟传输中途断开，用于测试断点续传
+"""
+import argparse
+import json
+import pathlib
+import random
+import threading
+import time
+import urllib.parse
+import http.server
+from typing import NamedTuple
+from bench import fixtures
+
+CHUNK_SIZE = 64 * 1024
+ORIGINS = ("https://www.pixiv.net", "https://www.pixivision.net", "https://i.pximg.net")
+
+
+class FaultConfig(NamedTuple):
+    latency: float = 0.0  # 每个请求返回前的固定延迟(秒)
+    jitter: float = 0.0  # 在固定延迟上再加0~jitter秒的随机延迟
+    bandwidth: int = 0  # 每个响应的发送速率上限(字节/秒)，0为不限
+    error_rate: float = 0.0  # 返回500的比例
+    throttle_rate: float = 0.0  # 返回429的比例
+    retry_after: int = 1  # 429响应中的Retry-After(秒)
+    truncate_rate: float = 0.0  # 图片响应只发送一半body后断开连接的比例
+    seed: int | None = None
+
+
+def hosts(base_url: str) -> dict[str, str]:
+    # 配置中transport.hosts的值，把所有origin替换到base_url下以host命名的路径
+    return {origin: f"{base_url}/{urllib.parse.urlsplit(origin).hostname}" for origin in ORIGINS}
+
+
+def _content_type(host: str, path: str) -> str:
+    if host == fixtures.IMAGE_HOST:
+        return {".png": "image/png", ".gif": "image/gif", ".zip": "application/zip"}.get(
+            pathlib.PurePosixPath(path).suffix, "image/jpeg")
+    if host == "www.pixivision.net":
+        return "text/html; charset=utf-8"
+    return "application/json"
+
+
+class FakePixivServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, root: pathlib.Path, faults: FaultConfig, address: tuple[str, int] = ("127.0.0.1", 0)):
+        super().__init__(address, _Handler)
+        self.root = root
+        self.faults = faults
+        self._random = random.Random(faults.seed)
+        self._lock = threading.Lock()
+        self.counts: dict[int, int] = {}
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def draw(self) -> tuple[float, float]:
+        # 返回(额外延迟, 用于决定是否注入错误的随机数)
+        with self._lock:
+            return self._random.uniform(0, self.faults.jitter), self._random.random()
+
+    def count(self, status: int):
+        with self._lock:
+            self.counts[status] = self.counts.get(status, 0) + 1
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: FakePixivServer
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: bytes, content_type: str = "application/json", headers: dict | None = None,
+              truncate: bool = False):
+        # truncate为True时Content-Length仍为完整长度，只发送一半body后断开连接
+        self.server.count(status)
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        if truncate:
+            self.send_header("Connection", "close")
+            self.close_connection = True
+        self.end_headers()
+        bandwidth = self.server.faults.bandwidth
+        size = len(body) // 2 if truncate else len(body)
+        for i in range(0, size, CHUNK_SIZE):
+            chunk = body[i:min(i + CHUNK_SIZE, size)]
+            self.wfile.write(chunk)
+            if bandwidth:
+                time.sleep(len(chunk) / bandwidth)
+
+    def _lookup(self, host: str, path: str, query: str) -> pathlib.Path | None:
+        file_path = fixtures.fixture_path(self.server.root, host, path, query)
+        if file_path.exists():
+            return file_path
+        if host == fixtures.IMAGE_HOST:
+            file_path = fixtures.default_image_path(self.server.root, pathlib.PurePosixPath(path).suffix)
+            if file_path.exists():
+                return file_path
+        return None
+
+    def _send_image(self, body: bytes, content_type: str, etag: str, truncate: bool):
+        headers = {"ETag": etag, "Accept-Ranges": "bytes"}
+        byte_range = self.headers.get("Range", "")
+        if_range = self.headers.get("If-Range")
+        # If-Range与当前ETag不一致(文件已变化)时忽略Range，返回完整内容
+        if not byte_range.startswith("bytes=") or (if_range is not None and if_range != etag):
+            self._send(200, body, content_type, headers, truncate)
+            return
+        first, _, last = byte_range[len("bytes="):].partition("-")
+        start = int(first)
+        end = min(int(last), len(body) - 1) if last else len(body) - 1
+        if start >= len(body):
+            self._send(416, b"", content_type, {**headers, "Content-Range": f"bytes */{len(body)}"})
+            return
+        headers["Content-Range"] = f"bytes {start}-{end}/{len(body)}"
+        self._send(206, body[start:end + 1], content_type, headers, truncate)
+
+    def do_GET(self):
+        faults = self.server.faults
+        jitter, roll = self.server.draw()
+        if faults.latency or jitter:
+            time.sleep(faults.latency + jitter)
+        if roll < faults.throttle_rate:
+            self._send(429, b'{"error": true, "message": "rate limited"}',
+                       headers={"Retry-After": str(faults.retry_after)})
+            return
+        if roll < faults.throttle_rate + faults.error_rate:
+            self._send(500, b'{"error": true, "message": "injected error"}')
+            return
+        truncate = roll < faults.throttle_rate + faults.error_rate + faults.truncate_rate
+
+        parts = urllib.parse.urlsplit(self.path)
+        host, _, path = parts.path.lstrip("/").partition("/")
+        file_path = self._lookup(host, "/" + path, parts.query)
+        if file_path is None:
+            self._send(404, json.dumps({"error": True, "message": f"no fixture for {self.path}"}).encode())
+            return
+        if host == fixtures.IMAGE_HOST:
+            stat = file_path.stat()
+            etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+            self._send_image(file_path.read_bytes(), _content_type(host, path), etag, truncate)
+            return
+        self._send(200, file_path.read_bytes(), _content_type(host, path))
+
+
+def serve(root: pathlib.Path, faults: FaultConfig, address: tuple[str, int] = ("127.0.0.1", 0)) -> FakePixivServer:
+    # 在后台线程中运行，server.shutdown()停止
+    server = FakePixivServer(root, faults, address)
+    threading.Thread(target=server.serve_forever, name="fake-pixiv", daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="模拟pixiv的本地http服务器")
+    parser.add_argument("--fixtures", type=pathlib.Path, required=True)
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--generate", type=int, default=0, help="fixtures目录不存在时生成的作品数")
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--bandwidth", type=int, default=0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--truncate-rate", type=float, default=0.0, help="图片响应传输中途断开的比例")
+    args = parser.parse_args()
+    if args.generate and not fixtures.exists(args.fixtures):
+        fixtures.generate(args.fixtures, args.generate)
+    faults = FaultConfig(args.latency, args.jitter, args.bandwidth, args.error_rate, args.throttle_rate,
+                         truncate_rate=args.truncate_rate)
+    server = FakePixivServer(args.fixtures, faults, ("127.0.0.1", args.port))
+    print(f"serving {args.fixtures} on {server.base_url}, transport.hosts: {json.dumps(hosts(server.base_url))}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
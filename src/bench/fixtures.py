@@ -0,0 +1,138 @@
+"""
+fixtures目录格式
+
+每个请求对应一个文件: {root}/{host}/{path}[@{query}].body，query去掉lang后按参数名排序
+例如 www.pixiv.net/ajax/illust/1000.body、www.pixiv.net/ranking.php@content=illust&date=20240101&format=json&mode=daily&p=1.body
+i.pximg.net下没有对应文件的图片使用同扩展名的i.pximg.net/_default{ext}.body
+录制的真实响应按同样的规则放入目录即可回放
+"""
+import json
+import os
+import pathlib
+import random
+import urllib.parse
+from typing import NamedTuple
+
+IMAGE_HOST = "i.pximg.net"
+IGNORED_PARAMS = ("lang",)
+RANK_PAGE_SIZE = 50
+RANK_DATE = 20240101
+PIXIVISION_AID = 1
+PIXIVISION_SIZE = 20
+
+
+def fixture_path(root: pathlib.Path, host: str, path: str, query: str = "") -> pathlib.Path:
+    params = sorted((k, v) for k, v in urllib.parse.parse_qsl(query) if k not in IGNORED_PARAMS)
+    name = path.strip("/") or "index"
+    if params:
+        name += "@" + urllib.parse.urlencode(params)
+    return root / host / f"{name}.body"
+
+
+def default_image_path(root: pathlib.Path, suffix: str) -> pathlib.Path:
+    return root / IMAGE_HOST / f"_default{suffix}.body"
+
+
+class FixtureSet(NamedTuple):
+    artwork_ids: list[int]
+    user_ids: list[int]
+    rank_date: int
+    pixivision_aid: int
+
+
+def _write(file_path: pathlib.Path, body: bytes):
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+    file_path.write_bytes(body)
+
+
+def _write_json(root: pathlib.Path, url: str, obj: dict):
+    parts = urllib.parse.urlsplit(url)
+    _write(fixture_path(root, parts.hostname, parts.path, parts.query), json.dumps(obj).encode())
+
+
+def _artwork_body(artwork_id: int, user_id: int) -> dict:
+    suffix = "png" if artwork_id % 4 == 0 else "jpg"
+    return {
+        "illustId": str(artwork_id), "userId": str(user_id), "userName": f"user{user_id}", "illustType": 0,
+        "tags": {"tags": [
+            {"tag": f"tag{artwork_id % 37}"},
+            {"tag": "オリジナル", "translation": {"en": "original"}},
+        ]},
+        "urls": {"original": f"https://{IMAGE_HOST}/img-original/img/2024/01/01/00/00/00/{artwork_id}_p0.{suffix}"},
+        "title": f"artwork {artwork_id}", "pageCount": 1 + artwork_id % 3, "xRestrict": 0,
+        "description": "", "bookmarkCount": artwork_id % 1000, "likeCount": artwork_id % 500,
+        "commentCount": 0, "viewCount": artwork_id % 10000,
+        "createDate": "2024-01-01T00:00:00+09:00", "uploadDate": "2024-01-01T00:00:00+09:00",
+        "height": 1200, "width": 800,
+    }
+
+
+def _pixivision_html(artwork_ids: list[int]) -> str:
+    works = "".join(
+        f'<div class="am__work__main"><a href="https://www.pixiv.net/artworks/{i}"></a></div>'
+        for i in artwork_ids
+    )
+    return (
+        '<html><head><meta property="og:title" content="bench"><meta property="og:description" content="bench">'
+        '</head><body><div class="am__categoty-pr"><a data-gtm-label="illustration"></a></div>'
+        f'<div class="am__body">{works}</div></body></html>'
+    )
+
+
+def generate(root: pathlib.Path, artworks: int = 200, users: int = 10, image_kb: int = 256, seed: int = 0) -> FixtureSet:
+    """
+    生成合成的fixtures: artworks个作品平均分给users个用户，全部作品组成日榜，前PIXIVISION_SIZE个作品组成一篇pixivision
+    每页图片大小为image_kb，所有图片共用png、jpg两个文件
+    """
+    rng = random.Random(seed)
+    artwork_ids = list(range(1000, 1000 + artworks))
+    user_ids = list(range(100, 100 + users))
+    by_user: dict[int, list[int]] = {}
+    for idx, artwork_id in enumerate(artwork_ids):
+        user_id = user_ids[idx % len(user_ids)]
+        by_user.setdefault(user_id, []).append(artwork_id)
+        _write_json(root, f"https://www.pixiv.net/ajax/illust/{artwork_id}", {"error": False, "body": _artwork_body(artwork_id, user_id)})
+
+    for user_id, ids in by_user.items():
+        _write_json(root, f"https://www.pixiv.net/ajax/user/{user_id}/profile/all",
+                    {"error": False, "body": {"illusts": {str(i): None for i in ids}}})
+
+    for page, start in enumerate(range(0, len(artwork_ids), RANK_PAGE_SIZE), 1):
+        contents = [{"illust_id": i} for i in artwork_ids[start:start + RANK_PAGE_SIZE]]
+        has_next = start + RANK_PAGE_SIZE < len(artwork_ids)
+        _write_json(root, f"https://www.pixiv.net/ranking.php?content=illust&p={page}&format=json&date={RANK_DATE}&mode=daily",
+                    {"contents": contents, "next": page + 1 if has_next else False})
+
+    _write(fixture_path(root, "www.pixivision.net", f"/zh/a/{PIXIVISION_AID}"),
+           _pixivision_html(artwork_ids[:PIXIVISION_SIZE]).encode())
+
+    noise = rng.randbytes(image_kb * 1024)
+    _write(default_image_path(root, ".png"), b"\x89PNG\r\n\x1a\n" + noise)
+    _write(default_image_path(root, ".jpg"), b"\xff\xd8\xff" + noise)
+    return FixtureSet(artwork_ids, user_ids, RANK_DATE, PIXIVISION_AID)
+
+
+def load(root: pathlib.Path) -> FixtureSet:
+    # 从已有的fixtures目录中找出可以用于基准测试的作品、用户、日榜与pixivision
+    def _ids(directory: pathlib.Path, pattern: str) -> list[int]:
+        if not directory.exists():
+            return []
+        return sorted(int(p.name.split(".")[0]) for p in directory.glob(pattern) if p.name.split(".")[0].isdigit())
+
+    pixiv = root / "www.pixiv.net"
+    rank_dates = sorted(
+        int(dict(urllib.parse.parse_qsl(p.name[len("ranking.php@"):-len(".body")]))["date"])
+        for p in pixiv.glob("ranking.php@*mode=daily*p=1.body")
+    ) if pixiv.exists() else []
+    pixivision = _ids(root / "www.pixivision.net" / "zh" / "a", "*.body")
+    return FixtureSet(
+        _ids(pixiv / "ajax" / "illust", "*.body"),
+        [int(p.name) for p in sorted((pixiv / "ajax" / "user").glob("*")) if (p / "profile" / "all.body").exists()]
+        if (pixiv / "ajax" / "user").exists() else [],
+        rank_dates[0] if rank_dates else 0,
+        pixivision[0] if pixivision else 0,
+    )
+
+
+def exists(root: pathlib.Path) -> bool:
+    return os.path.isdir(root / "www.pixiv.net")
@@ -0,0 +1,177 @@
+"""
+基准测试
+
+启动模拟服务器后，每个爬取模式在独立的子进程中运行(各自的临时配置、sqlite数据库和图片目录)，
+输出artworks/s、MB/s、请求延迟p50/p99、429与错误数、续传(206)次数以及子进程的内存峰值
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import pathlib
+import resource
+import shutil
+import tempfile
+import time
+import yaml
+from bench import fake_server
+from bench import fixtures
+
+MODES = ("artwork", "user", "rank", "pixivision")
+RATE = 1000.0  # 基准测试不限速，由模拟服务器注入429
+
+
+def _write_config(run_dir: pathlib.Path, base_url: str) -> pathlib.Path:
+    (run_dir / "file").mkdir(parents=True, exist_ok=True)
+    config = {
+        "session_id": "bench",
+        "proxy": "",
+        "file_path": str(run_dir / "file"),
+        "sql_url": f"sqlite:///{run_dir / 'db.sqlite'}",
+        "ajax_rate": RATE,
+        "image_rate": RATE,
+        "transport": {"hosts": fake_server.hosts(base_url)},
+    }
+    config_path = run_dir / "config.yml"
+    with open(config_path, "w", encoding="utf-8") as f:
+        yaml.safe_dump(config, f)
+    return config_path
+
+
+def _sum(totals: dict[str, float], name: str, **labels) -> float:
+    # 按指标名(以及部分标签)汇总totals()中的值
+    label_text = [f'{k}="{v}"' for k, v in labels.items()]
+    return sum(
+        value for key, value in totals.items()
+        if key.split("{")[0] == name and all(text in key for text in label_text)
+    )
+
+
+def _run_mode(mode: str, config_path: pathlib.Path, fixture_set: fixtures.FixtureSet, options_kwargs: dict,
+              max_artworks: int, results: multiprocessing.Queue):
+    # 在子进程中执行，配置在导入pixiv_crawler时读取，必须先设置环境变量
+    import pkg.cfg as cfg
+    os.environ[cfg.CONFIG_ENV] = str(config_path)
+    import pkg.log as log
+    import pkg.metrics as metrics
+    import interval.pixiv_crawler as pixiv_crawler
+    log.configure(file=str(config_path.parent / "log.txt"), console=False)
+
+    options = pixiv_crawler.pixiv_api.new_filter(**options_kwargs)
+    start = time.monotonic()
+    if mode == "artwork":
+        for artwork_id in fixture_set.artwork_ids[:max_artworks]:
+            pixiv_crawler.crawler_by_artwork_id(artwork_id, options)
+    elif mode == "user":
+        for user_id in fixture_set.user_ids:
+            pixiv_crawler.crawler_by_user_id(user_id, options)
+    elif mode == "rank":
+        pixiv_crawler.crawler_by_rank_all(pixiv_crawler.pixiv_api.RankType.DAILY, fixture_set.rank_date, options)
+    elif mode == "pixivision":
+        pixiv_crawler.crawler_by_pixivision_aid(fixture_set.pixivision_aid, options)
+    elapsed = time.monotonic() - start
+    log.flush()
+
+    totals = metrics.registry.totals()
+    latency = metrics.histogram("pixiv_request_seconds")
+    artworks = _sum(totals, "crawler_artworks_total", status="done")
+    if mode == "artwork":
+        artworks = _sum(totals, "db_written_artworks_total", status="ok")
+    mb = _sum(totals, "pixiv_response_bytes_total") / 1024 / 1024
+    results.put({
+        "mode": mode,
+        "artworks": int(artworks),
+        "elapsed": round(elapsed, 3),
+        "artworks_per_s": round(artworks / elapsed, 2) if elapsed else 0.0,
+        "mb_per_s": round(mb / elapsed, 2) if elapsed else 0.0,
+        "requests": int(_sum(totals, "pixiv_requests_total")),
+        "throttled": int(_sum(totals, "pixiv_requests_total", status=429)),
+        "resumed": int(_sum(totals, "pixiv_requests_total", status=206)),
+        "errors": int(_sum(totals, "pixiv_requests_total") - _sum(totals, "pixiv_requests_total", status=200)
+                      - _sum(totals, "pixiv_requests_total", status=206)
+                      - _sum(totals, "pixiv_requests_total", status=429)),
+        "retries": int(_sum(totals, "pixiv_request_retries_total")),
+        "p50_ms": round(latency.quantile(0.5) * 1000, 1),
+        "p99_ms": round(latency.quantile(0.99) * 1000, 1),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    })
+
+
+def _print_table(rows: list[dict]):
+    columns = ["mode", "artworks", "elapsed", "artworks_per_s", "mb_per_s", "p50_ms", "p99_ms",
+               "requests", "throttled", "errors", "resumed", "retries", "peak_rss_mb"]
+    widths = {c: max(len(c), *(len(str(row.get(c, ""))) for row in rows)) for c in columns}
+    print("  ".join(c.rjust(widths[c]) for c in columns))
+    for row in rows:
+        print("  ".join(str(row.get(c, "")).rjust(widths[c]) for c in columns))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="使用本地模拟服务器运行爬取基准测试")
+    parser.add_argument("--modes", default=",".join(MODES), help=f"逗号分隔，可选{','.join(MODES)}")
+    parser.add_argument("--fixtures", type=pathlib.Path, help="fixtures目录，不指定时在工作目录中生成合成数据")
+    parser.add_argument("--workdir", type=pathlib.Path, help="临时文件目录，不指定时使用临时目录并在结束后删除")
+    parser.add_argument("--artworks", type=int, default=200, help="生成的作品数")
+    parser.add_argument("--users", type=int, default=10, help="生成的用户数")
+    parser.add_argument("--image-kb", type=int, default=256, help="生成的每页图片大小")
+    parser.add_argument("--max-artworks", type=int, default=50, help="artwork模式逐个爬取的作品数")
+    parser.add_argument("--metadata-workers", type=int, default=4)
+    parser.add_argument("--image-workers", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--bandwidth", type=int, default=0, help="每个响应的速率上限(字节/秒)")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--truncate-rate", type=float, default=0.0, help="图片响应传输中途断开的比例，用于测试断点续传")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", type=pathlib.Path, help="把结果写入json文件")
+    args = parser.parse_args()
+
+    modes = [m for m in args.modes.split(",") if m]
+    for mode in modes:
+        if mode not in MODES:
+            parser.error(f"unknown mode: {mode}")
+    workdir = args.workdir or pathlib.Path(tempfile.mkdtemp(prefix="pixiv-bench-"))
+    fixtures_root = args.fixtures or workdir / "fixtures"
+    if fixtures.exists(fixtures_root):
+        fixture_set = fixtures.load(fixtures_root)
+    else:
+        fixture_set = fixtures.generate(fixtures_root, args.artworks, args.users, args.image_kb, args.seed)
+
+    faults = fake_server.FaultConfig(args.latency, args.jitter, args.bandwidth, args.error_rate,
+                                     args.throttle_rate, truncate_rate=args.truncate_rate, seed=args.seed)
+    server = fake_server.serve(fixtures_root, faults)
+    options_kwargs = {
+        "metadata_workers": args.metadata_workers,
+        "image_workers": args.image_workers,
+        "skip_manga": False,
+    }
+    ctx = multiprocessing.get_context("spawn")
+    rows = []
+    try:
+        for mode in modes:
+            results = ctx.Queue()
+            config_path = _write_config(workdir / "runs" / mode, server.base_url)
+            process = ctx.Process(target=_run_mode, args=(
+                mode, config_path, fixture_set, options_kwargs, args.max_artworks, results))
+            process.start()
+            process.join()
+            if process.exitcode != 0:
+                rows.append({"mode": mode, "error": f"exit code {process.exitcode}"})
+                print(f"{mode} failed, see {config_path.parent / 'log.txt'}")
+                continue
+            rows.append(results.get())
+    finally:
+        server.shutdown()
+        # 有模式失败时保留临时目录以便查看日志
+        if args.workdir is None and all("error" not in row for row in rows):
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    _print_table(rows)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"faults": faults._asdict(), "options": options_kwargs, "results": rows}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
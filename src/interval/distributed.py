@@ -0,0 +1,152 @@
+"""
+分布式爬取
+
+coordinator把种子(用户、排行榜、标签等)展开成artwork id写入数据库中的任务队列，
+多个worker进程(可以在不同机器上，连接同一个数据库)从队列中领取一批artwork下载并保存，
+worker定期为正在处理的项续期，进程退出后租约过期的项会被其它worker重新领取
+
+种子格式为 类型:参数1:参数2，例如 user:13038350、rank:monthly:20240212:1、tag:ホロライブ
+"""
+import os
+import socket
+import threading
+import time
+import contextlib
+import pkg.log as log
+import pkg.pixivapi as pixiv_api
+import interval.jobqueue as jobqueue
+import interval.pixiv_crawler as pixiv_crawler
+
+
+BATCH_SIZE = 20  # worker每次领取的artwork数量
+POLL_INTERVAL = 10.0  # 队列中只剩其它worker正在处理的项时，等待多久再尝试领取
+
+
+def _artwork_ids(artworks: dict[int, pixiv_api.ArtworkInfo]) -> list[int]:
+    # 只取id，不会触发artwork详情的请求
+    return list(artworks.keys())
+
+
+def _users_artwork_ids(queue: jobqueue.CrawlJobQueue, user_ids: list[int], options: pixiv_api.ArtworkOptions) -> list[int]:
+    # 已展开过的用户不再请求作品列表，coordinator中断后重新执行时跳过
+    queue.add(jobqueue.ITEM_USER, user_ids)
+    done_ids = queue.ids(jobqueue.ITEM_USER, (jobqueue.DONE,))
+    artwork_ids = []
+    for user_id in user_ids:
+        if user_id in done_ids:
+            continue
+        user_artwork_ids = _artwork_ids(pixiv_crawler.api.get_artworks_by_userid(user_id, options))
+        queue.add(jobqueue.ITEM_ARTWORK, user_artwork_ids)
+        queue.mark(jobqueue.ITEM_USER, [user_id], jobqueue.DONE)
+        artwork_ids += user_artwork_ids
+    return artwork_ids
+
+
+def expand_seed(queue: jobqueue.CrawlJobQueue, seed: str, options: pixiv_api.ArtworkOptions) -> list[int]:
+    api = pixiv_crawler.api
+    kind, *args = seed.split(":")
+    if kind == "artwork":
+        return [int(args[0])]
+    if kind == "user":
+        return _users_artwork_ids(queue, [int(args[0])], options)
+    if kind == "similar_user":
+        return _users_artwork_ids(queue, api.get_userids_by_similar_user(int(args[0]), options), options)
+    if kind == "recommend_user":
+        return _users_artwork_ids(queue, api.get_userids_by_recommend(options), options)
+    if kind == "request_creator":
+        return _users_artwork_ids(queue, api.get_userids_by_request_creator(options), options)
+    if kind == "rank":
+        rank_type = pixiv_api.RankType[args[0].upper()]
+        return _artwork_ids(api.get_artworks_by_rank(rank_type, int(args[1]), int(args[2]) if len(args) > 2 else 1, options))
+    if kind == "tag":
+        return _artwork_ids(api.get_artworks_by_tag_popular(":".join(args), options))
+    if kind == "follow_latest":
+        return _artwork_ids(api.get_artworks_by_follow_latest(int(args[0]) if args else 1, options))
+    if kind == "bookmark":
+        return _artwork_ids(api.get_artworks_by_user_bookmark(int(args[0]), int(args[1]) if len(args) > 1 else 1, options))
+    if kind == "similar_artwork":
+        return _artwork_ids(api.get_artworks_by_similar_artwork(int(args[0]), options))
+    if kind == "recommend":
+        return _artwork_ids(api.get_artworks_by_recommend(options))
+    if kind == "request_recommend":
+        return _artwork_ids(api.get_artworks_by_request_recommend(options))
+    raise ValueError(f"unknown seed: {seed}")
+
+
+def run_coordinator(job_key: str, seeds: list[str], options: pixiv_api.ArtworkOptions | None = None) -> int:
+    """
+    展开种子并把artwork id加入任务队列，返回加入的artwork数量，可以多次执行追加种子
+    """
+    if options is None:
+        options = pixiv_api.new_filter()
+    queue = jobqueue.CrawlJobQueue(pixiv_crawler.sql, job_key)
+    total = 0
+    for seed in seeds:
+        artwork_ids = expand_seed(queue, seed, options)
+        queue.add(jobqueue.ITEM_ARTWORK, artwork_ids)
+        total += len(artwork_ids)
+        log.info(f"expand seed {seed}", job_key=job_key, artworks=len(artwork_ids))
+    log.info(f"job {job_key} seeded", artworks=total, counts=queue.counts())
+    return total
+
+
+@contextlib.contextmanager
+def _keep_lease(queue: jobqueue.CrawlJobQueue, owner: str, lease_seconds: float):
+    # 处理一批artwork的时间可能超过租约，后台定期续期
+    stop = threading.Event()
+
+    def _renew():
+        while not stop.wait(lease_seconds / 3):
+            try:
+                queue.renew(jobqueue.ITEM_ARTWORK, owner, lease_seconds)
+            except Exception as e:
+                log.warning("renew lease failed", owner=owner, error=str(e))
+
+    thread = threading.Thread(target=_renew, name="lease", daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def run_worker(
+        job_key: str,
+        options: pixiv_api.ArtworkOptions | None = None,
+        batch_size: int = BATCH_SIZE,
+        lease_seconds: float = jobqueue.LEASE_SECONDS,
+        worker_id: str | None = None) -> int:
+    """
+    循环领取并处理artwork，队列中没有未完成的项时退出，返回成功保存的artwork数量
+    """
+    if options is None:
+        options = pixiv_api.new_filter()
+    if worker_id is None:
+        worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    queue = jobqueue.CrawlJobQueue(pixiv_crawler.sql, job_key)
+    # 进度由worker自己的队列记录，每批artwork不再使用options中的job_key
+    batch_options = pixiv_api.new_filter(**{**vars(options), "job_key": None})
+    saved = 0
+    while True:
+        artwork_ids = queue.lease(jobqueue.ITEM_ARTWORK, worker_id, batch_size, lease_seconds)
+        if not artwork_ids:
+            if not queue.remaining(jobqueue.ITEM_ARTWORK):
+                break
+            time.sleep(POLL_INTERVAL)
+            continue
+        log.info(f"worker {worker_id} leased {len(artwork_ids)} artworks", job_key=job_key)
+        try:
+            with _keep_lease(queue, worker_id, lease_seconds):
+                results = pixiv_crawler.crawler_by_artwork_ids(artwork_ids, batch_options)
+        except Exception as e:
+            # 整批记为失败并立即释放，不必等租约过期；失败次数未达上限的项之后会被重新领取
+            log.error(f"worker {worker_id} batch failed", job_key=job_key, artwork_ids=artwork_ids, error=str(e))
+            queue.complete(jobqueue.ITEM_ARTWORK, worker_id, dict.fromkeys(artwork_ids, jobqueue.FAILED), str(e))
+            continue
+        queue.complete(jobqueue.ITEM_ARTWORK, worker_id, results)
+        saved += sum(1 for status in results.values() if status == jobqueue.DONE)
+    job_done = queue.finish()
+    failed = len(queue.ids(jobqueue.ITEM_ARTWORK, (jobqueue.FAILED,)))
+    log.info(f"worker {worker_id} finished", job_key=job_key, saved=saved, job_done=job_done, failed=failed)
+    return saved
@@ -0,0 +1,227 @@
+import datetime
+import pkg.pixivmodel as model
+from sqlalchemy import and_, case, func, or_, select, update
+from sqlalchemy.orm import Session, sessionmaker
+
+
+PENDING = "pending"
+RUNNING = "running"  # 进程中断时会停留在该状态，恢复时与pending一样重新处理
+DONE = "done"
+SKIPPED = "skipped"  # 不需要处理(已存在、被过滤)
+FAILED = "failed"
+
+UNFINISHED = (PENDING, RUNNING, FAILED)  # 同一job_key重新执行时需要再次处理的状态(不限失败次数)
+
+ITEM_USER = "user"
+ITEM_ARTWORK = "artwork"
+
+ID_CHUNK = 500
+LEASE_SECONDS = 600  # worker领取的项在这段时间内没有完成或续期时可被其它worker重新领取
+MAX_ATTEMPTS = 3  # 失败的项最多被领取的次数
+
+
+def _db_now(session: Session) -> datetime.datetime:
+    """
+    数据库的当前时间，租约的过期时间以它为准，不受各worker本机时钟和时区的影响
+    带时区的结果(postgresql)转为UTC后去掉时区，与lease_expire列一致
+    """
+    now = session.execute(select(func.current_timestamp())).scalar_one()
+    if now.tzinfo is not None:
+        now = now.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return now
+
+
+class CrawlJobQueue(object):
+    """
+    持久化的爬取进度，记录某个任务(job_key)中每个user/artwork的处理状态
+
+    同一job_key再次执行时跳过已完成(done/skipped)的项，
+    pending、中断时处于running的项以及failed的项会重新处理
+    """
+
+    def __init__(self, sql: sessionmaker, job_key: str):
+        self._sql = sql
+        self.job_key = job_key
+        with self._sql() as session:
+            model.upsert(session, model.CrawlJob.__table__, [{"job_key": job_key, "status": RUNNING}],
+                         ["job_key"], ["status", "sql_update_time"])
+            session.commit()
+
+    def add(self, item_type: str, item_ids: list[int]):
+        # 已存在的项保持原状态
+        with self._sql() as session:
+            for i in range(0, len(item_ids), ID_CHUNK):
+                model.upsert(session, model.CrawlJobItem.__table__, [
+                    {"job_key": self.job_key, "item_type": item_type, "item_id": item_id, "status": PENDING}
+                    for item_id in item_ids[i:i + ID_CHUNK]
+                ], ["job_key", "item_type", "item_id"], [])
+            session.commit()
+
+    def ids(self, item_type: str, statuses: tuple[str, ...]) -> set[int]:
+        with self._sql() as session:
+            rows = session.execute(
+                select(model.CrawlJobItem.item_id)
+                .where(model.CrawlJobItem.job_key == self.job_key)
+                .where(model.CrawlJobItem.item_type == item_type)
+                .where(model.CrawlJobItem.status.in_(statuses))
+            )
+            return {row[0] for row in rows}
+
+    def _visible(self, item_type: str, now: datetime.datetime, max_attempts: int):
+        # 可以被领取的项：未处理的、租约已过期的、失败次数未达上限的
+        item = model.CrawlJobItem
+        return and_(
+            item.job_key == self.job_key,
+            item.item_type == item_type,
+            or_(
+                item.status == PENDING,
+                and_(item.status == FAILED, item.attempts < max_attempts),
+                and_(item.status == RUNNING, or_(item.lease_expire.is_(None), item.lease_expire < now)),
+            ),
+        )
+
+    def lease(self, item_type: str, owner: str, limit: int,
+              lease_seconds: float = LEASE_SECONDS, max_attempts: int = MAX_ATTEMPTS) -> list[int]:
+        """
+        为owner领取最多limit个项，返回实际领取到的id
+        UPDATE时再次检查可领取条件，多个worker同时领取同一项时只有一个会成功
+        """
+        item = model.CrawlJobItem
+        with self._sql() as session:
+            now = _db_now(session)
+            candidates = [row[0] for row in session.execute(
+                select(item.item_id).where(self._visible(item_type, now, max_attempts)).order_by(item.item_id).limit(limit)
+            )]
+            if not candidates:
+                return []
+            session.execute(
+                update(item)
+                .where(self._visible(item_type, now, max_attempts))
+                .where(item.item_id.in_(candidates))
+                .values(status=RUNNING, lease_owner=owner, attempts=item.attempts + 1,
+                        lease_expire=now + datetime.timedelta(seconds=lease_seconds),
+                        sql_update_time=func.current_timestamp())
+            )
+            session.commit()
+            rows = session.execute(
+                select(item.item_id)
+                .where(item.job_key == self.job_key)
+                .where(item.item_type == item_type)
+                .where(item.item_id.in_(candidates))
+                .where(item.status == RUNNING)
+                .where(item.lease_owner == owner)
+            )
+            return sorted(row[0] for row in rows)
+
+    def renew(self, item_type: str, owner: str, lease_seconds: float = LEASE_SECONDS):
+        item = model.CrawlJobItem
+        with self._sql() as session:
+            session.execute(
+                update(item)
+                .where(item.job_key == self.job_key)
+                .where(item.item_type == item_type)
+                .where(item.status == RUNNING)
+                .where(item.lease_owner == owner)
+                .values(lease_expire=_db_now(session) + datetime.timedelta(seconds=lease_seconds))
+            )
+            session.commit()
+
+    def complete(self, item_type: str, owner: str, results: dict[int, str], error: str = ""):
+        # 只更新仍由owner持有的项，租约过期后已被其它worker领取的项由新的owner负责
+        item = model.CrawlJobItem
+        by_status: dict[str, list[int]] = {}
+        for item_id, status in results.items():
+            by_status.setdefault(status, []).append(item_id)
+        with self._sql() as session:
+            for status, item_ids in by_status.items():
+                for i in range(0, len(item_ids), ID_CHUNK):
+                    session.execute(
+                        update(item)
+                        .where(item.job_key == self.job_key)
+                        .where(item.item_type == item_type)
+                        .where(item.lease_owner == owner)
+                        .where(item.item_id.in_(item_ids[i:i + ID_CHUNK]))
+                        .values(status=status, lease_owner=None, lease_expire=None, error=error[:256] or None,
+                                sql_update_time=func.current_timestamp())
+                    )
+            session.commit()
+
+    @staticmethod
+    def _unfinished(max_attempts: int):
+        # 还没有最终结果的项：未处理的、正在处理的、失败次数未达上限(还会被重新领取)的
+        item = model.CrawlJobItem
+        return or_(
+            item.status.in_((PENDING, RUNNING)),
+            and_(item.status == FAILED, item.attempts < max_attempts),
+        )
+
+    def remaining(self, item_type: str, max_attempts: int = MAX_ATTEMPTS) -> int:
+        # 还没有最终结果的项数(包括其它worker正在处理的)
+        item = model.CrawlJobItem
+        with self._sql() as session:
+            return session.execute(
+                select(func.count())
+                .where(item.job_key == self.job_key)
+                .where(item.item_type == item_type)
+                .where(self._unfinished(max_attempts))
+            ).scalar_one()
+
+    def mark(self, item_type: str, item_ids: list[int], status: str, error: str = ""):
+        values = {"status": status, "error": error[:256] or None, "sql_update_time": func.current_timestamp()}
+        if status == RUNNING:
+            values["attempts"] = model.CrawlJobItem.attempts + 1
+        with self._sql() as session:
+            for i in range(0, len(item_ids), ID_CHUNK):
+                session.execute(
+                    update(model.CrawlJobItem)
+                    .where(model.CrawlJobItem.job_key == self.job_key)
+                    .where(model.CrawlJobItem.item_type == item_type)
+                    .where(model.CrawlJobItem.item_id.in_(item_ids[i:i + ID_CHUNK]))
+                    .values(values)
+                )
+            session.commit()
+
+    def mark_results(self, item_type: str, results: dict[int, str]):
+        by_status: dict[str, list[int]] = {}
+        for item_id, status in results.items():
+            by_status.setdefault(status, []).append(item_id)
+        for status, item_ids in by_status.items():
+            self.mark(item_type, item_ids, status)
+
+    def counts(self) -> dict[str, dict[str, int]]:
+        with self._sql() as session:
+            rows = session.execute(
+                select(model.CrawlJobItem.item_type, model.CrawlJobItem.status, func.count())
+                .where(model.CrawlJobItem.job_key == self.job_key)
+                .group_by(model.CrawlJobItem.item_type, model.CrawlJobItem.status)
+            )
+            counts: dict[str, dict[str, int]] = {}
+            for item_type, status, cnt in rows:
+                counts.setdefault(item_type, {})[status] = cnt
+            return counts
+
+    def finish(self, max_attempts: int = MAX_ATTEMPTS) -> bool:
+        """
+        所有项都有最终结果时结束任务，返回任务是否已结束
+        失败次数达到上限的项不会再被领取，视为最终结果；有这样的项时任务标记为failed，否则为done
+        """
+        item = model.CrawlJobItem
+        with self._sql() as session:
+            # mysql不支持count(*) FILTER，用sum(case)统计
+            unfinished, failed = session.execute(
+                select(
+                    func.coalesce(func.sum(case((self._unfinished(max_attempts), 1), else_=0)), 0),
+                    func.coalesce(func.sum(case((item.status == FAILED, 1), else_=0)), 0),
+                ).where(item.job_key == self.job_key)
+            ).one()
+            if unfinished:
+                status = RUNNING
+            else:
+                status = FAILED if failed else DONE
+            session.execute(
+                update(model.CrawlJob)
+                .where(model.CrawlJob.job_key == self.job_key)
+                .values(status=status, sql_update_time=func.current_timestamp())
+            )
+            session.commit()
+        return not unfinished
@@ -0,0 +1,186 @@
+import pkg.log as log
+import pkg.metrics as metrics
+import pkg.profiling as profiling
+import pkg.pixivapi as pixiv_api
+import pkg.pixivmodel as model
+import interval.storage as storage
+import threading
+import time
+from sqlalchemy import delete, select
+from sqlalchemy.orm import Session, sessionmaker
+
+
+BATCH_SIZE = 200  # 攒够多少个artwork写一次数据库
+FLUSH_INTERVAL = 10.0  # 距上次写入超过多少秒时即使没攒够也写入
+TAG_QUERY_CHUNK = 500
+
+_write_latency = metrics.histogram("db_write_seconds", "一批artwork写入数据库(含提交)的耗时")
+_written = metrics.counter("db_written_artworks_total", "写入数据库的artwork数，失败的status为failed")
+
+_ARTWORK_UPDATE_COLUMNS = [
+    c.key for c in model.Artwork.__table__.c
+    if c.key not in ("illustid", "sql_create_time")
+]
+
+
+def page_rows(artwork_id: int, pages: list[storage.ImagePage]) -> list[dict]:
+    return [
+        {"illustid": artwork_id, "page": page.idx, "format": page.format, "filesize": page.size}
+        for page in pages
+    ]
+
+
+def _frame_rows(artwork_id: int, frames: list[pixiv_api.UgoiraFrame]) -> list[dict]:
+    return [
+        {"illustid": artwork_id, "frame": idx, "file": frame.file, "delay": frame.delay}
+        for idx, frame in enumerate(frames)
+    ]
+
+
+def _artwork_row(artwork_info: pixiv_api.ArtworkInfo, file_size: int) -> dict:
+    return {
+        "illustid": artwork_info.artwork_id,
+        "userid": artwork_info.user_id,
+        "illust_type": artwork_info.artwork_type.value,
+        "title": artwork_info.title,
+        "nums": artwork_info.nums,
+        "restrict": artwork_info.restrict.value,
+        "description": artwork_info.desc,
+        "bookmark_cnt": artwork_info.bookmark_cnt,
+        "like_cnt": artwork_info.like_cnt,
+        "comment_cnt": artwork_info.comment_cnt,
+        "view_cnt": artwork_info.view_cnt,
+        "create_time": artwork_info.create_time,
+        "upload_time": artwork_info.upload_time,
+        "height": artwork_info.height,
+        "width": artwork_info.width,
+        "filesize": file_size,
+    }
+
+
+class ArtworkWriter(object):
+    """
+    延迟批量写入artwork
+
+    add()只把artwork放入缓冲区，缓冲区达到batch_size或距上次写入超过flush_interval时，
+    在一个事务中批量写入user、tag、illust、illust_page、ugoira_frame以及illust_tag；tag名到tagid的映射缓存在进程内，
+    tag按名称upsert，多个进程同时写入同一个新tag时不会产生重复的行。
+    某一批写入失败时逐个重试以定位出错的artwork，失败的artwork id记录在failed中，
+    由调用方通过pop_failed()取出处理
+    """
+
+    def __init__(self, sql: sessionmaker, batch_size: int = BATCH_SIZE, flush_interval: float = FLUSH_INTERVAL):
+        self._sql = sql
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._pending: list[tuple[pixiv_api.ArtworkInfo, list[storage.ImagePage], list[pixiv_api.UgoiraFrame]]] = []
+        self._last_flush = time.monotonic()
+        self._tag_ids: dict[str, int] = {}
+        self._failed: dict[int, Exception] = {}
+
+    def add(self, artwork_info: pixiv_api.ArtworkInfo, pages: list[storage.ImagePage],
+            frames: list[pixiv_api.UgoiraFrame] | None = None):
+        # frames为动图每帧的延迟
+        with self._lock:
+            self._pending.append((artwork_info, pages, frames or []))
+            if len(self._pending) < self._batch_size and time.monotonic() - self._last_flush < self._flush_interval:
+                return
+            self._flush()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def pop_failed(self) -> dict[int, Exception]:
+        # 返回写入失败的artwork id及异常，并清空记录
+        with self._lock:
+            failed, self._failed = self._failed, {}
+        return failed
+
+    def _flush(self):
+        batch, self._pending = self._pending, []
+        self._last_flush = time.monotonic()
+        if not batch:
+            return
+        try:
+            self._timed_write(batch)
+            return
+        except Exception as e:
+            if len(batch) == 1:
+                self._failed[batch[0][0].artwork_id] = e
+                _written.inc(status="failed")
+                return
+            log.warning(f"write {len(batch)} artworks failed, retry one by one", error=str(e))
+        for item in batch:
+            try:
+                self._timed_write([item])
+            except Exception as e:
+                self._failed[item[0].artwork_id] = e
+                _written.inc(status="failed")
+
+    def _timed_write(self, batch: list[tuple[pixiv_api.ArtworkInfo, list[storage.ImagePage], list[pixiv_api.UgoiraFrame]]]):
+        with _write_latency.time(), profiling.section("db:write"):
+            self._write(batch)
+        _written.inc(len(batch), status="ok")
+
+    def _write(self, batch: list[tuple[pixiv_api.ArtworkInfo, list[storage.ImagePage], list[pixiv_api.UgoiraFrame]]]):
+        with self._sql() as session:
+            tag_ids = self._resolve_tag_ids(session, batch)
+
+            users = {a.user_id: {"userid": a.user_id, "username": a.user_name} for a, _, _ in batch}
+            model.upsert(session, model.User.__table__, list(users.values()),
+                         ["userid"], ["username", "sql_update_time"])
+
+            artworks = {a.artwork_id: _artwork_row(a, sum(page.size for page in pages)) for a, pages, _ in batch}
+            model.upsert(session, model.Artwork.__table__, list(artworks.values()),
+                         ["illustid"], _ARTWORK_UPDATE_COLUMNS)
+            model.upsert(session, model.ArtworkPage.__table__,
+                         [row for a, pages, _ in batch for row in page_rows(a.artwork_id, pages)],
+                         ["illustid", "page"], ["format", "filesize", "sql_update_time"])
+            model.upsert(session, model.UgoiraFrame.__table__,
+                         [row for a, _, frames in batch for row in _frame_rows(a.artwork_id, frames)],
+                         ["illustid", "frame"], ["file", "delay", "sql_update_time"])
+
+            # 与merge一致，更新时以本次的tag为准
+            session.execute(delete(model.ArtworkTag).where(model.ArtworkTag.c.illustid.in_(artworks.keys())))
+            links = {
+                (tag_ids[tag.name], a.artwork_id)
+                for a, _, _ in batch
+                for tag in a.tags
+            }
+            model.upsert(session, model.ArtworkTag,
+                         [{"tagid": tag_id, "illustid": artwork_id} for tag_id, artwork_id in links],
+                         ["tagid", "illustid"], [])
+            session.commit()
+        # 提交成功后才缓存新插入的tag，避免回滚后缓存了不存在的tagid
+        self._tag_ids.update(tag_ids)
+
+    def _resolve_tag_ids(self, session: Session, batch: list[tuple[pixiv_api.ArtworkInfo, list[storage.ImagePage], list[pixiv_api.UgoiraFrame]]]) -> dict[str, int]:
+        tags: dict[str, pixiv_api.ArtworkTag] = {}
+        for artwork_info, _, _ in batch:
+            for tag in artwork_info.tags:
+                tags.setdefault(tag.name, tag)
+        tag_ids = {name: self._tag_ids[name] for name in tags if name in self._tag_ids}
+
+        missing = [name for name in tags if name not in tag_ids]
+        tag_ids.update(self._query_tag_ids(session, missing))
+        missing = [name for name in missing if name not in tag_ids]
+        if missing:
+            model.upsert(session, model.Tag.__table__, [
+                {"tagname": name, "tagtransname": tags[name].translation}
+                for name in missing
+            ], ["tagname"], [])
+            tag_ids.update(self._query_tag_ids(session, missing))
+        return tag_ids
+
+    @staticmethod
+    def _query_tag_ids(session: Session, names: list[str]) -> dict[str, int]:
+        tag_ids: dict[str, int] = {}
+        for i in range(0, len(names), TAG_QUERY_CHUNK):
+            rows = session.execute(
+                select(model.Tag.name, model.Tag.tag_id)
+                .where(model.Tag.name.in_(names[i:i + TAG_QUERY_CHUNK]))
+            )
+            tag_ids.update(rows.all())
+        return tag_ids
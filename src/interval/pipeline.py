@@ -0,0 +1,155 @@
+"""
+多阶段流水线
+
+每个阶段有独立的线程数和有界输入队列，下游处理不过来时队列写满，上游阶段阻塞等待(背压)，
+这样数据库提交慢只会让下载阶段暂停，不会让所有线程都卡在同一个函数里
+"""
+import queue
+import threading
+import time
+from typing import Any, Callable, Iterable
+import pkg.log as log
+import pkg.profiling as profiling
+
+
+_END = object()  # 通知阶段的worker退出
+
+
+class Stage(object):
+    """
+    handler处理一项并返回交给下一阶段的项，返回None表示该项在此阶段结束(如被过滤)
+    """
+
+    def __init__(self, name: str, handler: Callable[[Any], Any], workers: int = 1, queue_size: int = 16):
+        self.name = name
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.queue: queue.Queue = queue.Queue(max(1, queue_size))
+        self._lock = threading.Lock()
+        self.processed = 0
+        self.dropped = 0
+        self.failed = 0
+        self.busy = 0.0  # 所有worker处理耗时之和
+        self.max_depth = 0
+
+    def put(self, item):
+        self.queue.put(item)
+        depth = self.queue.qsize()
+        if depth > self.max_depth:
+            self.max_depth = depth
+
+    def _record(self, elapsed: float, result, failed: bool):
+        with self._lock:
+            self.busy += elapsed
+            if failed:
+                self.failed += 1
+            elif result is None:
+                self.dropped += 1
+            else:
+                self.processed += 1
+
+    def stats(self, elapsed: float) -> dict:
+        with self._lock:
+            done = self.processed + self.dropped + self.failed
+            return {
+                "workers": self.workers,
+                "queue": self.queue.qsize(),
+                "max_queue": self.max_depth,
+                "processed": self.processed,
+                "dropped": self.dropped,
+                "failed": self.failed,
+                "throughput": round(done / elapsed, 2) if elapsed > 0 else 0.0,  # 每秒处理的项数
+                "utilization": round(self.busy / (elapsed * self.workers), 2) if elapsed > 0 else 0.0,
+            }
+
+
+class Pipeline(object):
+    """
+    on_finish(item, completed): 项离开流水线时调用，completed表示是否经过了所有阶段
+    on_error(item, e): 某阶段抛出异常时调用，返回False时停止流水线，不再处理剩余的项
+    回调本身抛出异常时同样停止流水线(worker继续取出剩余的项，上游不会阻塞)，run()结束时抛出该异常
+    """
+
+    def __init__(self, stages: list[Stage], on_finish: Callable[[Any, bool], None],
+                 on_error: Callable[[Any, Exception], bool]):
+        self.stages = stages
+        self._on_finish = on_finish
+        self._on_error = on_error
+        self._stop = threading.Event()
+        self._callback_lock = threading.Lock()
+        self._callback_error: Exception | None = None
+        self._started = 0.0
+        self._finished = 0.0
+
+    @property
+    def stopped(self) -> bool:
+        return self._stop.is_set()
+
+    def _callback(self, callback: Callable, item, arg) -> bool:
+        # 返回回调的结果，回调出错时返回False
+        with self._callback_lock:
+            try:
+                return callback(item, arg)
+            except Exception as e:
+                log.error(f"pipeline callback {callback.__name__} failed", error=str(e))
+                if self._callback_error is None:
+                    self._callback_error = e
+                self._stop.set()
+                return False
+
+    def _work(self, idx: int):
+        stage = self.stages[idx]
+        next_stage = self.stages[idx + 1] if idx + 1 < len(self.stages) else None
+        while True:
+            item = stage.queue.get()
+            if item is _END:
+                return
+            if self._stop.is_set():
+                # 停止后只取出剩余的项，让上游不再阻塞
+                continue
+            start = time.monotonic()
+            try:
+                with profiling.section(f"stage:{stage.name}"):
+                    result = stage.handler(item)
+            except Exception as e:
+                stage._record(time.monotonic() - start, None, True)
+                if not self._callback(self._on_error, item, e):
+                    self._stop.set()
+                continue
+            stage._record(time.monotonic() - start, result, False)
+            if result is None or next_stage is None:
+                self._callback(self._on_finish, item if result is None else result, result is not None)
+                continue
+            next_stage.put(result)
+
+    def run(self, items: Iterable):
+        self._started = time.monotonic()
+        threads = [
+            [
+                threading.Thread(target=self._work, args=(idx,), name=f"{stage.name}-{i}", daemon=True)
+                for i in range(stage.workers)
+            ]
+            for idx, stage in enumerate(self.stages)
+        ]
+        for stage_threads in threads:
+            for thread in stage_threads:
+                thread.start()
+        try:
+            for item in items:
+                if self._stop.is_set():
+                    break
+                self.stages[0].put(item)
+        finally:
+            # 按顺序关闭各阶段，上一阶段的worker全部退出后下一阶段才不会再有新的项
+            for stage, stage_threads in zip(self.stages, threads):
+                for _ in stage_threads:
+                    stage.queue.put(_END)
+                for thread in stage_threads:
+                    thread.join()
+            self._finished = time.monotonic()
+        if self._callback_error is not None:
+            raise self._callback_error
+
+    def stats(self) -> dict[str, dict]:
+        elapsed = (self._finished or time.monotonic()) - self._started
+        return {stage.name: stage.stats(elapsed) for stage in self.stages}
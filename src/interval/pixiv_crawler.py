@@ -2,78 +2,197 @@ import pkg.log as log
 import pkg.pixivapi as pixiv_api
 import pkg.pixivmodel as model
 import pkg.cfg as cfg
+import pkg.metrics as metrics
+import pkg.profiling as profiling
+import interval.persist as persist
+import interval.jobqueue as jobqueue
+import interval.storage as storage
+import interval.ugoira as ugoira
+import interval.pipeline as pipeline
 import yaml
+import asyncio
+import contextlib
+import datetime
+import functools
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed, wait
 from pathlib import Path
+from typing import Iterator
 
 
 config = cfg.get_pixiv_config()
+log.configure(level=config.log_level, max_bytes=config.log_max_mb * 1024 * 1024)
+profiling.configure(
+    dir=config.profiling.get("dir"),
+    sample_rate=config.profiling.get("sample_rate"),
+    trace_malloc=config.profiling.get("tracemalloc"),
+    top=config.profiling.get("top"),
+)
 
 
-api = pixiv_api.new_pixiv_api(pixiv_api.ApiMetaArgument(
+api_meta = pixiv_api.ApiMetaArgument(
     PHPSESSID=config.phpsessid,
-    PROXY=config.proxy
-))
+    PROXY=config.proxy,
+    CACHE_PATH=config.cache_path,
+    CACHE_MAX_BYTES=config.cache_max_mb * 1024 * 1024,
+    AJAX_RATE=config.ajax_rate,
+    IMAGE_RATE=config.image_rate,
+    TRANSPORT=pixiv_api.TransportConfig(**config.transport),
+    PHPSESSIDS=tuple(config.session_ids),
+    PROXIES=tuple(config.proxies),
+    SCHEDULE=config.schedule,
+)
+api = pixiv_api.new_pixiv_api(api_meta)
+# 配置async_metadata时用异步实现并发获取每批artwork的详情，在后台线程的事件循环中执行
+async_api = pixiv_api.new_pixiv_api(api_meta, use_async=True) if config.async_metadata else None
+_async_loop: asyncio.AbstractEventLoop | None = None
+_async_loop_lock = threading.Lock()
 sql = model.new_session(config.sql_url)
-
-
-def _new_artwork(
+writer = persist.ArtworkWriter(sql)
+image_store = storage.new_storage(config.storage, config.file_path)
+EXIST_QUERY_CHUNK = 500  # 批量检查artwork是否存在时每条IN查询的id数量
+CHECKPOINT_SIZE = 100  # 使用job_key时每处理多少个artwork保存一次进度
+_transcodes: set[Future] = set()  # 进行中的动图转换
+_transcodes_lock = threading.Lock()
+RANK_WORKERS = 8  # 回填排行榜时同时获取的(日期, 榜单)数量
+PIPELINE_QUEUE_SIZE = 16  # 流水线各阶段之间默认的队列长度，队列满时上游阶段等待
+_last_pipeline: pipeline.Pipeline | None = None
+
+_download_latency = metrics.histogram("crawler_download_seconds", "下载一个artwork全部图片的耗时")
+_downloaded_bytes = metrics.counter("crawler_downloaded_bytes_total", "已保存的图片字节数(含之前已下载的)")
+_downloaded_images = metrics.counter("crawler_downloaded_images_total", "已保存的图片数(含之前已下载的)")
+_exist_check_latency = metrics.histogram("crawler_exist_check_seconds", "批量检查artwork是否已存在的耗时")
+_artwork_results = metrics.counter("crawler_artworks_total", "按结果(jobqueue中的状态)统计的artwork数")
+_summary_depth = threading.local()
+
+
+def _get_filepath(artwork_id: int, idx: int, suffix: str = storage.DEFAULT_SUFFIX) -> Path:
+    return image_store.path(artwork_id, idx, suffix)
+
+
+def _download_image(url: str, artwork_id: int, idx: int) -> storage.ImagePage:
+    # 扩展名取自url，已下载过的图片(任意扩展名)直接返回
+    suffix = storage.suffix_from_url(url)
+    file_path = image_store.find(artwork_id, idx, suffix)
+    if file_path is not None:
+        return storage.ImagePage(idx, file_path.suffix[1:], file_path.stat().st_size)
+    return image_store.store(artwork_id, idx, suffix, lambda path: api.download_image(url, path))
+
+
+def _download_artwork(artwork_info: pixiv_api.ArtworkInfo) -> list[storage.ImagePage]:
+    return [
+        _download_image(url, artwork_info.artwork_id, idx)
+        for idx, url in enumerate(artwork_info.image_download_urls)
+    ]
+
+
+def _transcode_ugoira(artwork_id: int, zip_page: storage.ImagePage, frames: list[pixiv_api.UgoiraFrame],
+                      options: pixiv_api.ArtworkOptions):
+    out_path = image_store.animation_path(artwork_id, f".{options.ugoira_format}")
+    if out_path.exists():
+        return
+    zip_path = _get_filepath(artwork_id, zip_page.idx, f".{zip_page.format}")
+    future = ugoira.submit(zip_path, [(frame.file, frame.delay) for frame in frames], out_path,
+                           options.ugoira_format, options.transcode_workers)
+    with _transcodes_lock:
+        _transcodes.add(future)
+
+
+def _wait_transcodes():
+    # 动图转换失败不影响artwork本身，只记录日志
+    with _transcodes_lock:
+        futures = list(_transcodes)
+        _transcodes.clear()
+    if not futures:
+        return
+    log.info(f"waiting for {len(futures)} ugoira transcodes")
+    wait(futures)
+    for future in futures:
+        if future.exception() is not None:
+            log.error("transcode ugoira failed", error=str(future.exception()))
+
+
+def _download_ugoira(
         artwork_info: pixiv_api.ArtworkInfo,
-        tags: list[pixiv_api.ArtworkTag],
-        file_size: int) -> model.Artwork:
-    return model.Artwork(
-        artwork_id=artwork_info.artwork_id,
-        user_id=artwork_info.user_id,
-        artwork_type=artwork_info.artwork_type.value,
-        title=artwork_info.title,
-        nums=artwork_info.nums,
-        restrict=artwork_info.restrict.value,
-        description=artwork_info.desc,
-        bookmark_cnt=artwork_info.bookmark_cnt,
-        like_cnt=artwork_info.like_cnt,
-        comment_cnt=artwork_info.comment_cnt,
-        view_cnt=artwork_info.view_cnt,
-        create_time=artwork_info.create_time,
-        upload_time=artwork_info.upload_time,
-        height=artwork_info.height,
-        width=artwork_info.width,
-        file_size=file_size,
-        tags=tags
-    )
+        options: pixiv_api.ArtworkOptions) -> tuple[list[storage.ImagePage], list[pixiv_api.UgoiraFrame]]:
+    # 动图的原始数据是一个帧zip，作为第0页流式下载到磁盘
+    meta = api.get_ugoira_meta(artwork_info.artwork_id)
+    page = _download_image(meta.original_src, artwork_info.artwork_id, 0)
+    if options.ugoira_format:
+        _transcode_ugoira(artwork_info.artwork_id, page, meta.frames, options)
+    return [page], meta.frames
 
 
-def _get_filepath(artwork_id: int, idx: int) -> Path:
-    return config.file_path / f"{artwork_id}_{idx}.jpg"
+def _is_artwork_exist(artwork_id: int) -> bool:
+    return artwork_id in _filter_exist_artworks([artwork_id])
 
 
-def _download_artwork(artwork_info: pixiv_api.ArtworkInfo) -> int:
-    total_file_size = 0
-    for idx, url in enumerate(artwork_info.image_download_urls):
-        file_path = _get_filepath(artwork_info.artwork_id, idx)
-        if file_path.exists() and file_path.stat().st_size > 0:
-            total_file_size += file_path.stat().st_size
-            continue
-        content = api.get_image(url)
-        total_file_size += len(content)
-        with file_path.open('wb+') as f:
-            f.write(content)
-    return total_file_size
+def _filter_exist_artworks(artwork_ids: list[int]) -> set[int]:
+    with _exist_check_latency.time(), profiling.section("db:exist_check"):
+        return _query_exist_artworks(artwork_ids)
 
 
-def _is_artwork_exist(artwork_id: int) -> bool:
+def _query_exist_artworks(artwork_ids: list[int]) -> set[int]:
+    # _is_artwork_exist的批量版本，分块IN查询数据库，再扫描涉及到的目录，返回已完整下载的artwork id
+    artwork_nums: dict[int, int] = {}
     with sql() as session:
-        artwork_record = session.query(model.Artwork).filter_by(artwork_id=artwork_id).first()
-        if not artwork_record:
-            return False
-    for idx in range(artwork_record.nums):
-        file_path = _get_filepath(artwork_id, idx)
-        if not file_path.exists() or file_path.stat().st_size <= 0:
-            return False
-    return True
+        for i in range(0, len(artwork_ids), EXIST_QUERY_CHUNK):
+            rows = session.query(model.Artwork.artwork_id, model.Artwork.nums).filter(
+                model.Artwork.artwork_id.in_(artwork_ids[i:i + EXIST_QUERY_CHUNK])
+            )
+            artwork_nums.update(rows)
+    if not artwork_nums:
+        return set()
+
+    downloaded = image_store.existing(
+        (artwork_id, idx)
+        for artwork_id, nums in artwork_nums.items()
+        for idx in range(nums)
+    )
+    return {
+        artwork_id
+        for artwork_id, nums in artwork_nums.items()
+        if all((artwork_id, idx) in downloaded for idx in range(nums))
+    }
+
+
+def fix_image_suffixes() -> int:
+    """
+    根据文件头修正已下载图片的扩展名，并为已入库的artwork补充illust_page记录，返回改名的文件数
+    """
+    renamed_cnt = 0
+    batch: list[tuple[int, storage.ImagePage]] = []
+
+    def _save_pages():
+        artwork_ids = list({artwork_id for artwork_id, _ in batch})
+        with sql() as session:
+            saved_ids = {row[0] for row in session.query(model.Artwork.artwork_id).filter(
+                model.Artwork.artwork_id.in_(artwork_ids)
+            )}
+            model.upsert(session, model.ArtworkPage.__table__, [
+                row for artwork_id, page in batch if artwork_id in saved_ids
+                for row in persist.page_rows(artwork_id, [page])
+            ], ["illustid", "page"], ["format", "filesize", "sql_update_time"])
+            session.commit()
+        batch.clear()
+
+    for artwork_id, page, renamed in storage.fix_suffixes(image_store):
+        renamed_cnt += renamed
+        batch.append((artwork_id, page))
+        if len(batch) >= EXIST_QUERY_CHUNK:
+            _save_pages()
+    if batch:
+        _save_pages()
+    log.info("fix image suffixes finished", renamed=renamed_cnt)
+    return renamed_cnt
 
 
 def _crawler_by_artwork_info(
         artwork_info: pixiv_api.ArtworkInfo,
-        options: pixiv_api.ArtworkOptions | None = None) -> bool:
+        options: pixiv_api.ArtworkOptions | None = None,
+        check_exist: bool = True) -> bool:
     if options is None:
         options = pixiv_api.new_filter()
 
@@ -82,85 +201,416 @@ def _crawler_by_artwork_info(
         log.info(f"artwork {artwork_info.artwork_id} is invalid, reason: {invalid_reason}")
         return False
 
-    if _is_artwork_exist(artwork_info.artwork_id):
+    if check_exist and _is_artwork_exist(artwork_info.artwork_id):
         if not options.update:
             log.info(f"artwork {artwork_info.artwork_id} already exist")
             return False
-    # 爬取图片
-    total_file_size = _download_artwork(artwork_info)
-    # 存数据库
-    with sql() as session:
-        tags = []
-        for tag in artwork_info.tags:
-            tag_record = session.query(model.Tag).filter_by(name=tag.name).first()
-            if tag_record is None:
-                tags.append(model.Tag(name=tag.name, trans_name=tag.translation))
-            else:
-                tags.append(tag_record)
-        user = model.User(user_id=artwork_info.user_id, user_name=artwork_info.user_name)
-        artwork = _new_artwork(artwork_info, tags, total_file_size)
-        session.merge(user)
-        session.merge(artwork)  # 会自动插入不存在的tag
-        session.commit()
+    # 与流水线的下载、入库阶段相同，只是在当前线程中执行
+    task = _download_stage(_ArtworkTask(artwork_info.artwork_id, artwork_info), options)
+    _persist_stage(task)
     return True
 
 
+def _flush_writer() -> dict[int, Exception]:
+    # 写入缓冲区中剩余的artwork，返回写入失败的artwork及其异常，由调用方决定是否抛出
+    writer.flush()
+    failed = writer.pop_failed()
+    for artwork_id, e in failed.items():
+        log.error(f"save artwork {artwork_id} failed", error=str(e))
+    return failed
+
+
+def _log_saved(artwork_info: pixiv_api.ArtworkInfo):
+    log.info(
+        f"save artwork {artwork_info.artwork_id} to database",
+        title=artwork_info.title,
+        tags=[tag.name for tag in artwork_info.tags],
+        user=f"{artwork_info.user_name}({artwork_info.user_id})",
+        nums=artwork_info.nums
+    )
+
+
+def _run_async(coro):
+    # 在后台事件循环中执行协程并等待结果，事件循环在第一次使用时启动
+    global _async_loop
+    with _async_loop_lock:
+        if _async_loop is None:
+            _async_loop = asyncio.new_event_loop()
+            threading.Thread(target=_async_loop.run_forever, name="async-api", daemon=True).start()
+    return asyncio.run_coroutine_threadsafe(coro, _async_loop).result()
+
+
+def _load_artworks_async(
+        artworks_info: dict[int, pixiv_api.ArtworkInfo],
+        options: pixiv_api.ArtworkOptions) -> dict[int, pixiv_api.ArtworkInfo]:
+    """
+    用异步实现并发获取尚未获取的artwork详情，替换artworks_info中对应的项
+    获取失败的artwork与同步实现一样在访问属性时抛出异常，由流水线的获取信息阶段处理
+    """
+    artwork_ids = [i for i, info in artworks_info.items() if not info.loaded]
+    if not artwork_ids:
+        return artworks_info
+
+    async def _load():
+        loaded = await async_api.get_artworks_by_ids(artwork_ids, options)
+        await async_api.load_artworks(loaded)
+        return loaded
+
+    with profiling.section("async:load_artworks"):
+        return {**artworks_info, **_run_async(_load())}
+
+
+class _ArtworkTask(object):
+    # 在流水线各阶段之间传递的artwork
+    __slots__ = ("artwork_id", "artwork_info", "pages", "frames")
+
+    def __init__(self, artwork_id: int, artwork_info: pixiv_api.ArtworkInfo):
+        self.artwork_id = artwork_id
+        self.artwork_info = artwork_info
+        self.pages: list[storage.ImagePage] = []
+        self.frames: list[pixiv_api.UgoiraFrame] | None = None
+
+
+def _fetch_stage(task: _ArtworkTask) -> _ArtworkTask:
+    # 访问任一属性即获取artwork信息
+    _ = task.artwork_info.artwork_type
+    return task
+
+
+def _filter_stage(task: _ArtworkTask, options: pixiv_api.ArtworkOptions) -> _ArtworkTask | None:
+    # 已存在的artwork在_run_artworks中已批量过滤
+    invalid_reason = options.valid_by_artwork_info(task.artwork_info)
+    if invalid_reason:
+        log.info(f"artwork {task.artwork_id} is invalid, reason: {invalid_reason}")
+        return None
+    return task
+
+
+def _download_stage(task: _ArtworkTask, options: pixiv_api.ArtworkOptions) -> _ArtworkTask:
+    with _download_latency.time():
+        if task.artwork_info.artwork_type == pixiv_api.ArtworkType.UGORIA:
+            task.pages, task.frames = _download_ugoira(task.artwork_info, options)
+        else:
+            task.pages = _download_artwork(task.artwork_info)
+    _downloaded_images.inc(len(task.pages))
+    _downloaded_bytes.inc(sum(page.size for page in task.pages))
+    return task
+
+
+def _persist_stage(task: _ArtworkTask) -> _ArtworkTask:
+    # 存数据库(批量延迟写入，见_flush_writer)
+    writer.add(task.artwork_info, task.pages, task.frames)
+    return task
+
+
+def _new_pipeline(options: pixiv_api.ArtworkOptions, on_finish, on_error) -> pipeline.Pipeline:
+    """
+    获取信息 -> 过滤 -> 下载 -> 入库，各阶段的线程数分别为metadata_workers(不小于prefetch_window)、
+    filter_workers、image_workers、persist_workers，队列长度为stage_queue_size
+    过滤与入库(只是放入writer的缓冲区)都很快，默认单线程即可
+    """
+    queue_size = options.stage_queue_size or PIPELINE_QUEUE_SIZE
+    return pipeline.Pipeline([
+        pipeline.Stage("fetch", _fetch_stage, max(options.metadata_workers, options.prefetch_window), queue_size),
+        pipeline.Stage("filter", lambda task: _filter_stage(task, options), options.filter_workers, queue_size),
+        pipeline.Stage("download", lambda task: _download_stage(task, options), options.image_workers, queue_size),
+        pipeline.Stage("persist", _persist_stage, options.persist_workers, queue_size),
+    ], on_finish, on_error)
+
+
+def pipeline_stats() -> dict[str, dict]:
+    # 正在运行(或最近一次)的流水线各阶段的队列长度、处理数量、吞吐量(每秒)等
+    return _last_pipeline.stats() if _last_pipeline is not None else {}
+
+
+def _collect_pipeline() -> Iterator[metrics.Sample]:
+    for stage, stats in pipeline_stats().items():
+        for key in ("queue", "max_queue", "throughput", "utilization"):
+            yield f"crawler_pipeline_{key}", {"stage": stage}, stats[key]
+
+
+def _collect_identities() -> Iterator[metrics.Sample]:
+    for stats in api.identity_stats():
+        yield "pixiv_identity_inflight", {"identity": stats["name"]}, stats["inflight"]
+        yield "pixiv_identity_cooling_seconds", {"identity": stats["name"]}, stats["cooling"]
+        for origin, pool in stats["transport"].items():
+            yield "pixiv_pool_connections", {"identity": stats["name"], "origin": origin}, pool["connections"]
+            yield "pixiv_pool_reused", {"identity": stats["name"], "origin": origin}, pool["reused"]
+
+
+def _collect_cache() -> Iterator[metrics.Sample]:
+    stats = api.cache_stats()
+    if stats:
+        yield "pixiv_cache_entries", {}, stats["entries"]
+        yield "pixiv_cache_bytes", {}, stats["bytes"]
+
+
+metrics.register_collector(_collect_pipeline)
+metrics.register_collector(_collect_identities)
+metrics.register_collector(_collect_cache)
+
+
+def start_metrics_exporters():
+    """
+    按配置中的metrics启动导出: prometheus_port非0时提供http://host:port/metrics，
+    json_path非空时每隔json_interval秒写入一次快照，json_path中的{pid}替换为进程id
+    """
+    metrics_config = config.metrics
+    port = metrics_config.get("prometheus_port", 0)
+    if port:
+        try:
+            metrics.serve_prometheus(port)
+        except OSError as e:
+            # 同一台机器上的多个worker进程只有一个能监听该端口
+            log.warning(f"serve metrics on port {port} failed", error=str(e))
+    json_path = metrics_config.get("json_path", "")
+    if json_path:
+        metrics.write_snapshots(json_path.format(pid=os.getpid()),
+                                metrics_config.get("json_interval", metrics.SNAPSHOT_INTERVAL))
+
+
+def _job_summary(func):
+    # 最外层的crawler_by_*结束时输出本次调用期间各指标的增量，嵌套调用不重复输出；按配置抽样进行性能分析
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if getattr(_summary_depth, "active", False):
+            return func(*args, **kwargs)
+        _summary_depth.active = True
+        before = metrics.registry.totals()
+        start = time.monotonic()
+        try:
+            with profiling.job(func.__name__):
+                return func(*args, **kwargs)
+        finally:
+            _summary_depth.active = False
+            log.info(f"{func.__name__} summary", elapsed=round(time.monotonic() - start, 3),
+                     metrics=metrics.diff(before, metrics.registry.totals()))
+    return wrapper
+
+
+def _save_artworks(
+        artworks_info: dict[int, pixiv_api.ArtworkInfo],
+        options: pixiv_api.ArtworkOptions,
+        start: int,
+        total: int) -> dict[int, str]:
+    # 返回jobqueue中的状态: DONE, SKIPPED, FAILED
+    # 经过所有阶段的artwork只是放入了writer的缓冲区，写入数据库后才算DONE
+    results: dict[int, str] = {}
+    queued: dict[int, pixiv_api.ArtworkInfo] = {}
+    errors: list[Exception] = []
+
+    def _on_finish(task: _ArtworkTask, completed: bool):
+        log.info(f"{start+len(results)+1}/{total} - {task.artwork_id}")
+        results[task.artwork_id] = jobqueue.DONE if completed else jobqueue.SKIPPED
+        if completed:
+            queued[task.artwork_id] = task.artwork_info
+            log.debug(f"artwork {task.artwork_id} queued for saving")
+
+    def _on_error(task: _ArtworkTask, e: Exception) -> bool:
+        log.info(f"{start+len(results)+1}/{total} - {task.artwork_id}")
+        log.error(f"save artwork {task.artwork_id} failed", error=str(e))
+        results[task.artwork_id] = jobqueue.FAILED
+        # ignore_error为False时，出错后不再开始新的artwork
+        if not options.ignore_error:
+            errors.append(e)
+            return False
+        return True
+
+    global _last_pipeline
+    artwork_pipeline = _last_pipeline = _new_pipeline(options, _on_finish, _on_error)
+    try:
+        artwork_pipeline.run(_ArtworkTask(k, v) for k, v in artworks_info.items())
+        log.info("artwork pipeline stats", **artwork_pipeline.stats())
+    finally:
+        # 出错停止时也写入已放入缓冲区的artwork
+        failed = _flush_writer()
+        for artwork_id, artwork_info in queued.items():
+            if artwork_id in failed:
+                results[artwork_id] = jobqueue.FAILED
+            else:
+                _log_saved(artwork_info)
+    if errors:
+        raise errors[0]
+    if failed and not options.ignore_error:
+        raise next(iter(failed.values()))
+    return results
+
+
+def _get_job_queue(options: pixiv_api.ArtworkOptions) -> jobqueue.CrawlJobQueue | None:
+    if not options.job_key:
+        return None
+    return jobqueue.CrawlJobQueue(sql, options.job_key)
+
+
+def _run_artworks(
+        artworks_info: dict[int, pixiv_api.ArtworkInfo],
+        options: pixiv_api.ArtworkOptions,
+        queue: jobqueue.CrawlJobQueue | None) -> dict[int, str]:
+    # 返回每个artwork的处理结果(jobqueue中的状态)
+    all_ids = list(artworks_info.keys())
+    results: dict[int, str] = {}
+
+    if queue is not None:
+        queue.add(jobqueue.ITEM_ARTWORK, all_ids)
+        for status in (jobqueue.DONE, jobqueue.SKIPPED):
+            results.update((i, status) for i in queue.ids(jobqueue.ITEM_ARTWORK, (status,)) & set(all_ids))
+        if results:
+            log.info(f"{len(results)} artworks already finished in job {queue.job_key}")
+
+    if not options.update:
+        exist_ids = _filter_exist_artworks([i for i in all_ids if i not in results])
+        if exist_ids:
+            log.info(f"{len(exist_ids)} artworks already exist")
+            results.update((i, jobqueue.SKIPPED) for i in exist_ids)
+            _artwork_results.inc(len(exist_ids), status=jobqueue.SKIPPED)
+            if queue is not None:
+                queue.mark(jobqueue.ITEM_ARTWORK, list(exist_ids), jobqueue.SKIPPED)
+
+    pending = [(k, v) for k, v in artworks_info.items() if k not in results]
+    # 使用job_key时每批保存一次进度，async_metadata时每批并发获取一次详情
+    chunk_size = CHECKPOINT_SIZE if queue is not None or async_api is not None else max(1, len(pending))
+    for i in range(0, len(pending), chunk_size):
+        chunk = dict(pending[i:i + chunk_size])
+        if async_api is not None:
+            chunk = _load_artworks_async(chunk, options)
+        if queue is not None:
+            queue.mark(jobqueue.ITEM_ARTWORK, list(chunk.keys()), jobqueue.RUNNING)
+        chunk_results = _save_artworks(chunk, options, len(all_ids) - len(pending) + i, len(all_ids))
+        results.update(chunk_results)
+        if queue is not None:
+            queue.mark_results(jobqueue.ITEM_ARTWORK, chunk_results)
+        for status in chunk_results.values():
+            _artwork_results.inc(status=status)
+
+    return results
+
+
+def _crawl_artworks(
+        artworks_info: dict[int, pixiv_api.ArtworkInfo],
+        options: pixiv_api.ArtworkOptions) -> dict[int, str]:
+    log.info("Artworks start downloading...", artworks=len(artworks_info))
+    queue = _get_job_queue(options)
+    results = _run_artworks(artworks_info, options, queue)
+    _wait_transcodes()
+    if queue is not None:
+        queue.finish()
+    log.info("Artworks download finished", failed_ids=[i for i in artworks_info if results.get(i) != jobqueue.DONE])
+    return results
+
+
 def _crawler_by_artworks_info(
         artworks_info: dict[int, pixiv_api.ArtworkInfo],
         options: pixiv_api.ArtworkOptions) -> list[int]:
-    log.info("Artworks start downloading...", artworks=artworks_info.keys())
-    ok_ids = []
-    for idx, (artwork_id, artwork_info) in enumerate(artworks_info.items()):
-        log.info(f"{idx+1}/{len(artworks_info)} - {artwork_id}")
-        try:
-            if _crawler_by_artwork_info(artwork_info, options):
-                ok_ids.append(artwork_id)
-        except Exception as e:
-            log.error(f"save artwork {artwork_id} failed", error=str(e))
-            if not options.ignore_error:
-                raise e
-            continue
-        log.info(
-            f"save artwork {artwork_id} to database",
-            title=artwork_info.title,
-            tags=[tag.name for tag in artwork_info.tags],
-            user=f"{artwork_info.user_name}({artwork_info.user_id})",
-            nums=artwork_info.nums
-        )
-    log.info("Artworks download finished", failed_ids=[i for i in artworks_info.keys() if i not in ok_ids])
-    return ok_ids
+    results = _crawl_artworks(artworks_info, options)
+    return [i for i in artworks_info if results.get(i) == jobqueue.DONE]
 
 
+@_job_summary
 def crawler_by_artwork_id(artwork_id: int, options: pixiv_api.ArtworkOptions | None = None):
     if options is None:
         options = pixiv_api.new_filter()
 
     artwork_info = api.get_artwork_info(artwork_id, options)
-    _crawler_by_artwork_info(artwork_info, options)
-    log.info(
-        f"save artwork {artwork_info.artwork_id} to database",
-        title=artwork_info.title,
-        tags=[tag.name for tag in artwork_info.tags],
-        user=f"{artwork_info.user_name}({artwork_info.user_id})",
-    )
+    queued = _crawler_by_artwork_info(artwork_info, options)
+    failed = _flush_writer()
+    _wait_transcodes()
+    if artwork_id in failed:
+        raise failed[artwork_id]
+    if queued:
+        _log_saved(artwork_info)
+
+
+@_job_summary
+def crawler_by_artwork_ids(artwork_ids: list[int], options: pixiv_api.ArtworkOptions | None = None) -> dict[int, str]:
+    # 处理一批artwork，等待其中动图的转换结束后返回，返回每个artwork的处理结果(jobqueue中的状态)
+    if options is None:
+        options = pixiv_api.new_filter()
+    return _crawl_artworks(api.get_artworks_by_ids(artwork_ids, options), options)
+
+
+def _get_user_sync(user_id: int) -> int | None:
+    with sql() as session:
+        user_sync = session.get(model.UserSync, user_id)
+        return None if user_sync is None else user_sync.max_artwork_id
+
+
+def _set_user_sync(user_id: int, max_artwork_id: int, artwork_cnt: int):
+    with sql() as session:
+        model.upsert(session, model.UserSync.__table__, [
+            {"userid": user_id, "max_illustid": max_artwork_id, "illust_cnt": artwork_cnt}
+        ], ["userid"], ["max_illustid", "illust_cnt", "sql_update_time"])
+        session.commit()
 
 
+def _crawler_by_user_incremental(
+        user_id: int,
+        artworks: dict[int, pixiv_api.ArtworkInfo],
+        options: pixiv_api.ArtworkOptions):
+    """
+    只处理id大于上次同步位置的作品，其中已入库的也跳过；
+    有作品失败时同步位置只推进到第一个失败的作品之前，下次同步重试
+    """
+    high_water = _get_user_sync(user_id)
+    new_ids = [i for i in artworks if high_water is None or i > high_water]
+    if new_ids and not options.update:
+        with sql() as session:
+            saved_ids = {row[0] for row in session.query(model.Artwork.artwork_id).filter_by(user_id=user_id)}
+        new_ids = [i for i in new_ids if i not in saved_ids]
+    log.info("incremental sync user", user_id=user_id, high_water=high_water, total=len(artworks), new=len(new_ids))
+
+    results = _crawl_artworks({i: artworks[i] for i in new_ids}, options) if new_ids else {}
+    failed_ids = [i for i, status in results.items() if status == jobqueue.FAILED]
+    if failed_ids:
+        max_artwork_id = max([i for i in artworks if i < min(failed_ids)], default=0)
+    else:
+        max_artwork_id = max(artworks, default=0)
+    if high_water is not None:
+        max_artwork_id = max(max_artwork_id, high_water)
+    _set_user_sync(user_id, max_artwork_id, len(artworks))
+
+
+@_job_summary
 def crawler_by_user_id(user_id: int, options: pixiv_api.ArtworkOptions | None = None):
     if options is None:
         options = pixiv_api.new_filter()
     artworks = api.get_artworks_by_userid(user_id, options)
     log.info("get artworks from user", user_id=user_id)
+    if options.incremental:
+        _crawler_by_user_incremental(user_id, artworks, options)
+        return
     _crawler_by_artworks_info(artworks, options)
 
 
 def _crawler_by_users_id(user_ids: list[int], options: pixiv_api.ArtworkOptions):
     log.info("Users start downloading...", user_ids=user_ids)
+    queue = _get_job_queue(options)
+    if queue is not None:
+        queue.add(jobqueue.ITEM_USER, user_ids)
+        done_ids = queue.ids(jobqueue.ITEM_USER, (jobqueue.DONE,))
+        user_ids = [i for i in user_ids if i not in done_ids]
+        # 已完成的用户不再重新获取，但其中失败或中断的artwork需要重试
+        retry_ids = list(queue.ids(jobqueue.ITEM_ARTWORK, jobqueue.UNFINISHED))
+        log.info(f"resume job {queue.job_key}", done_users=len(done_ids), retry_artworks=len(retry_ids))
+        if retry_ids:
+            _crawler_by_artworks_info(api.get_artworks_by_ids(retry_ids, options), options)
     for idx, user_id in enumerate(user_ids):
         log.info(f"! {idx + 1}/{len(user_ids)} start to save user {user_id} to database")
-        crawler_by_user_id(user_id, options)
+        if queue is not None:
+            queue.mark(jobqueue.ITEM_USER, [user_id], jobqueue.RUNNING)
+        try:
+            crawler_by_user_id(user_id, options)
+        except Exception as e:
+            if queue is not None:
+                queue.mark(jobqueue.ITEM_USER, [user_id], jobqueue.FAILED, str(e))
+            raise e
+        if queue is not None:
+            queue.mark(jobqueue.ITEM_USER, [user_id], jobqueue.DONE)
+    if queue is not None:
+        log.info(f"job {queue.job_key} progress", finished=queue.finish(), counts=queue.counts())
     log.info("Users download finished")
 
 
+@_job_summary
 def crawler_by_pixivision_aid(aid: int, options: pixiv_api.ArtworkOptions | None = None):
     if options is None:
         options = pixiv_api.new_filter()
@@ -184,6 +634,7 @@ def crawler_by_pixivision_aid(aid: int, options: pixiv_api.ArtworkOptions | None
     log.info(f"save pixivision {aid} to database")
 
 
+@_job_summary
 def crawler_by_follow_latest(page: int, options: pixiv_api.ArtworkOptions | None = None):
     if options is None:
         options = pixiv_api.new_filter()
@@ -193,6 +644,7 @@ def crawler_by_follow_latest(page: int, options: pixiv_api.ArtworkOptions | None
     _crawler_by_artworks_info(artworks, options)
 
 
+@_job_summary
 def crawler_by_recommend(options: pixiv_api.ArtworkOptions | None = None):
     if options is None:
         options = pixiv_api.new_filter()
@@ -202,6 +654,7 @@ def crawler_by_recommend(options: pixiv_api.ArtworkOptions | None = None):
     _crawler_by_artworks_info(artworks, options)
 
 
+@_job_summary
 def crawler_by_rank(rank_type: pixiv_api.RankType, date: int, page: int, options: pixiv_api.ArtworkOptions | None = None):
     if options is None:
         options = pixiv_api.new_filter()
@@ -211,6 +664,126 @@ def crawler_by_rank(rank_type: pixiv_api.RankType, date: int, page: int, options
     _crawler_by_artworks_info(artworks, options)
 
 
+def _crawler_by_artwork_pages(pages: Iterator[dict[int, pixiv_api.ArtworkInfo]], options: pixiv_api.ArtworkOptions) -> int:
+    # 拿到一页就开始下载，下一页在后台获取，返回成功保存的数量
+    saved = 0
+    with contextlib.closing(pages):
+        for page, artworks in enumerate(pages, 1):
+            log.info(f"page {page}", artworks=len(artworks))
+            saved += len(_crawler_by_artworks_info(artworks, options))
+    return saved
+
+
+@_job_summary
+def crawler_by_rank_all(rank_type: pixiv_api.RankType, date: int, options: pixiv_api.ArtworkOptions | None = None,
+                        max_pages: int | None = None):
+    if options is None:
+        options = pixiv_api.new_filter()
+
+    log.info(f"get all artworks from rank", rank_type=rank_type.name, date=date)
+    saved = _crawler_by_artwork_pages(api.iter_artworks_by_rank(rank_type, date, options, max_pages), options)
+    log.info(f"save rank to database", rank_type=rank_type.name, date=date, saved=saved)
+
+
+def _iter_dates(start_date: int, end_date: int) -> Iterator[int]:
+    day = datetime.datetime.strptime(str(start_date), "%Y%m%d").date()
+    end = datetime.datetime.strptime(str(end_date), "%Y%m%d").date()
+    while day <= end:
+        yield int(day.strftime("%Y%m%d"))
+        day += datetime.timedelta(days=1)
+
+
+def _get_rank_ids(rank_type: pixiv_api.RankType, date: int, options: pixiv_api.ArtworkOptions,
+                  max_pages: int | None) -> list[int]:
+    # 只取id，不获取artwork详情
+    artwork_ids = []
+    pages = api.iter_artworks_by_rank(rank_type, date, options, max_pages)
+    with contextlib.closing(pages):
+        for artworks in pages:
+            artwork_ids += artworks.keys()
+    return artwork_ids
+
+
+@_job_summary
+def crawler_by_rank_range(
+        rank_types: list[pixiv_api.RankType],
+        start_date: int,
+        end_date: int,
+        options: pixiv_api.ArtworkOptions | None = None,
+        max_pages: int | None = None,
+        workers: int = RANK_WORKERS):
+    """
+    回填start_date到end_date(含)之间每天的多个排行榜
+    先并发获取所有(日期, 榜单)的id并去重，再统一下载，已完成的(日期, 榜单)记录在rank_sync表中，再次执行时跳过
+    范围较大时可以同时指定options.job_key，下载中断后从中断处继续
+    """
+    if options is None:
+        options = pixiv_api.new_filter()
+
+    pairs = [(date, rank_type) for date in _iter_dates(start_date, end_date) for rank_type in rank_types]
+    with sql() as session:
+        done_pairs = set(session.query(model.RankSync.date, model.RankSync.mode).filter(
+            model.RankSync.date.between(start_date, end_date)
+        ))
+    pairs = [(date, rank_type) for date, rank_type in pairs if (date, rank_type.value) not in done_pairs]
+    log.info(f"rank backfill", start_date=start_date, end_date=end_date, pending=len(pairs), done=len(done_pairs))
+
+    pair_ids: dict[tuple[int, pixiv_api.RankType], list[int]] = {}
+    with ThreadPoolExecutor(workers, thread_name_prefix="rank") as executor:
+        futures = {
+            executor.submit(_get_rank_ids, rank_type, date, options, max_pages): (date, rank_type)
+            for date, rank_type in pairs
+        }
+        for future in as_completed(futures):
+            date, rank_type = futures[future]
+            try:
+                pair_ids[(date, rank_type)] = future.result()
+            except Exception as e:
+                # 该(日期, 榜单)不记为完成，下次重试
+                log.error(f"get rank failed", date=date, rank_type=rank_type.name, error=str(e))
+
+    # 同一artwork会出现在多天、多个榜单中，获取详情前先去重
+    artwork_ids = list(dict.fromkeys(i for date, rank_type in pairs for i in pair_ids.get((date, rank_type), [])))
+    log.info(f"rank backfill artworks", total=sum(len(ids) for ids in pair_ids.values()), unique=len(artwork_ids))
+    results = _crawl_artworks(api.get_artworks_by_ids(artwork_ids, options), options) if artwork_ids else {}
+
+    # 没有失败的artwork才算完成，榜单为空(尚未公布或该日期没有此榜单)的不记录
+    completed = [
+        {"date": date, "mode": rank_type.value, "illust_cnt": len(ids)}
+        for (date, rank_type), ids in pair_ids.items()
+        if ids and all(results.get(i) in (jobqueue.DONE, jobqueue.SKIPPED) for i in ids)
+    ]
+    with sql() as session:
+        model.upsert(session, model.RankSync.__table__, completed, ["date", "mode"], ["illust_cnt", "sql_update_time"])
+        session.commit()
+    log.info(f"rank backfill finished", completed=len(completed), incomplete=len(pairs) - len(completed))
+
+
+@_job_summary
+def crawler_by_follow_latest_all(options: pixiv_api.ArtworkOptions | None = None, min_artwork_id: int = 0,
+                                 max_pages: int | None = None):
+    if options is None:
+        options = pixiv_api.new_filter()
+
+    log.info(f"get all artworks from bookmark new", min_artwork_id=min_artwork_id)
+    saved = _crawler_by_artwork_pages(api.iter_artworks_by_follow_latest(options, min_artwork_id, max_pages), options)
+    log.info(f"save bookmark new to database", saved=saved)
+
+
+@_job_summary
+def crawler_by_user_bookmark_all(user_id: int, options: pixiv_api.ArtworkOptions | None = None,
+                                 until_artwork_id: int | None = None, max_pages: int | None = None):
+    if options is None:
+        options = pixiv_api.new_filter()
+
+    log.info(f"get all artworks from user bookmark", user_id=user_id)
+    saved = _crawler_by_artwork_pages(
+        api.iter_artworks_by_user_bookmark(user_id, options, until_artwork_id, max_pages), options
+    )
+    log.info(f"save user bookmark to database", user_id=user_id, saved=saved)
+
+
+@_job_summary
 def crawler_by_request_recommend(options: pixiv_api.ArtworkOptions | None = None):
     if options is None:
         options = pixiv_api.new_filter()
@@ -220,6 +793,7 @@ def crawler_by_request_recommend(options: pixiv_api.ArtworkOptions | None = None
     _crawler_by_artworks_info(artworks, options)
 
 
+@_job_summary
 def crawler_by_user_bookmark(user_id: int, page: int, options: pixiv_api.ArtworkOptions | None = None):
     if options is None:
         options = pixiv_api.new_filter()
@@ -229,6 +803,7 @@ def crawler_by_user_bookmark(user_id: int, page: int, options: pixiv_api.Artwork
     _crawler_by_artworks_info(artworks, options)
 
 
+@_job_summary
 def crawler_by_tag_popular(tag_name: str, options: pixiv_api.ArtworkOptions | None = None):
     if options is None:
         options = pixiv_api.new_filter()
@@ -238,6 +813,7 @@ def crawler_by_tag_popular(tag_name: str, options: pixiv_api.ArtworkOptions | No
     _crawler_by_artworks_info(artworks, options)
 
 
+@_job_summary
 def crawler_by_similar_artwork(artwork_id: int, options: pixiv_api.ArtworkOptions = None):
     if options is None:
         options = pixiv_api.new_filter()
@@ -247,6 +823,7 @@ def crawler_by_similar_artwork(artwork_id: int, options: pixiv_api.ArtworkOption
     _crawler_by_artworks_info(artworks, options)
 
 
+@_job_summary
 def crawler_by_similar_user(user_id: int, options: pixiv_api.ArtworkOptions | None = None):
     if options is None:
         options = pixiv_api.new_filter()
@@ -256,6 +833,7 @@ def crawler_by_similar_user(user_id: int, options: pixiv_api.ArtworkOptions | No
     _crawler_by_users_id(userids, options)
 
 
+@_job_summary
 def crawler_by_recommend_user(options: pixiv_api.ArtworkOptions | None = None):
     if options is None:
         options = pixiv_api.new_filter()
@@ -265,6 +843,7 @@ def crawler_by_recommend_user(options: pixiv_api.ArtworkOptions | None = None):
     _crawler_by_users_id(userids, options)
 
 
+@_job_summary
 def crawler_by_request_creator(options: pixiv_api.ArtworkOptions | None = None):
     if options is None:
         options = pixiv_api.new_filter()
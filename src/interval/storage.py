@@ -0,0 +1,248 @@
+"""
+图片存储布局
+
+flat: 所有图片放在同一目录，{artwork_id}_{idx}.{ext}(默认，与之前一致)
+sharded: 按artwork id的哈希分到两级子目录 ab/cd/{artwork_id}_{idx}.{ext}，同一artwork的图片在同一目录
+content: 在sharded的基础上按内容sha256去重，内容相同的图片硬链接到objects/下的同一个文件，
+         文件系统不支持硬链接时不去重，按sharded保存
+
+扩展名取自原图url，url中没有可识别的扩展名时根据文件头判断
+"""
+import hashlib
+import os
+import re
+import urllib.parse
+import pkg.log as log
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, NamedTuple
+
+
+FLAT = "flat"
+SHARDED = "sharded"
+CONTENT = "content"
+
+OBJECTS_DIR = "objects"
+HASH_CHUNK_SIZE = 1024 * 1024
+STAT_PAGES = 16  # 一个目录中要检查的页数不超过该值时逐个stat，不扫描整个目录
+FILE_NAME_RE = re.compile(r"^(\d+)_(\d+)\.\w+$")
+
+DEFAULT_SUFFIX = ".jpg"
+SUFFIXES = (".jpg", ".png", ".gif", ".webp", ".zip")
+HEADER_SIZE = 16
+# (文件头, 偏移, 扩展名)
+MAGIC_NUMBERS = [
+    (b"\xff\xd8\xff", 0, ".jpg"),
+    (b"\x89PNG\r\n\x1a\n", 0, ".png"),
+    (b"GIF8", 0, ".gif"),
+    (b"WEBP", 8, ".webp"),
+    (b"PK\x03\x04", 0, ".zip"),
+]
+
+
+class ImagePage(NamedTuple):
+    idx: int
+    format: str  # 扩展名，不含点，如jpg、png
+    size: int
+
+
+def suffix_from_url(url: str) -> str | None:
+    suffix = os.path.splitext(urllib.parse.urlsplit(url).path)[1].lower()
+    if suffix == ".jpeg":
+        suffix = ".jpg"
+    return suffix if suffix in SUFFIXES else None
+
+
+def sniff_suffix(header: bytes) -> str | None:
+    for magic, offset, suffix in MAGIC_NUMBERS:
+        if header[offset:offset + len(magic)] == magic:
+            return suffix
+    return None
+
+
+def _read_suffix(file_path: Path) -> str | None:
+    with open(file_path, "rb") as f:
+        return sniff_suffix(f.read(HEADER_SIZE))
+
+
+class ImageStorage(object):
+    """
+    flat布局，其它布局继承并重写_dir
+    """
+    # existing()是否扫描目录；flat布局的目录可能有上百万个文件，扫描一次比逐页stat慢得多
+    scan_dirs = False
+
+    def __init__(self, root: Path):
+        self.root = root
+
+    def _dir(self, artwork_id: int) -> Path:
+        return self.root
+
+    def path(self, artwork_id: int, idx: int, suffix: str = DEFAULT_SUFFIX) -> Path:
+        return self._dir(artwork_id) / f"{artwork_id}_{idx}{suffix}"
+
+    def animation_path(self, artwork_id: int, suffix: str) -> Path:
+        # 动图转换后的文件，不参与按页的存在检查
+        return self._dir(artwork_id) / f"{artwork_id}_ugoira{suffix}"
+
+    def find(self, artwork_id: int, idx: int, prefer: str | None = None) -> Path | None:
+        # 查找已下载(文件非空)的图片，不确定扩展名时依次尝试，优先尝试prefer
+        suffixes = SUFFIXES if prefer is None else (prefer, *(s for s in SUFFIXES if s != prefer))
+        for suffix in suffixes:
+            file_path = self.path(artwork_id, idx, suffix)
+            try:
+                if file_path.stat().st_size > 0:
+                    return file_path
+            except FileNotFoundError:
+                continue
+        return None
+
+    def store(self, artwork_id: int, idx: int, suffix: str | None, download: Callable[[Path], int]) -> ImagePage:
+        """
+        download把图片写入给定路径并返回大小
+        suffix为None时先按默认扩展名写入，下载完成后根据文件头改为正确的扩展名
+        """
+        file_path = self.path(artwork_id, idx, suffix or DEFAULT_SUFFIX)
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        size = download(file_path)
+        if suffix is None:
+            suffix = _read_suffix(file_path) or DEFAULT_SUFFIX
+            if suffix != file_path.suffix:
+                file_path = file_path.rename(file_path.with_suffix(suffix))
+        return ImagePage(idx, suffix[1:], size)
+
+    def existing(self, pages: Iterable[tuple[int, int]]) -> set[tuple[int, int]]:
+        """
+        返回pages中已下载(文件非空，任意扩展名)的(artwork_id, idx)
+        分片布局的每个目录文件不多，只扫描一次，不逐个stat；目录中只需检查少量页时仍逐个stat
+        flat布局总是逐页stat，不扫描可能有上百万个文件的根目录
+        """
+        wanted: dict[Path, set[tuple[int, int]]] = {}
+        for artwork_id, idx in pages:
+            wanted.setdefault(self._dir(artwork_id), set()).add((artwork_id, idx))
+        found = set()
+        for directory, names in wanted.items():
+            if not self.scan_dirs or len(names) <= STAT_PAGES:
+                found.update(page for page in names if self.find(*page) is not None)
+                continue
+            try:
+                with os.scandir(directory) as it:
+                    for entry in it:
+                        match = FILE_NAME_RE.match(entry.name)
+                        if match is None:
+                            continue
+                        page = (int(match.group(1)), int(match.group(2)))
+                        if page in names and entry.stat().st_size > 0:
+                            found.add(page)
+            except FileNotFoundError:
+                continue
+        return found
+
+    def iter_files(self) -> Iterator[tuple[int, int, Path]]:
+        # 遍历所有图片文件，返回(artwork_id, idx, 路径)
+        for directory, dirnames, filenames in os.walk(self.root):
+            if Path(directory) == self.root and OBJECTS_DIR in dirnames:
+                dirnames.remove(OBJECTS_DIR)
+            for filename in filenames:
+                match = FILE_NAME_RE.match(filename)
+                if match is not None:
+                    yield int(match.group(1)), int(match.group(2)), Path(directory) / filename
+
+
+class ShardedStorage(ImageStorage):
+    scan_dirs = True
+
+    def _dir(self, artwork_id: int) -> Path:
+        digest = hashlib.md5(str(artwork_id).encode()).hexdigest()
+        return self.root / digest[:2] / digest[2:4]
+
+
+class ContentAddressedStorage(ShardedStorage):
+    def __init__(self, root: Path):
+        super().__init__(root)
+        self._link_warned = False
+
+    def _object_path(self, digest: str, suffix: str) -> Path:
+        return self.root / OBJECTS_DIR / digest[:2] / digest[2:4] / f"{digest}{suffix}"
+
+    def dedupe(self, file_path: Path):
+        # 已有相同内容时把file_path换成指向已有文件的硬链接，否则把file_path登记为新的对象
+        digest = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+                digest.update(chunk)
+        object_path = self._object_path(digest.hexdigest(), file_path.suffix)
+        object_path.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            os.link(file_path, object_path)
+            return
+        except FileExistsError:
+            pass
+        except OSError as e:
+            # 文件系统不支持硬链接时不去重，只提示一次
+            if not self._link_warned:
+                self._link_warned = True
+                log.warning("hardlink is not supported, images are stored without dedupe",
+                            root=str(self.root), error=str(e))
+            return
+        if os.path.samefile(file_path, object_path):
+            return
+        tmp_path = file_path.with_name(file_path.name + ".link")
+        os.link(object_path, tmp_path)
+        os.replace(tmp_path, file_path)
+
+    def store(self, artwork_id: int, idx: int, suffix: str | None, download: Callable[[Path], int]) -> ImagePage:
+        page = super().store(artwork_id, idx, suffix, download)
+        self.dedupe(self.path(artwork_id, idx, f".{page.format}"))
+        return page
+
+
+def new_storage(layout: str, root: Path) -> ImageStorage:
+    if layout == SHARDED:
+        return ShardedStorage(root)
+    if layout == CONTENT:
+        return ContentAddressedStorage(root)
+    if layout == FLAT:
+        return ImageStorage(root)
+    raise ValueError(f"unknown storage layout: {layout}")
+
+
+def migrate_flat(root: Path, storage: ImageStorage, on_progress: Callable[[int], None] | None = None) -> int:
+    """
+    把root目录下flat布局的图片移动到storage的布局中(同一文件系统内重命名)，返回移动的文件数
+    可以重复执行，中断后再次执行会继续移动剩下的文件
+    """
+    moved = 0
+    with os.scandir(root) as it:
+        for entry in it:
+            match = FILE_NAME_RE.match(entry.name)
+            if match is None or not entry.is_file():
+                continue
+            dst = storage.path(int(match.group(1)), int(match.group(2)), Path(entry.name).suffix)
+            if dst == Path(entry.path):
+                continue
+            dst.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(entry.path, dst)
+            if isinstance(storage, ContentAddressedStorage):
+                storage.dedupe(dst)
+            moved += 1
+            if on_progress is not None and moved % 1000 == 0:
+                on_progress(moved)
+    return moved
+
+
+def fix_suffixes(storage: ImageStorage) -> Iterator[tuple[int, ImagePage, bool]]:
+    """
+    只读取文件头判断真实格式，把扩展名不对的文件改名
+    对每个图片返回(artwork_id, ImagePage, 是否改名)，无法识别格式的文件保持原样
+    改名后的文件已存在时保留两个文件并记录日志，不返回该文件(已存在的文件会单独返回)
+    """
+    for artwork_id, idx, file_path in storage.iter_files():
+        suffix = _read_suffix(file_path)
+        renamed = suffix is not None and suffix != file_path.suffix
+        if renamed:
+            target = file_path.with_suffix(suffix)
+            if target.exists():
+                log.warning(f"skip renaming {file_path}, {target.name} already exists")
+                continue
+            file_path = file_path.rename(target)
+        yield artwork_id, ImagePage(idx, file_path.suffix[1:], file_path.stat().st_size), renamed
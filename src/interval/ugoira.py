@@ -0,0 +1,54 @@
+"""
+动图(ugoira)转换
+
+原始数据是每帧一张图片的zip以及每帧的延迟，转换为gif/webp需要解码所有帧，
+放在独立的进程池中执行，不阻塞下载；需要安装Pillow
+进程池使用spawn启动子进程，提交时流水线、日志等线程都在运行，fork出的子进程可能继承被其它线程持有的锁
+"""
+import multiprocessing
+import os
+import threading
+import zipfile
+from concurrent.futures import Future, ProcessPoolExecutor
+from pathlib import Path
+
+
+FORMATS = ("gif", "webp")
+
+_executor: ProcessPoolExecutor | None = None
+_executor_lock = threading.Lock()
+
+
+def transcode(zip_path: Path, frames: list[tuple[str, int]], out_path: Path, fmt: str) -> int:
+    """
+    把zip中的帧按frames(文件名, 毫秒)的顺序合成为动图，先写入临时文件再重命名，返回文件大小
+    在子进程中执行，参数与返回值都需要能被pickle
+    """
+    from PIL import Image
+
+    images = []
+    with zipfile.ZipFile(zip_path) as zf:
+        for name, _ in frames:
+            with zf.open(name) as f:
+                image = Image.open(f)
+                image.load()
+            images.append(image.convert("RGBA") if fmt == "webp" else image.convert("RGB"))
+    tmp_path = out_path.with_name(out_path.name + ".part")
+    images[0].save(
+        tmp_path, format=fmt.upper(), save_all=True, append_images=images[1:],
+        duration=[delay for _, delay in frames], loop=0,
+    )
+    os.replace(tmp_path, out_path)
+    return out_path.stat().st_size
+
+
+def submit(zip_path: Path, frames: list[tuple[str, int]], out_path: Path, fmt: str, workers: int = 0) -> Future:
+    # 进程池在第一次使用时创建，之后所有调用共用；流水线的多个下载线程会同时调用
+    global _executor
+    if fmt not in FORMATS:
+        raise ValueError(f"unsupported ugoira format: {fmt}")
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(workers or None, mp_context=multiprocessing.get_context("spawn"))
+        executor = _executor
+    return executor.submit(transcode, zip_path, frames, out_path, fmt)
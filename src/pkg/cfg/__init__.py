@@ -1,17 +1,37 @@
+import os
 import typing
 import pathlib
 
 
+CONFIG_ENV = "PIXIV_CRAWLER_CONFIG"  # 设置时使用该路径的配置文件，如基准测试使用的临时配置
+
+
 class PixivConfig(typing.NamedTuple):
     phpsessid: str
     proxy: str
     file_path: pathlib.Path
     sql_url: str
+    cache_path: str = ""
+    cache_max_mb: int = 512
+    ajax_rate: float = 5.0
+    image_rate: float = 20.0
+    transport: dict = {}
+    session_ids: list[str] = []
+    proxies: list[str] = []
+    schedule: str = "least_loaded"
+    async_metadata: bool = False
+    storage: str = "flat"
+    log_level: str = "info"
+    log_max_mb: int = 64
+    metrics: dict = {}
+    profiling: dict = {}
 
 
 def get_pixiv_config(filename: str = "config.yml") -> PixivConfig:
     import yaml
     filepath = pathlib.Path(__file__).parent.parent.parent / "cfg" / filename
+    if os.environ.get(CONFIG_ENV):
+        filepath = pathlib.Path(os.environ[CONFIG_ENV])
     with open(filepath, "r") as f:
         obj = yaml.safe_load(f)
     return PixivConfig(
@@ -19,4 +39,18 @@ def get_pixiv_config(filename: str = "config.yml") -> PixivConfig:
         proxy=obj["proxy"],
         file_path=pathlib.Path(obj["file_path"]),
         sql_url=obj["sql_url"],
+        cache_path=obj.get("cache_path") or "",
+        cache_max_mb=obj.get("cache_max_mb", 512),
+        ajax_rate=obj.get("ajax_rate", 5.0),
+        image_rate=obj.get("image_rate", 20.0),
+        transport=obj.get("transport") or {},
+        session_ids=obj.get("session_ids") or [],
+        proxies=obj.get("proxies") or [],
+        schedule=obj.get("schedule", "least_loaded"),
+        async_metadata=obj.get("async_metadata", False),
+        storage=obj.get("storage", "flat"),
+        log_level=obj.get("log_level", "info"),
+        log_max_mb=obj.get("log_max_mb", 64),
+        metrics=obj.get("metrics") or {},
+        profiling=obj.get("profiling") or {},
     )
@@ -1,13 +1,223 @@
+"""
+日志
+
+info/warning/error只把记录放入队列，由后台线程批量格式化：文件中每行一条JSON，控制台输出与之前相同的文本
+参数在入队时复制一份(dict、list、tuple、set逐层复制，其它对象转为字符串，不会迭代调用方的生成器)，
+调用方之后修改参数不影响日志内容
+低于当前级别的记录在入队前直接丢弃，不做任何处理
+队列有长度上限，后台线程跟不上(如磁盘很慢)时丢弃新的debug/info/warning记录并计数，之后写入一条丢弃数量的记录；
+error记录在队列满时等待
+文件超过max_bytes时轮转为log.txt.1、log.txt.2...，最多保留backup_count个；
+轮转不能在多个进程间同步，多进程时文件名中使用{pid}，每个进程写各自的文件
+"""
+import atexit
+import datetime
+import json
+import os
+import queue
+import sys
+import threading
+import time
 
 LOG_FILE = 'log.txt'
+MAX_BYTES = 64 * 1024 * 1024
+BACKUP_COUNT = 5
+BATCH_SIZE = 1000  # 后台线程一次最多写入的记录数，队列中积压的记录合并为一次写入
+QUEUE_SIZE = 100000  # 队列中最多积压的记录数
+
+LEVELS = {'Debug': 10, 'Info': 20, 'Warning': 30, 'Error': 40}
+_SCALARS = (str, bytes, int, float, bool, type(None), datetime.date)
+
+_level = LEVELS['Info']
+_file = LOG_FILE
+_max_bytes = MAX_BYTES
+_backup_count = BACKUP_COUNT
+_console = True
+
+_queue: queue.Queue = queue.Queue(QUEUE_SIZE)
+_dropped = 0  # 队列满时丢弃的记录数，由后台线程写入日志后清零
+_dropped_lock = threading.Lock()
+_writer: threading.Thread | None = None
+_writer_pid = 0
+_writer_lock = threading.Lock()
+
+
+def configure(level: str | None = None, file: str | None = None, max_bytes: int | None = None,
+              backup_count: int | None = None, console: bool | None = None):
+    # level为Debug/Info/Warning/Error(不区分大小写)，file中的{pid}替换为进程id，其它参数为None时保持不变
+    global _level, _file, _max_bytes, _backup_count, _console
+    flush()
+    if level is not None:
+        _level = LEVELS[level.capitalize()]
+    if file is not None:
+        _file = file
+    if max_bytes is not None:
+        _max_bytes = max_bytes
+    if backup_count is not None:
+        _backup_count = backup_count
+    if console is not None:
+        _console = console
+
+
+def enabled(lvl: str) -> bool:
+    # 构造日志参数本身开销较大时，调用方可以先检查级别
+    return LEVELS.get(lvl, 0) >= _level
+
+
+def _snapshot(value):
+    # 只复制内置容器，其它对象(包括生成器等只能迭代一次的对象)转为字符串
+    if isinstance(value, _SCALARS):
+        return value
+    if isinstance(value, dict):
+        return {k: _snapshot(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_snapshot(v) for v in value]
+    if isinstance(value, tuple):
+        return tuple(_snapshot(v) for v in value)
+    if isinstance(value, (set, frozenset)):
+        return {_snapshot(v) for v in value}
+    return str(value)
+
+
+def _json_default(obj):
+    # set、dict.keys()等可迭代对象转为列表，其它不能序列化的对象用str
+    if isinstance(obj, (datetime.datetime, datetime.date)):
+        return obj.isoformat()
+    if hasattr(obj, '__iter__') and not isinstance(obj, (str, bytes)):
+        return list(obj)
+    return str(obj)
+
+
+def _format_json(record) -> str:
+    created, lvl, msg, args, kwargs, thread = record
+    obj = {
+        'time': datetime.datetime.fromtimestamp(created).isoformat(timespec='milliseconds'),
+        'level': lvl.lower(),
+        'thread': thread,
+        'msg': msg,
+    }
+    if args:
+        obj['args'] = args
+    if kwargs:
+        obj['kwargs'] = kwargs
+    return json.dumps(obj, ensure_ascii=False, default=_json_default)
+
+
+def _format_text(record) -> str:
+    _, lvl, msg, args, kwargs, _ = record
+    return f'[{lvl}]: {msg} {args} {kwargs}'
+
 
-f = open(LOG_FILE, 'a+')
+def _path() -> str:
+    return _file.replace('{pid}', str(os.getpid()))
+
+
+def _rotate(path: str):
+    for i in range(_backup_count - 1, 0, -1):
+        if os.path.exists(f'{path}.{i}'):
+            os.replace(f'{path}.{i}', f'{path}.{i + 1}')
+    if _backup_count > 0:
+        os.replace(path, f'{path}.1')
+    else:
+        os.remove(path)
+
+
+def _write(records: list):
+    lines = []
+    for record in records:
+        try:
+            lines.append(_format_json(record))
+        except Exception as e:
+            lines.append(json.dumps({'level': 'error', 'msg': f'format log failed: {e}'}))
+    path = _path()
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write('\n'.join(lines) + '\n')
+        size = f.tell()
+    if _max_bytes and size >= _max_bytes:
+        _rotate(path)
+    if _console:
+        sys.stdout.write(''.join(_format_text(record) + '\n' for record in records))
+        sys.stdout.flush()
+
+
+def _take_dropped() -> int:
+    global _dropped
+    with _dropped_lock:
+        dropped, _dropped = _dropped, 0
+    return dropped
+
+
+def _run():
+    while True:
+        records = []
+        waiters = []
+        item = _queue.get()
+        while True:
+            # flush()放入的Event，写完之前的记录后通知
+            if isinstance(item, threading.Event):
+                waiters.append(item)
+            else:
+                records.append(item)
+            if len(records) >= BATCH_SIZE:
+                break
+            try:
+                item = _queue.get_nowait()
+            except queue.Empty:
+                break
+        dropped = _take_dropped()
+        if dropped:
+            records.append((time.time(), 'Warning', f'log queue full, dropped {dropped} records', (), {},
+                            threading.current_thread().name))
+        if records:
+            try:
+                _write(records)
+            except Exception as e:
+                sys.stderr.write(f'write log failed: {e}\n')
+        for waiter in waiters:
+            waiter.set()
+
+
+def _ensure_writer():
+    # fork出的子进程中没有后台线程，需要重新创建
+    global _writer, _writer_pid, _queue
+    with _writer_lock:
+        if _writer is not None and _writer_pid == os.getpid():
+            return
+        if _writer_pid != os.getpid():
+            _queue = queue.Queue(QUEUE_SIZE)
+        _writer = threading.Thread(target=_run, name='log-writer', daemon=True)
+        _writer.start()
+        _writer_pid = os.getpid()
+
+
+def flush(timeout: float | None = 10):
+    # 等待已放入队列的记录全部写入
+    if _writer is None or _writer_pid != os.getpid():
+        return
+    done = threading.Event()
+    _queue.put(done)
+    done.wait(timeout)
+
+
+atexit.register(flush)
 
 
 def log(lvl, msg, *args, **kwargs):
-    record_text = f'[{lvl}]: {msg} {args} {kwargs}'
-    print(record_text)
-    f.write(record_text + '\n')
+    global _dropped
+    if LEVELS.get(lvl, 0) < _level:
+        return
+    if _writer_pid != os.getpid():
+        _ensure_writer()
+    record = (time.time(), lvl, msg, _snapshot(args), _snapshot(kwargs), threading.current_thread().name)
+    try:
+        _queue.put(record, block=lvl == 'Error')
+    except queue.Full:
+        with _dropped_lock:
+            _dropped += 1
+
+
+def debug(msg, *args, **kwargs):
+    log('Debug', msg, *args, **kwargs)
 
 
 def info(msg, *args, **kwargs):
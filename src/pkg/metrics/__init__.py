@@ -0,0 +1,254 @@
+"""
+进程内指标
+
+Counter只增不减，Histogram按固定分桶统计分布(同时记录次数与总和)，Histogram.time()把耗时(秒)记入分布
+同名指标用标签(endpoint、status等)区分；其它模块已有的统计(连接池、流水线等)通过collector在导出时读取
+导出: to_prometheus()为Prometheus文本格式，snapshot()为可以json序列化的dict，
+serve_prometheus()/write_snapshots()在后台线程中持续导出
+"""
+import contextlib
+import http.server
+import json
+import os
+import threading
+import time
+from typing import Callable, Iterable, Iterator
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+SNAPSHOT_INTERVAL = 60.0
+
+# collector返回的样本: (指标名, 标签, 值)
+Sample = tuple[str, dict, float]
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key: tuple) -> str:
+    if not key:
+        return ""
+    escaped = (
+        (k, v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in key
+    )
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+class Counter(object):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str = ""):
+        self.name = name
+        self.help = help
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, value: float = 1.0, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + value
+
+    def samples(self) -> list[tuple[str, tuple, float]]:
+        with self._lock:
+            return [(self.name, key, value) for key, value in self._values.items()]
+
+
+class Histogram(object):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str = "", buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self._buckets = buckets
+        # 每组标签: [各分桶的次数(不累加)..., 超出最大分桶的次数, 总和]
+        self._values: dict[tuple, list[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = _label_key(labels)
+        idx = next((i for i, bound in enumerate(self._buckets) if value <= bound), len(self._buckets))
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0.0] * (len(self._buckets) + 2)
+            counts[idx] += 1
+            counts[-1] += value
+
+    @contextlib.contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - start, **labels)
+
+    def quantile(self, q: float, match: Callable[[dict], bool] | None = None) -> float:
+        """
+        按分桶估算分位数(桶内线性插值)，match非空时只统计标签满足条件的部分
+        超出最大分桶的部分按最大分桶的上界计算
+        """
+        merged = [0.0] * (len(self._buckets) + 1)
+        with self._lock:
+            for key, counts in self._values.items():
+                if match is None or match(dict(key)):
+                    for i, count in enumerate(counts[:-1]):
+                        merged[i] += count
+        total = sum(merged)
+        if total == 0:
+            return 0.0
+        rank = q * total
+        cumulative = 0.0
+        for i, count in enumerate(merged):
+            if count and cumulative + count >= rank:
+                if i >= len(self._buckets):
+                    return self._buckets[-1]
+                lower = self._buckets[i - 1] if i > 0 else 0.0
+                return lower + (self._buckets[i] - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self._buckets[-1]
+
+    def samples(self) -> list[tuple[str, tuple, float]]:
+        samples = []
+        with self._lock:
+            for key, counts in self._values.items():
+                cumulative = 0.0
+                for bound, count in zip((*self._buckets, float("inf")), counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    samples.append((f"{self.name}_bucket", (*key, ("le", le)), cumulative))
+                samples.append((f"{self.name}_count", key, cumulative))
+                samples.append((f"{self.name}_sum", key, counts[-1]))
+        return samples
+
+
+class Registry(object):
+    def __init__(self):
+        self._metrics: dict[str, Counter | Histogram] = {}
+        self._collectors: list[Callable[[], Iterable[Sample]]] = []
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name: str, *args):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"metric {name} is already registered as {metric.kind}")
+            return metric
+
+    def counter(self, name: str, help: str = "") -> Counter:
+        return self._get(Counter, name, help)
+
+    def histogram(self, name: str, help: str = "", buckets: tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        return self._get(Histogram, name, help, buckets)
+
+    def register_collector(self, collector: Callable[[], Iterable[Sample]]):
+        # collector在每次导出时调用，返回的样本作为gauge导出，不参与totals()
+        with self._lock:
+            self._collectors.append(collector)
+
+    def _collect(self) -> dict[str, list[tuple[tuple, float]]]:
+        gauges: dict[str, list[tuple[tuple, float]]] = {}
+        for collector in list(self._collectors):
+            try:
+                for name, labels, value in collector():
+                    gauges.setdefault(name, []).append((_label_key(labels), value))
+            except Exception:
+                # 某个collector出错不影响其它指标
+                continue
+        return gauges
+
+    def totals(self) -> dict[str, float]:
+        """
+        所有Counter以及Histogram次数、总和的当前值，key为"指标名{标签}"
+        两次调用的结果用diff()相减即得到这段时间内的增量
+        """
+        totals = {}
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            for name, key, value in metric.samples():
+                if not name.endswith("_bucket"):
+                    totals[name + _format_labels(key)] = value
+        return totals
+
+    def to_prometheus(self) -> str:
+        lines = []
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda m: m.name)
+        for metric in metrics:
+            if metric.help:
+                lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(f"{name}{_format_labels(key)} {value!r}" for name, key, value in metric.samples())
+        for name, samples in sorted(self._collect().items()):
+            lines.append(f"# TYPE {name} gauge")
+            lines.extend(f"{name}{_format_labels(key)} {float(value)!r}" for key, value in samples)
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> dict:
+        # {"time": 时间戳, "metrics": {"指标名{标签}": 值}}，gauge与Counter、Histogram放在一起
+        values = self.totals()
+        for name, samples in self._collect().items():
+            for key, value in samples:
+                values[name + _format_labels(key)] = value
+        return {"time": time.time(), "metrics": values}
+
+
+def diff(before: dict[str, float], after: dict[str, float]) -> dict[str, float]:
+    return {
+        key: round(value - before.get(key, 0.0), 6)
+        for key, value in after.items()
+        if value != before.get(key, 0.0)
+    }
+
+
+registry = Registry()
+counter = registry.counter
+histogram = registry.histogram
+register_collector = registry.register_collector
+
+
+def serve_prometheus(port: int, host: str = "0.0.0.0", target: Registry = registry) -> http.server.ThreadingHTTPServer:
+    # 在后台线程中提供GET /metrics
+    class _Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = target.to_prometheus().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer((host, port), _Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
+
+
+def write_snapshot(path: str, target: Registry = registry):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(target.snapshot(), f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def write_snapshots(path: str, interval: float = SNAPSHOT_INTERVAL, target: Registry = registry) -> threading.Thread:
+    # 在后台线程中每隔interval秒把snapshot()写入path(先写临时文件再替换)
+    def _run():
+        while True:
+            time.sleep(interval)
+            try:
+                write_snapshot(path, target)
+            except OSError:
+                continue
+
+    thread = threading.Thread(target=_run, name="metrics-json", daemon=True)
+    thread.start()
+    return thread
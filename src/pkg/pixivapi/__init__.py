@@ -1,11 +1,23 @@
 import enum
 import datetime
-from typing import Generator, NamedTuple, Optional
+import pathlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Generator, Iterator, NamedTuple, Optional
+from .transport import TransportConfig
 
 
 class ApiMetaArgument(NamedTuple):
     PHPSESSID: str
     PROXY: str
+    CACHE_PATH: str = ""  # 接口响应缓存的sqlite文件路径，为空则不缓存
+    CACHE_MAX_BYTES: int = 512 * 1024 * 1024
+    AJAX_RATE: float = 5.0  # www.pixiv.net等接口每秒最多请求数
+    IMAGE_RATE: float = 20.0  # i.pximg.net每秒最多请求数
+    TRANSPORT: TransportConfig = TransportConfig()
+    # 多账号/多代理轮换，为空时只使用PHPSESSID/PROXY
+    PHPSESSIDS: tuple[str, ...] = ()
+    PROXIES: tuple[str, ...] = ()
+    SCHEDULE: str = "least_loaded"  # least_loaded或round_robin
 
 
 class ArtworkType(enum.Enum):
@@ -44,6 +56,8 @@ class RankType(enum.Enum):
 
 
 class ArtworkInfo(object):
+    __slots__ = ()
+
     artwork_id: int
     user_id: int
     user_name: str
@@ -63,6 +77,11 @@ class ArtworkInfo(object):
     height: int
     width: int
 
+    @property
+    def loaded(self) -> bool:
+        # 懒加载的实现在获取信息之前为False
+        return True
+
 
 class PixivisionInfo(NamedTuple):
     aid: int
@@ -72,6 +91,18 @@ class PixivisionInfo(NamedTuple):
     artworks: dict[int, ArtworkInfo]
 
 
+class UgoiraFrame(NamedTuple):
+    file: str  # zip中的文件名
+    delay: int  # 该帧显示的毫秒数
+
+
+class UgoiraMeta(NamedTuple):
+    src: str  # 缩小尺寸的帧zip
+    original_src: str  # 原尺寸的帧zip
+    mime_type: str
+    frames: list[UgoiraFrame]
+
+
 class ArtworkOptions(object):
     def __init__(self) -> None:
         """
@@ -81,6 +112,16 @@ class ArtworkOptions(object):
         skip_manga: bool, 是否跳过漫画
         artwork_types: list[ArtworkType], 只爬取指定类型的artwork
         ignore_error: bool, 是否忽略爬取过程中的某个artwork出错，如果为False则会在出错时直接raise
+        metadata_workers: int, 流水线中获取artwork信息阶段的线程数
+        filter_workers: int, 流水线中过滤阶段的线程数
+        image_workers: int, 流水线中下载阶段的线程数，即同时下载的artwork数量
+        persist_workers: int, 流水线中入库阶段的线程数
+        prefetch_window: int, 在后台提前获取之后多少个artwork的信息，获取信息阶段的线程数取metadata_workers与它的较大值
+        stage_queue_size: int, 流水线各阶段之间的队列长度，队列满时上游阶段等待，0为默认长度
+        job_key: str, 非空时把爬取进度保存到数据库，相同job_key再次执行时从中断处继续
+        incremental: bool, 爬取用户时只处理上次同步之后的新作品，为False时重新检查用户的全部作品
+        ugoira_format: str, 动图额外转换成的格式(gif、webp)，为空时只保存原始的帧zip
+        transcode_workers: int, 转换动图的进程数，0为cpu核数
         """
         self.update = False
         self.only_r18 = False
@@ -88,6 +129,16 @@ class ArtworkOptions(object):
         self.skip_manga = True
         self.artwork_types: list[ArtworkType] | None = None
         self.ignore_error = True
+        self.metadata_workers = 1
+        self.filter_workers = 1
+        self.image_workers = 1
+        self.persist_workers = 1
+        self.prefetch_window = 0
+        self.stage_queue_size = 0
+        self.job_key: str | None = None
+        self.incremental = False
+        self.ugoira_format = ""
+        self.transcode_workers = 0
 
     def valid_by_artwork_info(self, artwork_info: ArtworkInfo) -> Optional[str]:
         if self.only_r18 and artwork_info.restrict == ArtworkRestrict.NON_R18:
@@ -104,10 +155,22 @@ class PixivApi(object):
     def get_image(self, url: str) -> bytes:
         raise NotImplementedError
 
+    def download_image(self, url: str, file_path: pathlib.Path) -> int:
+        # 流式下载图片到file_path，先写入临时文件，校验大小后原子重命名，返回文件大小
+        raise NotImplementedError
+
     def get_artwork_info(self, artwork_id: int, options: ArtworkOptions) -> ArtworkInfo:
         # 获取某个插画的详细信息
         raise NotImplementedError
 
+    def get_ugoira_meta(self, artwork_id: int) -> UgoiraMeta:
+        # 获取动图的帧zip地址以及每帧的延迟
+        raise NotImplementedError
+
+    def get_artworks_by_ids(self, artwork_ids: list[int], options: ArtworkOptions) -> dict[int, ArtworkInfo]:
+        # 根据artwork id列表获取插画作品
+        raise NotImplementedError
+
     def get_artworks_by_userid(self, user_id: int, options: ArtworkOptions) -> dict[int, ArtworkInfo]:
         # 根据用户id获取所有插画作品
         raise NotImplementedError
@@ -116,6 +179,11 @@ class PixivApi(object):
         # 获取关注的用户最新的插画作品
         raise NotImplementedError
 
+    def iter_artworks_by_follow_latest(self, options: ArtworkOptions, min_artwork_id: int = 0,
+                                       max_pages: int | None = None) -> Iterator[dict[int, ArtworkInfo]]:
+        # 逐页获取关注的用户最新的插画作品，遇到id不大于min_artwork_id的作品时停止
+        raise NotImplementedError
+
     def get_artworks_by_pixivision_aid(self, aid: int, options: ArtworkOptions) -> PixivisionInfo:
         # 获取pixivision的插画作品，根据aid
         raise NotImplementedError
@@ -129,6 +197,11 @@ class PixivApi(object):
         # date: 8位数字，如20220101
         raise NotImplementedError
 
+    def iter_artworks_by_rank(self, rank_type: RankType, date: int, options: ArtworkOptions,
+                              max_pages: int | None = None) -> Iterator[dict[int, ArtworkInfo]]:
+        # 逐页获取排行榜，直到最后一页或max_pages页
+        raise NotImplementedError
+
     def get_artworks_by_request_recommend(self, options: ArtworkOptions) -> dict[int, ArtworkInfo]:
         # 获取推荐的接稿的插画作品(接稿页面的推荐作品)
         raise NotImplementedError
@@ -145,6 +218,11 @@ class PixivApi(object):
         # 获取用户的收藏作品
         raise NotImplementedError
 
+    def iter_artworks_by_user_bookmark(self, user_id: int, options: ArtworkOptions, until_artwork_id: int | None = None,
+                                       max_pages: int | None = None) -> Iterator[dict[int, ArtworkInfo]]:
+        # 逐页获取用户的收藏作品(从最近收藏的开始)，遇到until_artwork_id时停止
+        raise NotImplementedError
+
     def get_artworks_by_tag_popular(self, tag_name: str, options: ArtworkOptions) -> dict[int, ArtworkInfo]:
         # 从指定tag获取热门作品
         raise NotImplementedError
@@ -158,7 +236,11 @@ class PixivApi(object):
         raise NotImplementedError
 
 
-def new_pixiv_api(meta: ApiMetaArgument) -> PixivApi:
+def new_pixiv_api(meta: ApiMetaArgument, use_async: bool = False) -> PixivApi:
+    # use_async为True时返回基于httpx的异步实现，所有接口均为协程(爬虫中由配置async_metadata开启，用于并发获取作品详情)
+    if use_async:
+        from . import api_async
+        return api_async.AsyncPixivApiImpl(meta)
     from . import api
     return api.PixivApiImpl(meta)
 
@@ -171,6 +253,30 @@ def origin_url_2_all_url(origin_url: str, nums: int) -> Generator[str, None, Non
     )
 
 
+def iter_pages(fetch_page: Callable[[int], tuple[list[int], bool]],
+               max_pages: int | None = None) -> Generator[list[int], None, None]:
+    """
+    从第1页开始逐页获取id，fetch_page(page)返回(该页的id, 是否还有下一页)
+    处理当前页时在后台获取下一页，内存中最多同时有两页
+    """
+    executor = ThreadPoolExecutor(1, thread_name_prefix="page")
+    page = 1
+    future = executor.submit(fetch_page, page)
+    try:
+        while True:
+            artwork_ids, has_next = future.result()
+            last = not artwork_ids or not has_next or (max_pages is not None and page >= max_pages)
+            if not last:
+                future = executor.submit(fetch_page, page + 1)
+            if artwork_ids:
+                yield artwork_ids
+            if last:
+                return
+            page += 1
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
 def new_filter(**kwargs) -> ArtworkOptions:
     options = ArtworkOptions()
     for k, v in kwargs.items():
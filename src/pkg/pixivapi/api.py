@@ -1,10 +1,17 @@
-from typing import Generator
 import pkg.pixivapi as pixiv_api
 import requests
 import parsel
 import datetime
 import typing
 import functools
+import contextlib
+import pathlib
+import pkg.metrics as metrics
+import pkg.profiling as profiling
+from pkg.pixivapi import download
+from pkg.pixivapi import identity
+from pkg.pixivapi import transport
+from pkg.pixivapi.cache import MetaCache, cache_key
 
 
 BASE_HEADERS = {
@@ -13,157 +20,210 @@ BASE_HEADERS = {
     "accept-language": "en,zh-CN;q=0.9,zh;q=0.8",
     "referer": "https://www.pixiv.net/",
 }
+BOOKMARK_PAGE_SIZE = 48
+
+response_bytes = metrics.counter("pixiv_response_bytes_total", "响应体字节数，图片按实际写入磁盘的字节数")
+cache_requests = metrics.counter("pixiv_cache_requests_total", "接口缓存的命中(hit)与未命中(miss)次数")
+
+
+class ArtworkRecord(pixiv_api.ArtworkInfo):
+    """
+    从/ajax/illust/{id}的响应中一次性解析出的artwork信息，不保留原始json
+    """
+    __slots__ = (
+        'artwork_id', 'user_id', 'user_name', 'artwork_type', 'tags', 'title', 'nums', 'restrict', 'desc',
+        'bookmark_cnt', 'like_cnt', 'comment_cnt', 'view_cnt', 'create_time', 'upload_time', 'height', 'width',
+        '_original_url',
+    )
+
+    @classmethod
+    def from_body(cls, body: dict) -> "ArtworkRecord":
+        record = cls()
+        record.artwork_id = int(body['illustId'])
+        record.user_id = int(body['userId'])
+        record.user_name = body['userName']
+        record.artwork_type = pixiv_api.ArtworkType(int(body['illustType']))
+        record.tags = cls._parse_tags(body['tags']['tags'])
+        record.title = body['title']
+        record.nums = int(body['pageCount'])
+        record.restrict = pixiv_api.ArtworkRestrict(int(body['xRestrict']))
+        record.desc = body['description']
+        record.bookmark_cnt = body['bookmarkCount']
+        record.like_cnt = body['likeCount']
+        record.comment_cnt = body['commentCount']
+        record.view_cnt = body['viewCount']
+        record.create_time = datetime.datetime.fromisoformat(body['createDate']).astimezone(None)
+        record.upload_time = datetime.datetime.fromisoformat(body['uploadDate']).astimezone(None)
+        record.height = body['height']
+        record.width = body['width']
+        record._original_url = body['urls']['original']
+        return record
+
+    @staticmethod
+    def _parse_tags(tag_infos: list[dict]) -> list[pixiv_api.ArtworkTag]:
+        tags: list[pixiv_api.ArtworkTag] = []
+
+        used_tag = set()
+        for tag_info in tag_infos:
+            tag = tag_info['tag']
+            translation = tag_info.get('translation', {})
+
+            tag_trans = translation.get('en', '') if translation else ''
+
+            if tag in used_tag:  # 网站部分返回的会出现重复tag的问题（e.g. 69353795）
+                continue
+            used_tag.add(tag)
+            tags.append(pixiv_api.ArtworkTag(name=tag, translation=tag_trans))
 
+        return tags
+
+    @property
+    def image_download_urls(self) -> list[str]:
+        if self.artwork_type == pixiv_api.ArtworkType.UGORIA:
+            return []
+        return list(pixiv_api.origin_url_2_all_url(self._original_url, self.nums))
 
-LazyResponse = typing.Callable[[], requests.Response]
+
+LazyArtwork = typing.Callable[[], "ArtworkRecord"]
 
 
 class ArtworkInfoImpl(pixiv_api.ArtworkInfo):
-    def __init__(self, res: LazyResponse | requests.Response) -> None:
-        self._raw_resp: LazyResponse | requests.Response = res
-        self._resp_json: dict = {}
-        self._timezone = datetime.datetime.now().astimezone().tzinfo.tzname(None)
-
-    def _get_body(self) -> dict:
-        if self._resp_json:
-            return self._resp_json['body']
-        if callable(self._raw_resp):
-            self._raw_resp = self._raw_resp()._raw_resp
-        if isinstance(self._raw_resp, requests.Response):
-            self._resp_json = self._raw_resp.json()
-        return self._resp_json['body']
+    """
+    懒加载的artwork信息，第一次访问属性时才请求并解析为ArtworkRecord，之后只保留ArtworkRecord
+    """
+    __slots__ = ('_raw_resp', '_record')
+
+    def __init__(self, res: LazyArtwork) -> None:
+        self._raw_resp: LazyArtwork | None = res
+        self._record: ArtworkRecord | None = None
+
+    @property
+    def loaded(self) -> bool:
+        return self._record is not None
+
+    def _get_record(self) -> ArtworkRecord:
+        if self._record is None:
+            self._record = self._raw_resp()
+            self._raw_resp = None
+        return self._record
 
     @property
     def artwork_id(self) -> int:
-        body = self._get_body()
-        return int(body['illustId'])
+        return self._get_record().artwork_id
 
     @property
     def user_id(self) -> int:
-        body = self._get_body()
-        return int(body['userId'])
+        return self._get_record().user_id
 
     @property
     def user_name(self) -> str:
-        body = self._get_body()
-        return body['userName']
+        return self._get_record().user_name
 
     @property
     def artwork_type(self) -> pixiv_api.ArtworkType:
-        body = self._get_body()
-        return pixiv_api.ArtworkType(
-            int(body['illustType'])
-        )
+        return self._get_record().artwork_type
 
     @property
     def tags(self) -> list[pixiv_api.ArtworkTag]:
-        body = self._get_body()
-        tags: list[pixiv_api.ArtworkTag] = []
-
-        used_tag = set()
-        for tag_info in body['tags']['tags']:
-            tag = tag_info['tag']
-            translation = tag_info.get('translation', {})
-
-            tag_trans = translation.get('en', '') if translation else ''
-
-            if tag in used_tag:  # 网站部分返回的会出现重复tag的问题（e.g. 69353795）
-                continue
-            used_tag.add(tag)
-            tags.append(pixiv_api.ArtworkTag(name=tag, translation=tag_trans))
-
-        return tags
+        return self._get_record().tags
 
     @property
-    def image_download_urls(self) -> Generator[str, None, None]:
-        if self.artwork_type == pixiv_api.ArtworkType.UGORIA:
-            return ("" for _ in [])
-
-        body = self._get_body()
-        original_url = body['urls']['original']
-        return pixiv_api.origin_url_2_all_url(original_url, self.nums)
+    def image_download_urls(self) -> list[str]:
+        return self._get_record().image_download_urls
 
     @property
     def title(self) -> str:
-        body = self._get_body()
-        return body['title']
+        return self._get_record().title
 
     @property
     def nums(self) -> int:
-        body = self._get_body()
-        return int(body['pageCount'])
+        return self._get_record().nums
 
     @property
     def restrict(self) -> pixiv_api.ArtworkRestrict:
-        body = self._get_body()
-        return pixiv_api.ArtworkRestrict(
-            int(body['xRestrict'])
-        )
+        return self._get_record().restrict
 
     @property
     def desc(self) -> str:
-        body = self._get_body()
-        return body['description']
+        return self._get_record().desc
 
     @property
     def bookmark_cnt(self) -> int:
-        body = self._get_body()
-        return body['bookmarkCount']
+        return self._get_record().bookmark_cnt
 
     @property
     def like_cnt(self) -> int:
-        body = self._get_body()
-        return body['likeCount']
+        return self._get_record().like_cnt
 
     @property
     def comment_cnt(self) -> int:
-        body = self._get_body()
-        return body['commentCount']
+        return self._get_record().comment_cnt
 
     @property
     def view_cnt(self) -> int:
-        body = self._get_body()
-        return body['viewCount']
+        return self._get_record().view_cnt
 
     @property
     def create_time(self) -> datetime.datetime:
-        body = self._get_body()
-        tm = datetime.datetime.fromisoformat(body['createDate'])
-        return tm.astimezone(None)
+        return self._get_record().create_time
 
     @property
     def upload_time(self) -> datetime.datetime:
-        body = self._get_body()
-        tm = datetime.datetime.fromisoformat(body['uploadDate'])
-        return tm.astimezone(None)
+        return self._get_record().upload_time
 
     @property
     def height(self) -> int:
-        body = self._get_body()
-        return body['height']
+        return self._get_record().height
 
     @property
     def width(self) -> int:
-        body = self._get_body()
-        return body['width']
+        return self._get_record().width
 
 
 class PixivApiImpl(pixiv_api.PixivApi):
     def __init__(self, meta: pixiv_api.ApiMetaArgument):
         self._meta = meta
-        self._session = requests.session()
-        self._init_session()
-
-    def _init_session(self):
-        if self._meta.PROXY:
-            self._session.proxies.update({
-                "http": self._meta.PROXY,
-                "https": self._meta.PROXY
-            })
-        if self._meta.PHPSESSID:
-            self._session.cookies.update({
-                "PHPSESSID": self._meta.PHPSESSID
-            })
+        self._cache = MetaCache(meta.CACHE_PATH, meta.CACHE_MAX_BYTES) if meta.CACHE_PATH else None
+        phpsessids = list(meta.PHPSESSIDS) or [meta.PHPSESSID]
+        self._primary_session = phpsessids[0]  # pin的请求使用的账号
+        self._identities = identity.new_identity_pool(
+            phpsessids,
+            list(meta.PROXIES) or [meta.PROXY],
+            meta.AJAX_RATE, meta.IMAGE_RATE, meta.TRANSPORT, meta.SCHEDULE,
+        )
+
+    def _get(self, url: str, headers: dict[str, str] = BASE_HEADERS, pin: bool = False, **kwargs) -> requests.Response:
+        # 所有请求都经过身份选择、限速与重试，结果与账号相关的接口pin为True，固定使用第一个身份
+        kwargs.setdefault("timeout", self._meta.TRANSPORT.timeout)
+        res = self._identities.send(url, headers, pin, **kwargs)
+        if not kwargs.get("stream"):
+            response_bytes.inc(len(res.content), endpoint=transport.endpoint(url))
+        return res
+
+    def transport_stats(self) -> dict[str, dict[str, dict[str, int]]]:
+        return {i.name: i.stats()["transport"] for i in self._identities.identities}
+
+    def identity_stats(self) -> list[dict]:
+        return self._identities.stats()
+
+    def _get_json(self, url: str, pin: bool = False, refresh: bool = False) -> dict:
+        # pin的接口结果与账号相关，缓存key中带上账号；refresh为True时不读缓存，但仍写入新的结果
+        with profiling.section(f"endpoint:{transport.endpoint(url)}"):
+            ttl = self._cache.ttl(url) if self._cache else 0
+            key = cache_key(url, self._primary_session if pin else "")
+            if ttl > 0 and not refresh:
+                cached = self._cache.get(key)
+                cache_requests.inc(result="miss" if cached is None else "hit")
+                if cached is not None:
+                    return cached
+            res = self._get(url, pin=pin)
+            obj = res.json()
+            if ttl > 0 and res.ok and not obj.get('error'):
+                self._cache.put(key, obj, ttl)
+            return obj
+
+    def cache_stats(self) -> dict:
+        return self._cache.stats() if self._cache else {}
 
     def _gen_artwork_info_dict(self, artwork_ids: list[int], options: pixiv_api.ArtworkOptions) -> dict[int, pixiv_api.ArtworkInfo]:
         return {
@@ -175,83 +235,179 @@ class PixivApiImpl(pixiv_api.PixivApi):
 
     def get_artwork_info(self, artwork_id: int, options: pixiv_api.ArtworkOptions) -> pixiv_api.ArtworkInfo:
         url = f"https://www.pixiv.net/ajax/illust/{artwork_id}?lang=zh"
-        res = self._session.get(url=url, headers=BASE_HEADERS)
-        return ArtworkInfoImpl(res)
+        return ArtworkRecord.from_body(self._get_json(url, refresh=options.update)['body'])
+
+    def get_ugoira_meta(self, artwork_id: int) -> pixiv_api.UgoiraMeta:
+        url = f"https://www.pixiv.net/ajax/illust/{artwork_id}/ugoira_meta?lang=zh"
+        body = self._get_json(url)['body']
+        return pixiv_api.UgoiraMeta(
+            src=body['src'],
+            original_src=body['originalSrc'],
+            mime_type=body['mime_type'],
+            frames=[pixiv_api.UgoiraFrame(file=f['file'], delay=f['delay']) for f in body['frames']],
+        )
+
+    def get_artworks_by_ids(self, artwork_ids: list[int], options: pixiv_api.ArtworkOptions) -> dict[int, pixiv_api.ArtworkInfo]:
+        return self._gen_artwork_info_dict(artwork_ids, options)
 
     def get_artworks_by_userid(self, user_id: int, options: pixiv_api.ArtworkOptions) -> dict[int, pixiv_api.ArtworkInfo]:
         url = f"https://www.pixiv.net/ajax/user/{user_id}/profile/all?lang=zh"
-        res = self._session.get(url=url, headers=BASE_HEADERS).json()
+        res = self._get_json(url)
         artwork_ids = res['body']['illusts']
         artwork_ids = list(set([int(i) for i in artwork_ids]))
         return self._gen_artwork_info_dict(artwork_ids, options)
 
-    def get_artworks_by_follow_latest(self, page: int, options: pixiv_api.ArtworkOptions) -> dict[int, pixiv_api.ArtworkInfo]:
+    def _get_follow_latest_page(self, options: pixiv_api.ArtworkOptions, page: int) -> tuple[list[int], bool]:
         url = f"https://www.pixiv.net/ajax/follow_latest/illust?p={page}&lang=zh"
         url += "&mode=r18" if options.only_r18 else "&mode=all"
-        res = self._session.get(url=url, headers=BASE_HEADERS).json()
-        artwork_ids = res['body']['page']['ids']
-        artwork_ids = list(set([int(i) for i in artwork_ids]))
+        res = self._get_json(url, pin=True)
+        artwork_ids = [int(i) for i in res['body']['page']['ids']]
+        return artwork_ids, not res['body']['page'].get('isLastPage', False)
+
+    def get_artworks_by_follow_latest(self, page: int, options: pixiv_api.ArtworkOptions) -> dict[int, pixiv_api.ArtworkInfo]:
+        artwork_ids, _ = self._get_follow_latest_page(options, page)
+        artwork_ids = list(set(artwork_ids))
         return self._gen_artwork_info_dict(artwork_ids, options)
 
+    def iter_artworks_by_follow_latest(self, options: pixiv_api.ArtworkOptions, min_artwork_id: int = 0,
+                                       max_pages: int | None = None) -> typing.Iterator[dict[int, pixiv_api.ArtworkInfo]]:
+        return self._iter_artwork_pages(
+            functools.partial(self._get_follow_latest_page, options), options,
+            stop=lambda artwork_id: artwork_id <= min_artwork_id, max_pages=max_pages
+        )
+
+    def _iter_artwork_pages(
+            self,
+            fetch_page: typing.Callable[[int], tuple[list[int], bool]],
+            options: pixiv_api.ArtworkOptions,
+            stop: typing.Callable[[int], bool] | None = None,
+            max_pages: int | None = None) -> typing.Iterator[dict[int, pixiv_api.ArtworkInfo]]:
+        # 逐页生成artwork，遇到stop返回True的id时丢弃它及之后的id并结束，翻页期间列表变化导致的重复id只保留第一次
+        seen: set[int] = set()
+        pages = pixiv_api.iter_pages(fetch_page, max_pages)
+        with contextlib.closing(pages):
+            for artwork_ids in pages:
+                stopped = False
+                page_ids = []
+                for artwork_id in artwork_ids:
+                    if stop is not None and stop(artwork_id):
+                        stopped = True
+                        break
+                    if artwork_id not in seen:
+                        seen.add(artwork_id)
+                        page_ids.append(artwork_id)
+                if page_ids:
+                    yield self._gen_artwork_info_dict(page_ids, options)
+                if stopped:
+                    return
+
     def get_artworks_by_pixivision_aid(self, aid: int, options: pixiv_api.ArtworkOptions) -> pixiv_api.PixivisionInfo:
         url = f"https://www.pixivision.net/zh/a/{aid}"
-        headers = {
-            **BASE_HEADERS,
-            "Accept-Language": "zh-CN,zh;q=0.9,en;q=0.8"
-        }
-        res = self._session.get(url=url, headers=headers).text
-
-        parsel_obj = parsel.Selector(res)
-        title = parsel_obj.xpath('//meta[@property="og:title"]/@content').get()
-        a_type = parsel_obj.css('.am__categoty-pr').css('a').attrib['data-gtm-label']
-        description = parsel_obj.xpath('//meta[@property="og:description"]/@content').get()
-
-        if a_type != 'illustration':
-            return pixiv_api.PixivisionInfo(aid, title, description, a_type, {})
-
-        artwork_ids = []
-        for i in parsel_obj.css('.am__body')[0].css('.am__work__main'):
-            href = i.css('a').attrib['href']
-            artwork_id = href.split('/')[-1]
-            if '?' in artwork_id:
-                artwork_id = artwork_id.split('?')[0]
-            artwork_ids.append(int(artwork_id))
-
-        res = pixiv_api.PixivisionInfo(
-            aid, title, description, a_type,
-            self._gen_artwork_info_dict(artwork_ids, options)
-        )
-        return res
+        with profiling.section(f"endpoint:{transport.endpoint(url)}"):
+            headers = {
+                **BASE_HEADERS,
+                "Accept-Language": "zh-CN,zh;q=0.9,en;q=0.8"
+            }
+            res = self._get(url, headers).text
+
+            parsel_obj = parsel.Selector(res)
+            title = parsel_obj.xpath('//meta[@property="og:title"]/@content').get()
+            a_type = parsel_obj.css('.am__categoty-pr').css('a').attrib['data-gtm-label']
+            description = parsel_obj.xpath('//meta[@property="og:description"]/@content').get()
+
+            if a_type != 'illustration':
+                return pixiv_api.PixivisionInfo(aid, title, description, a_type, {})
+
+            artwork_ids = []
+            for i in parsel_obj.css('.am__body')[0].css('.am__work__main'):
+                href = i.css('a').attrib['href']
+                artwork_id = href.split('/')[-1]
+                if '?' in artwork_id:
+                    artwork_id = artwork_id.split('?')[0]
+                artwork_ids.append(int(artwork_id))
+
+            res = pixiv_api.PixivisionInfo(
+                aid, title, description, a_type,
+                self._gen_artwork_info_dict(artwork_ids, options)
+            )
+            return res
 
     def get_image(self, url: str) -> bytes:
-        res = self._session.get(url=url, headers=BASE_HEADERS)
+        res = self._get(url)
         res.raise_for_status()
         return res.content
 
+    def download_image(self, url: str, file_path: pathlib.Path) -> int:
+        with profiling.section(f"endpoint:{transport.endpoint(url)}"):
+            return self._download_image(url, file_path)
+
+    def _download_image(self, url: str, file_path: pathlib.Path) -> int:
+        tmp_path = download.temp_path(file_path)
+        for retry in range(download.RESUME_RETRIES + 1):
+            try:
+                total = self._download_part(url, tmp_path)
+                break
+            except (requests.ConnectionError, requests.exceptions.ChunkedEncodingError):
+                # 已写入的部分保留在临时文件中，下次从断点继续
+                if retry >= download.RESUME_RETRIES:
+                    raise
+        return download.commit_download(tmp_path, file_path, total)
+
+    def _download_part(self, url: str, tmp_path: pathlib.Path) -> int:
+        # 响应关闭前一直占用图片服务器的一个并发数，416时先关闭响应再重新下载
+        offset, range_headers = download.resume_headers(tmp_path)
+        headers = {**BASE_HEADERS, **range_headers}
+        with self._get(url, headers, stream=True) as res:
+            if res.status_code != 416:
+                res.raise_for_status()
+                mode, total = download.begin_write(tmp_path, offset, res.status_code, res.headers)
+                written = 0
+                try:
+                    with tmp_path.open(mode) as f:
+                        for chunk in res.iter_content(download.CHUNK_SIZE):
+                            f.write(chunk)
+                            written += len(chunk)
+                finally:
+                    response_bytes.inc(written, endpoint=transport.endpoint(url))
+                return total
+            if download.range_not_satisfiable(tmp_path, offset, res.headers):
+                return offset
+        return self._download_part(url, tmp_path)
+
     def get_artworks_by_recommend(self, options: pixiv_api.ArtworkOptions) -> dict[int, pixiv_api.ArtworkInfo]:
         url = "https://www.pixiv.net/ajax/top/illust?lang=zh"
         url += "&mode=r18" if options.only_r18 else "&mode=all"
-        res = self._session.get(url=url, headers=BASE_HEADERS).json()
+        res = self._get_json(url, pin=True)
         artwork_ids = res['body']['page']['recommend']['ids']
         artwork_ids = list(set((int(i) for i in artwork_ids)))
         return self._gen_artwork_info_dict(artwork_ids, options)
 
-    def get_artworks_by_rank(self, rank_type: pixiv_api.RankType, date: int, page: int, options: pixiv_api.ArtworkOptions) -> dict[int, pixiv_api.ArtworkInfo]:
-        url = f"https://www.pixiv.net/ranking.php?&content=illust&p=1&format=json"
+    def _get_rank_page(self, rank_type: pixiv_api.RankType, date: int, page: int) -> tuple[list[int], bool]:
+        url = f"https://www.pixiv.net/ranking.php?&content=illust&p={page}&format=json"
         url += f"&date={date}&mode={rank_type.value}"
-        res = self._session.get(url=url, headers=BASE_HEADERS).json()
+        res = self._get_json(url)
+        # 超出最后一页时返回{"error": ...}
+        artwork_ids = [int(i['illust_id']) for i in res.get('contents', [])]
+        return artwork_ids, bool(res.get('next'))
 
-        artwork_ids = [int(i['illust_id']) for i in res['contents']]
-        artwork_ids = list(set((int(i) for i in artwork_ids)))
+    def get_artworks_by_rank(self, rank_type: pixiv_api.RankType, date: int, page: int, options: pixiv_api.ArtworkOptions) -> dict[int, pixiv_api.ArtworkInfo]:
+        artwork_ids, _ = self._get_rank_page(rank_type, date, page)
+        artwork_ids = list(set(artwork_ids))
         return self._gen_artwork_info_dict(artwork_ids, options)
 
+    def iter_artworks_by_rank(self, rank_type: pixiv_api.RankType, date: int, options: pixiv_api.ArtworkOptions,
+                              max_pages: int | None = None) -> typing.Iterator[dict[int, pixiv_api.ArtworkInfo]]:
+        return self._iter_artwork_pages(
+            functools.partial(self._get_rank_page, rank_type, date), options, max_pages=max_pages
+        )
+
     def get_artworks_by_request_recommend(self, options: pixiv_api.ArtworkOptions) -> dict[int, pixiv_api.ArtworkInfo]:
         url = f"https://www.pixiv.net/ajax/commission/page/request/complete/illust?p=1&lang=zh"
         if options.only_r18:
             url += "&mode=r18"
         elif options.only_non_r18:
             url += "&mode=safe"
-        res = self._session.get(url=url, headers=BASE_HEADERS).json()
+        res = self._get_json(url, pin=True)
         reqs = res['body']['requests']
         artwork_ids = [int(req['postWork']['postWorkId']) for req in reqs]
         artwork_ids = list(set(artwork_ids))
@@ -263,7 +419,7 @@ class PixivApiImpl(pixiv_api.PixivApi):
             url += "&mode=r18"
         elif options.only_non_r18:
             url += "&mode=safe"
-        res = self._session.get(url=url, headers=BASE_HEADERS).json()
+        res = self._get_json(url)
         userids = res['body']['page']['creatorUserIds']
         userids = list(set([int(creator) for creator in userids]))
         return userids
@@ -271,22 +427,33 @@ class PixivApiImpl(pixiv_api.PixivApi):
     def get_userids_by_similar_user(self, user_id: int, options: pixiv_api.ArtworkOptions) -> list[int]:
         url = f"https://www.pixiv.net/ajax/user/{user_id}/recommends?userNum=20&workNum=3&lang=zh"
         url += "&isR18=false" if options.only_non_r18 else "&isR18=true"
-        res = self._session.get(url=url, headers=BASE_HEADERS).json()
+        res = self._get_json(url)
         userids = [int(i['userId']) for i in res['body']['recommendUsers']]
         userids = list(set(userids))
         return userids
 
-    def get_artworks_by_user_bookmark(self, user_id: int, page: int, options: pixiv_api.ArtworkOptions) -> dict[int, pixiv_api.ArtworkInfo]:
-        url = f"https://www.pixiv.net/ajax/user/{user_id}/illusts/bookmarks?tag=&offset={(page-1)*48}&limit=48&rest=show&lang=zh"
-        res = self._session.get(url=url, headers=BASE_HEADERS).json()
+    def _get_user_bookmark_page(self, user_id: int, page: int) -> tuple[list[int], bool]:
+        url = f"https://www.pixiv.net/ajax/user/{user_id}/illusts/bookmarks?tag=&offset={(page-1)*BOOKMARK_PAGE_SIZE}&limit={BOOKMARK_PAGE_SIZE}&rest=show&lang=zh"
+        res = self._get_json(url)
         artwork_ids = [int(i['id']) for i in res['body']['works']]
+        return artwork_ids, page * BOOKMARK_PAGE_SIZE < res['body'].get('total', 0)
+
+    def get_artworks_by_user_bookmark(self, user_id: int, page: int, options: pixiv_api.ArtworkOptions) -> dict[int, pixiv_api.ArtworkInfo]:
+        artwork_ids, _ = self._get_user_bookmark_page(user_id, page)
         artwork_ids = list(set(artwork_ids))
         return self._gen_artwork_info_dict(artwork_ids, options)
 
+    def iter_artworks_by_user_bookmark(self, user_id: int, options: pixiv_api.ArtworkOptions, until_artwork_id: int | None = None,
+                                       max_pages: int | None = None) -> typing.Iterator[dict[int, pixiv_api.ArtworkInfo]]:
+        return self._iter_artwork_pages(
+            functools.partial(self._get_user_bookmark_page, user_id), options,
+            stop=lambda artwork_id: artwork_id == until_artwork_id, max_pages=max_pages
+        )
+
     def get_artworks_by_tag_popular(self, tag_name: str, options: pixiv_api.ArtworkOptions) -> dict[int, pixiv_api.ArtworkInfo]:
         tag_name = requests.utils.quote(tag_name)
         url = f"https://www.pixiv.net/ajax/search/top/{tag_name}?lang=zh"
-        res = self._session.get(url=url, headers=BASE_HEADERS).json()
+        res = self._get_json(url)
         populars = res['body']['popular']
         artworks = populars['permanent'] + populars['recent']
         artwork_ids = [int(i["id"]) for i in artworks]
@@ -295,14 +462,14 @@ class PixivApiImpl(pixiv_api.PixivApi):
 
     def get_userids_by_recommend(self, options: pixiv_api.ArtworkOptions) -> list[int]:
         url = "https://www.pixiv.net/ajax/top/illust?mode=all&lang=zh"
-        res = self._session.get(url=url, headers=BASE_HEADERS).json()
+        res = self._get_json(url, pin=True)
         userids = [int(i['userId']) for i in res['body']['users']]
         userids = list(set(userids))
         return userids
 
     def get_artworks_by_similar_artwork(self, artwork_id: int, options: pixiv_api.ArtworkOptions) -> dict[int, pixiv_api.ArtworkInfo]:
         url = f"https://www.pixiv.net/ajax/illust/{artwork_id}/recommend/init?limit=20&lang=zh"
-        res = self._session.get(url=url, headers=BASE_HEADERS).json()
+        res = self._get_json(url)
         artwork_ids = [int(i['id']) for i in res['body']['illusts']]
         artwork_ids = list(set(artwork_ids))
         return self._gen_artwork_info_dict(artwork_ids, options)
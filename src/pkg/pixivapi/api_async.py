@@ -0,0 +1,457 @@
+import pkg.pixivapi as pixiv_api
+import pkg.metrics as metrics
+from pkg.pixivapi.api import BASE_HEADERS, BOOKMARK_PAGE_SIZE, ArtworkInfoImpl, ArtworkRecord, cache_requests, response_bytes
+from pkg.pixivapi import download
+from pkg.pixivapi import ratelimit
+from pkg.pixivapi import transport
+from pkg.pixivapi.cache import MetaCache, cache_key
+import asyncio
+import functools
+import httpx
+import parsel
+import pathlib
+import requests
+import time
+import typing
+
+
+MAX_CONCURRENCY = 64  # 同时进行中的请求数上限
+
+RETRY_EXCEPTIONS = (httpx.TimeoutException, httpx.NetworkError)
+
+# 与同步实现共用同名指标
+_requests = metrics.counter("pixiv_requests_total")
+_latency = metrics.histogram("pixiv_request_seconds")
+_retries = metrics.counter("pixiv_request_retries_total")
+
+
+def _raise(e: Exception):
+    raise e
+
+
+def _not_loaded():
+    raise RuntimeError("artwork info is not loaded, await AsyncPixivApiImpl.load_artworks() first")
+
+
+async def _aiter_pages(fetch_page: typing.Callable[[int], typing.Awaitable[tuple[list[int], bool]]],
+                       max_pages: int | None = None) -> typing.AsyncIterator[list[int]]:
+    # pixiv_api.iter_pages的异步版本，处理当前页时下一页在后台task中获取
+    page = 1
+    task = asyncio.ensure_future(fetch_page(page))
+    try:
+        while True:
+            artwork_ids, has_next = await task
+            last = not artwork_ids or not has_next or (max_pages is not None and page >= max_pages)
+            if not last:
+                task = asyncio.ensure_future(fetch_page(page + 1))
+            if artwork_ids:
+                yield artwork_ids
+            if last:
+                return
+            page += 1
+    finally:
+        task.cancel()
+
+
+class AsyncArtworkInfoImpl(ArtworkInfoImpl):
+    """
+    异步实现的懒加载artwork信息，await load()之后才能访问属性
+    """
+    __slots__ = ('_load',)
+
+    def __init__(self, load: typing.Callable[[], typing.Awaitable[pixiv_api.ArtworkInfo]]) -> None:
+        super().__init__(_not_loaded)
+        self._load = load
+
+    async def load(self) -> None:
+        if self._load is None:
+            return
+        load, self._load = self._load, None
+        try:
+            self._record = await load()
+        except Exception as e:
+            # 与同步实现一致，获取失败的artwork在访问属性时才抛出异常
+            self._raw_resp = functools.partial(_raise, e)
+
+
+class _LoopState(typing.NamedTuple):
+    # 与事件循环绑定的对象，在哪个循环中使用就在哪个循环中创建
+    loop: asyncio.AbstractEventLoop
+    client: httpx.AsyncClient
+    semaphore: asyncio.Semaphore
+    limiter: ratelimit.AsyncRateLimiter
+
+
+class AsyncPixivApiImpl(pixiv_api.PixivApi):
+    """
+    PixivApi的异步实现，接口与PixivApiImpl一致，但全部为协程
+
+    get_artworks_by_*返回的dict中artwork信息尚未获取，可以先按id过滤(如跳过已存在的artwork)，
+    再对剩下的调用load_artworks()并发获取
+
+    请求与同步实现一样按AJAX_RATE/IMAGE_RATE限速，429/5xx与连接错误时重试；
+    只支持一个身份，PHPSESSIDS/PROXIES中有多个时抛出ValueError
+
+    httpx连接池、并发数与限速器都绑定事件循环，在第一次请求时为当前循环创建，
+    换了事件循环(如再次asyncio.run)时重新创建，限速器学到的并发上限也随之重置
+    """
+
+    def __init__(self, meta: pixiv_api.ApiMetaArgument, max_concurrency: int = MAX_CONCURRENCY):
+        if len(meta.PHPSESSIDS) > 1 or len(meta.PROXIES) > 1:
+            raise ValueError("multiple PHPSESSIDS/PROXIES are not supported by the async backend")
+        self._meta = meta
+        self._max_concurrency = max_concurrency
+        self._state: _LoopState | None = None
+        self._cache = MetaCache(meta.CACHE_PATH, meta.CACHE_MAX_BYTES) if meta.CACHE_PATH else None
+
+    @property
+    def _phpsessid(self) -> str:
+        return (self._meta.PHPSESSIDS or (self._meta.PHPSESSID,))[0]
+
+    def _new_client(self) -> httpx.AsyncClient:
+        proxy = (self._meta.PROXIES or (self._meta.PROXY,))[0]
+        cookies = {"PHPSESSID": self._phpsessid} if self._phpsessid else None
+        return transport.new_async_client(
+            proxy, self._meta.TRANSPORT,
+            headers=BASE_HEADERS,
+            cookies=cookies,
+            follow_redirects=True,
+        )
+
+    def _loop_state(self) -> _LoopState:
+        loop = asyncio.get_running_loop()
+        if self._state is None or self._state.loop is not loop:
+            # 之前的循环已经结束，其中的连接无法再关闭，直接丢弃
+            self._state = _LoopState(
+                loop, self._new_client(), asyncio.Semaphore(self._max_concurrency),
+                ratelimit.AsyncRateLimiter(self._meta.AJAX_RATE, self._meta.IMAGE_RATE),
+            )
+        return self._state
+
+    def transport_stats(self) -> dict[str, dict[str, int]]:
+        return transport.async_client_stats(self._state.client) if self._state is not None else {}
+
+    async def aclose(self):
+        if self._state is not None and self._state.loop is asyncio.get_running_loop():
+            await self._state.client.aclose()
+        self._state = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
+
+    async def _timed_get(self, url: str, stream: bool = False, **kwargs) -> httpx.Response:
+        name = transport.endpoint(url)
+        state = self._loop_state()
+        async with state.semaphore:
+            start = time.monotonic()
+            status = "error"
+            try:
+                request = state.client.build_request("GET", transport.rewrite_url(url, self._meta.TRANSPORT.hosts), **kwargs)
+                res = await state.client.send(request, stream=stream)
+                status = res.status_code
+                return res
+            finally:
+                _latency.observe(time.monotonic() - start, endpoint=name)
+                _requests.inc(endpoint=name, status=status)
+
+    async def _get(self, url: str, stream: bool = False, **kwargs) -> httpx.Response:
+        """
+        在限速下请求，重试规则与同步实现相同(见ratelimit.RateLimiter)，重试用尽后返回最后一次的响应或抛出最后一次的异常
+        stream为True时由调用方读取并关闭响应
+        """
+        limiter = self._loop_state().limiter
+        max_retries = limiter.max_retries
+        for attempt in range(max_retries + 1):
+            if attempt:
+                _retries.inc(endpoint=transport.endpoint(url))
+            try:
+                res, delay = await limiter.attempt(
+                    url, functools.partial(self._timed_get, url, stream, **kwargs), attempt, stream
+                )
+            except RETRY_EXCEPTIONS:
+                if attempt >= max_retries:
+                    raise
+                res, delay = None, ratelimit.backoff_delay(attempt)
+            if delay is None or attempt >= max_retries:
+                break
+            if res is not None:
+                await res.aclose()
+            await asyncio.sleep(delay)
+        if not stream:
+            response_bytes.inc(len(res.content), endpoint=transport.endpoint(url))
+        return res
+
+    async def _get_json(self, url: str, pin: bool = False, refresh: bool = False) -> dict:
+        # sqlite缓存的读写在线程中执行，不阻塞事件循环；pin与refresh的含义与同步实现相同
+        ttl = self._cache.ttl(url) if self._cache else 0
+        key = cache_key(url, self._phpsessid if pin else "")
+        if ttl > 0 and not refresh:
+            cached = await asyncio.to_thread(self._cache.get, key)
+            cache_requests.inc(result="miss" if cached is None else "hit")
+            if cached is not None:
+                return cached
+        res = await self._get(url)
+        obj = res.json()
+        if ttl > 0 and res.is_success and not obj.get('error'):
+            await asyncio.to_thread(self._cache.put, key, obj, ttl)
+        return obj
+
+    def cache_stats(self) -> dict:
+        return self._cache.stats() if self._cache else {}
+
+    def _gen_artwork_info_dict(self, artwork_ids: list[int], options: pixiv_api.ArtworkOptions) -> dict[int, pixiv_api.ArtworkInfo]:
+        return {
+            i: AsyncArtworkInfoImpl(functools.partial(
+                self.get_artwork_info, artwork_id=i, options=options
+            ))
+            for i in artwork_ids
+        }
+
+    async def load_artworks(self, artworks: dict[int, pixiv_api.ArtworkInfo]) -> None:
+        # 并发获取artworks中尚未获取的artwork信息，并发数受max_concurrency限制
+        await asyncio.gather(*(
+            info.load()
+            for info in artworks.values()
+            if isinstance(info, AsyncArtworkInfoImpl)
+        ))
+
+    async def get_artwork_info(self, artwork_id: int, options: pixiv_api.ArtworkOptions) -> pixiv_api.ArtworkInfo:
+        url = f"https://www.pixiv.net/ajax/illust/{artwork_id}?lang=zh"
+        res = await self._get_json(url, refresh=options.update)
+        return ArtworkRecord.from_body(res['body'])
+
+    async def get_ugoira_meta(self, artwork_id: int) -> pixiv_api.UgoiraMeta:
+        url = f"https://www.pixiv.net/ajax/illust/{artwork_id}/ugoira_meta?lang=zh"
+        body = (await self._get_json(url))['body']
+        return pixiv_api.UgoiraMeta(
+            src=body['src'],
+            original_src=body['originalSrc'],
+            mime_type=body['mime_type'],
+            frames=[pixiv_api.UgoiraFrame(file=f['file'], delay=f['delay']) for f in body['frames']],
+        )
+
+    async def get_artworks_by_ids(self, artwork_ids: list[int], options: pixiv_api.ArtworkOptions) -> dict[int, pixiv_api.ArtworkInfo]:
+        return self._gen_artwork_info_dict(artwork_ids, options)
+
+    async def get_artworks_by_userid(self, user_id: int, options: pixiv_api.ArtworkOptions) -> dict[int, pixiv_api.ArtworkInfo]:
+        url = f"https://www.pixiv.net/ajax/user/{user_id}/profile/all?lang=zh"
+        res = await self._get_json(url)
+        artwork_ids = res['body']['illusts']
+        artwork_ids = list(set([int(i) for i in artwork_ids]))
+        return self._gen_artwork_info_dict(artwork_ids, options)
+
+    async def _get_follow_latest_page(self, options: pixiv_api.ArtworkOptions, page: int) -> tuple[list[int], bool]:
+        url = f"https://www.pixiv.net/ajax/follow_latest/illust?p={page}&lang=zh"
+        url += "&mode=r18" if options.only_r18 else "&mode=all"
+        res = await self._get_json(url, pin=True)
+        artwork_ids = [int(i) for i in res['body']['page']['ids']]
+        return artwork_ids, not res['body']['page'].get('isLastPage', False)
+
+    async def get_artworks_by_follow_latest(self, page: int, options: pixiv_api.ArtworkOptions) -> dict[int, pixiv_api.ArtworkInfo]:
+        artwork_ids, _ = await self._get_follow_latest_page(options, page)
+        artwork_ids = list(set(artwork_ids))
+        return self._gen_artwork_info_dict(artwork_ids, options)
+
+    def iter_artworks_by_follow_latest(self, options: pixiv_api.ArtworkOptions, min_artwork_id: int = 0,
+                                       max_pages: int | None = None) -> typing.AsyncIterator[dict[int, pixiv_api.ArtworkInfo]]:
+        return self._iter_artwork_pages(
+            functools.partial(self._get_follow_latest_page, options), options,
+            stop=lambda artwork_id: artwork_id <= min_artwork_id, max_pages=max_pages
+        )
+
+    async def _iter_artwork_pages(
+            self,
+            fetch_page: typing.Callable[[int], typing.Awaitable[tuple[list[int], bool]]],
+            options: pixiv_api.ArtworkOptions,
+            stop: typing.Callable[[int], bool] | None = None,
+            max_pages: int | None = None) -> typing.AsyncIterator[dict[int, pixiv_api.ArtworkInfo]]:
+        seen: set[int] = set()
+        pages = _aiter_pages(fetch_page, max_pages)
+        try:
+            async for artwork_ids in pages:
+                stopped = False
+                page_ids = []
+                for artwork_id in artwork_ids:
+                    if stop is not None and stop(artwork_id):
+                        stopped = True
+                        break
+                    if artwork_id not in seen:
+                        seen.add(artwork_id)
+                        page_ids.append(artwork_id)
+                if page_ids:
+                    yield self._gen_artwork_info_dict(page_ids, options)
+                if stopped:
+                    return
+        finally:
+            await pages.aclose()
+
+    async def get_artworks_by_pixivision_aid(self, aid: int, options: pixiv_api.ArtworkOptions) -> pixiv_api.PixivisionInfo:
+        url = f"https://www.pixivision.net/zh/a/{aid}"
+        headers = {
+            **BASE_HEADERS,
+            "Accept-Language": "zh-CN,zh;q=0.9,en;q=0.8"
+        }
+        res = (await self._get(url, headers=headers)).text
+
+        parsel_obj = parsel.Selector(res)
+        title = parsel_obj.xpath('//meta[@property="og:title"]/@content').get()
+        a_type = parsel_obj.css('.am__categoty-pr').css('a').attrib['data-gtm-label']
+        description = parsel_obj.xpath('//meta[@property="og:description"]/@content').get()
+
+        if a_type != 'illustration':
+            return pixiv_api.PixivisionInfo(aid, title, description, a_type, {})
+
+        artwork_ids = []
+        for i in parsel_obj.css('.am__body')[0].css('.am__work__main'):
+            href = i.css('a').attrib['href']
+            artwork_id = href.split('/')[-1]
+            if '?' in artwork_id:
+                artwork_id = artwork_id.split('?')[0]
+            artwork_ids.append(int(artwork_id))
+
+        return pixiv_api.PixivisionInfo(
+            aid, title, description, a_type,
+            self._gen_artwork_info_dict(artwork_ids, options)
+        )
+
+    async def get_image(self, url: str) -> bytes:
+        res = await self._get(url)
+        res.raise_for_status()
+        return res.content
+
+    async def download_image(self, url: str, file_path: pathlib.Path) -> int:
+        tmp_path = download.temp_path(file_path)
+        for retry in range(download.RESUME_RETRIES + 1):
+            try:
+                total = await self._download_part(url, tmp_path)
+                break
+            except httpx.TransportError:
+                # 已写入的部分保留在临时文件中，下次从断点继续
+                if retry >= download.RESUME_RETRIES:
+                    raise
+        return download.commit_download(tmp_path, file_path, total)
+
+    async def _download_part(self, url: str, tmp_path: pathlib.Path) -> int:
+        offset, headers = download.resume_headers(tmp_path)
+        res = await self._get(url, stream=True, headers=headers)
+        try:
+            if res.status_code == 416:
+                if download.range_not_satisfiable(tmp_path, offset, res.headers):
+                    return offset
+            else:
+                res.raise_for_status()
+                mode, total = download.begin_write(tmp_path, offset, res.status_code, res.headers)
+                written = 0
+                try:
+                    with tmp_path.open(mode) as f:
+                        async for chunk in res.aiter_bytes(download.CHUNK_SIZE):
+                            f.write(chunk)
+                            written += len(chunk)
+                finally:
+                    response_bytes.inc(written, endpoint=transport.endpoint(url))
+                return total
+        finally:
+            await res.aclose()
+        return await self._download_part(url, tmp_path)
+
+    async def get_artworks_by_recommend(self, options: pixiv_api.ArtworkOptions) -> dict[int, pixiv_api.ArtworkInfo]:
+        url = "https://www.pixiv.net/ajax/top/illust?lang=zh"
+        url += "&mode=r18" if options.only_r18 else "&mode=all"
+        res = await self._get_json(url, pin=True)
+        artwork_ids = res['body']['page']['recommend']['ids']
+        artwork_ids = list(set((int(i) for i in artwork_ids)))
+        return self._gen_artwork_info_dict(artwork_ids, options)
+
+    async def _get_rank_page(self, rank_type: pixiv_api.RankType, date: int, page: int) -> tuple[list[int], bool]:
+        url = f"https://www.pixiv.net/ranking.php?&content=illust&p={page}&format=json"
+        url += f"&date={date}&mode={rank_type.value}"
+        res = await self._get_json(url)
+        artwork_ids = [int(i['illust_id']) for i in res.get('contents', [])]
+        return artwork_ids, bool(res.get('next'))
+
+    async def get_artworks_by_rank(self, rank_type: pixiv_api.RankType, date: int, page: int, options: pixiv_api.ArtworkOptions) -> dict[int, pixiv_api.ArtworkInfo]:
+        artwork_ids, _ = await self._get_rank_page(rank_type, date, page)
+        artwork_ids = list(set(artwork_ids))
+        return self._gen_artwork_info_dict(artwork_ids, options)
+
+    def iter_artworks_by_rank(self, rank_type: pixiv_api.RankType, date: int, options: pixiv_api.ArtworkOptions,
+                              max_pages: int | None = None) -> typing.AsyncIterator[dict[int, pixiv_api.ArtworkInfo]]:
+        return self._iter_artwork_pages(
+            functools.partial(self._get_rank_page, rank_type, date), options, max_pages=max_pages
+        )
+
+    async def get_artworks_by_request_recommend(self, options: pixiv_api.ArtworkOptions) -> dict[int, pixiv_api.ArtworkInfo]:
+        url = f"https://www.pixiv.net/ajax/commission/page/request/complete/illust?p=1&lang=zh"
+        if options.only_r18:
+            url += "&mode=r18"
+        elif options.only_non_r18:
+            url += "&mode=safe"
+        res = await self._get_json(url, pin=True)
+        reqs = res['body']['requests']
+        artwork_ids = [int(req['postWork']['postWorkId']) for req in reqs]
+        artwork_ids = list(set(artwork_ids))
+        return self._gen_artwork_info_dict(artwork_ids, options)
+
+    async def get_userids_by_request_creator(self, options: pixiv_api.ArtworkOptions) -> list[int]:
+        url = f"https://www.pixiv.net/ajax/commission/page/request/creators/illust/ids?&follows=0&p=1&lang=zh"
+        if options.only_r18:
+            url += "&mode=r18"
+        elif options.only_non_r18:
+            url += "&mode=safe"
+        res = await self._get_json(url)
+        userids = res['body']['page']['creatorUserIds']
+        userids = list(set([int(creator) for creator in userids]))
+        return userids
+
+    async def get_userids_by_similar_user(self, user_id: int, options: pixiv_api.ArtworkOptions) -> list[int]:
+        url = f"https://www.pixiv.net/ajax/user/{user_id}/recommends?userNum=20&workNum=3&lang=zh"
+        url += "&isR18=false" if options.only_non_r18 else "&isR18=true"
+        res = await self._get_json(url)
+        userids = [int(i['userId']) for i in res['body']['recommendUsers']]
+        userids = list(set(userids))
+        return userids
+
+    async def _get_user_bookmark_page(self, user_id: int, page: int) -> tuple[list[int], bool]:
+        url = f"https://www.pixiv.net/ajax/user/{user_id}/illusts/bookmarks?tag=&offset={(page-1)*BOOKMARK_PAGE_SIZE}&limit={BOOKMARK_PAGE_SIZE}&rest=show&lang=zh"
+        res = await self._get_json(url)
+        artwork_ids = [int(i['id']) for i in res['body']['works']]
+        return artwork_ids, page * BOOKMARK_PAGE_SIZE < res['body'].get('total', 0)
+
+    async def get_artworks_by_user_bookmark(self, user_id: int, page: int, options: pixiv_api.ArtworkOptions) -> dict[int, pixiv_api.ArtworkInfo]:
+        artwork_ids, _ = await self._get_user_bookmark_page(user_id, page)
+        artwork_ids = list(set(artwork_ids))
+        return self._gen_artwork_info_dict(artwork_ids, options)
+
+    def iter_artworks_by_user_bookmark(self, user_id: int, options: pixiv_api.ArtworkOptions, until_artwork_id: int | None = None,
+                                       max_pages: int | None = None) -> typing.AsyncIterator[dict[int, pixiv_api.ArtworkInfo]]:
+        return self._iter_artwork_pages(
+            functools.partial(self._get_user_bookmark_page, user_id), options,
+            stop=lambda artwork_id: artwork_id == until_artwork_id, max_pages=max_pages
+        )
+
+    async def get_artworks_by_tag_popular(self, tag_name: str, options: pixiv_api.ArtworkOptions) -> dict[int, pixiv_api.ArtworkInfo]:
+        tag_name = requests.utils.quote(tag_name)
+        url = f"https://www.pixiv.net/ajax/search/top/{tag_name}?lang=zh"
+        res = await self._get_json(url)
+        populars = res['body']['popular']
+        artworks = populars['permanent'] + populars['recent']
+        artwork_ids = [int(i["id"]) for i in artworks]
+        artwork_ids = list(set(artwork_ids))
+        return self._gen_artwork_info_dict(artwork_ids, options)
+
+    async def get_userids_by_recommend(self, options: pixiv_api.ArtworkOptions) -> list[int]:
+        url = "https://www.pixiv.net/ajax/top/illust?mode=all&lang=zh"
+        res = await self._get_json(url, pin=True)
+        userids = [int(i['userId']) for i in res['body']['users']]
+        userids = list(set(userids))
+        return userids
+
+    async def get_artworks_by_similar_artwork(self, artwork_id: int, options: pixiv_api.ArtworkOptions) -> dict[int, pixiv_api.ArtworkInfo]:
+        url = f"https://www.pixiv.net/ajax/illust/{artwork_id}/recommend/init?limit=20&lang=zh"
+        res = await self._get_json(url)
+        artwork_ids = [int(i['id']) for i in res['body']['illusts']]
+        artwork_ids = list(set(artwork_ids))
+        return self._gen_artwork_info_dict(artwork_ids, options)
@@ -0,0 +1,125 @@
+"""
+接口json响应的本地缓存，保存在sqlite文件中
+
+以完整url(接口路径+参数)为key，zlib压缩后存储，每个接口有各自的过期时间，
+总大小超过上限时按最近访问时间淘汰
+结果与账号相关的接口(关注的最新作品、推荐等)的key中带有PHPSESSID的hash，不同账号互不命中
+
+作品详情中的收藏数、点赞数等会变化，只缓存几个小时，更新已存在的artwork时不读缓存
+"""
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+import zlib
+
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+ATIME_RESOLUTION = 60  # 访问时间的更新粒度(秒)，避免每次命中都写库
+
+HOUR = 3600
+DAY = 24 * HOUR
+
+# (url匹配规则, 过期时间秒)，按顺序匹配第一个，未匹配的接口不缓存
+DEFAULT_TTLS: list[tuple[str, int]] = [
+    (r"/ajax/illust/\d+/recommend/", DAY),
+    (r"/ajax/illust/\d+/ugoira_meta", 30 * DAY),
+    (r"/ajax/illust/\d+\?", 6 * HOUR),
+    (r"/ajax/follow_latest/", 10 * 60),
+    (r"/ajax/top/illust", 10 * 60),
+    (r"/ajax/user/\d+/profile/all", HOUR),
+    (r"/ajax/user/\d+/illusts/bookmarks", HOUR),
+    (r"/ajax/user/\d+/recommends", DAY),
+    (r"/ajax/search/top/", HOUR),
+    (r"/ajax/commission/", HOUR),
+    (r"/ranking\.php", DAY),
+]
+
+
+def cache_key(url: str, session_id: str = "") -> str:
+    # session_id非空时key只对该账号有效
+    if not session_id:
+        return url
+    return f"{url}#{hashlib.sha256(session_id.encode('utf-8')).hexdigest()[:16]}"
+
+
+class MetaCache(object):
+    def __init__(self, path: str, max_bytes: int = DEFAULT_MAX_BYTES, ttls: list[tuple[str, int]] | None = None):
+        self._max_bytes = max_bytes
+        self._ttls = [(re.compile(pattern), ttl) for pattern, ttl in (ttls or DEFAULT_TTLS)]
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            "key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, "
+            "expire REAL NOT NULL, atime REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS cache_atime ON cache (atime)")
+        self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+        self.hits = 0
+        self.misses = 0
+
+    def ttl(self, url: str) -> int:
+        for pattern, ttl in self._ttls:
+            if pattern.search(url):
+                return ttl
+        return 0
+
+    def get(self, key: str) -> dict | None:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, expire, atime FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is None or row[1] < now:
+                if row is not None:
+                    self._delete(key)
+                self.misses += 1
+                return None
+            if now - row[2] > ATIME_RESOLUTION:
+                self._conn.execute("UPDATE cache SET atime = ? WHERE key = ?", (now, key))
+            self.hits += 1
+        return json.loads(zlib.decompress(row[0]))
+
+    def put(self, key: str, obj: dict, ttl: int):
+        value = zlib.compress(json.dumps(obj, ensure_ascii=False).encode("utf-8"))
+        now = time.time()
+        with self._lock:
+            self._delete(key)
+            self._conn.execute(
+                "INSERT INTO cache (key, value, size, expire, atime) VALUES (?, ?, ?, ?, ?)",
+                (key, value, len(value), now + ttl, now)
+            )
+            self._total_bytes += len(value)
+            if self._total_bytes > self._max_bytes:
+                self._evict()
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+            return {"hits": self.hits, "misses": self.misses, "entries": entries, "bytes": self._total_bytes}
+
+    def _delete(self, key: str):
+        row = self._conn.execute("SELECT size FROM cache WHERE key = ?", (key,)).fetchone()
+        if row is not None:
+            self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+            self._total_bytes -= row[0]
+
+    def _evict(self):
+        # 先删过期的，仍超出上限时按访问时间从旧到新删除，删到上限的90%
+        now = time.time()
+        self._conn.execute("DELETE FROM cache WHERE expire < ?", (now,))
+        self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+        target = self._max_bytes * 0.9
+        if self._total_bytes <= target:
+            return
+        freed = 0
+        cutoff = None
+        for key, size, atime in self._conn.execute("SELECT key, size, atime FROM cache ORDER BY atime"):
+            freed += size
+            cutoff = atime
+            if self._total_bytes - freed <= target:
+                break
+        self._conn.execute("DELETE FROM cache WHERE atime <= ?", (cutoff,))
+        self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
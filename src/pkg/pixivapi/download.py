@@ -0,0 +1,92 @@
+"""
+图片下载的断点续传辅助函数，同步与异步实现共用
+
+下载过程中数据写入`<name>.part`，服务器返回的ETag保存在`<name>.part.etag`，
+中断后再次下载时通过Range + If-Range从已下载的位置继续，
+文件在服务器端发生变化时服务器会返回完整内容，此时从头开始写入
+"""
+import os
+import pathlib
+import typing
+
+
+CHUNK_SIZE = 64 * 1024  # 流式下载时每次写入的块大小
+RESUME_RETRIES = 3  # 单次下载中连接断开后自动续传的次数
+
+
+def temp_path(file_path: pathlib.Path) -> pathlib.Path:
+    return file_path.with_name(file_path.name + ".part")
+
+
+def _etag_path(tmp_path: pathlib.Path) -> pathlib.Path:
+    return tmp_path.with_name(tmp_path.name + ".etag")
+
+
+def discard(tmp_path: pathlib.Path):
+    tmp_path.unlink(missing_ok=True)
+    _etag_path(tmp_path).unlink(missing_ok=True)
+
+
+def resume_headers(tmp_path: pathlib.Path) -> tuple[int, dict[str, str]]:
+    # 返回已下载的字节数以及续传需要附加的请求头
+    offset = tmp_path.stat().st_size if tmp_path.exists() else 0
+    if offset <= 0:
+        return 0, {}
+    headers = {"Range": f"bytes={offset}-"}
+    etag_path = _etag_path(tmp_path)
+    if etag_path.exists():
+        headers["If-Range"] = etag_path.read_text()
+    return offset, headers
+
+
+def expected_size(headers: typing.Mapping[str, str]) -> int:
+    # 返回-1表示无法校验(没有Content-Length或内容被压缩过)
+    if "Content-Length" not in headers or headers.get("Content-Encoding", "identity") != "identity":
+        return -1
+    return int(headers["Content-Length"])
+
+
+def _parse_content_range(value: str) -> tuple[int, int]:
+    # "bytes 100-199/1000" -> (100, 1000), "bytes */1000" -> (-1, 1000)
+    unit_range, _, total = value.partition("/")
+    byte_range = unit_range.split(" ")[-1]
+    start = -1 if byte_range == "*" else int(byte_range.split("-")[0])
+    return start, -1 if total in ("", "*") else int(total)
+
+
+def begin_write(tmp_path: pathlib.Path, offset: int, status_code: int, headers: typing.Mapping[str, str]) -> tuple[str, int]:
+    """
+    根据响应决定临时文件的打开方式，返回(文件打开模式, 文件总大小)，总大小未知时为-1
+    """
+    etag = headers.get("ETag")
+    if etag:
+        _etag_path(tmp_path).write_text(etag)
+    if status_code == 206:
+        start, total = _parse_content_range(headers.get("Content-Range", ""))
+        if start != offset:
+            discard(tmp_path)
+            raise IOError(f"unexpected content range for {tmp_path.name}: {headers.get('Content-Range')}")
+        return "ab", total
+    return "wb", expected_size(headers)
+
+
+def range_not_satisfiable(tmp_path: pathlib.Path, offset: int, headers: typing.Mapping[str, str]) -> bool:
+    """
+    处理416响应，返回临时文件是否已经完整；不完整时丢弃临时文件，需要从头下载
+    """
+    _, total = _parse_content_range(headers.get("Content-Range", ""))
+    if total == offset:
+        return True
+    discard(tmp_path)
+    return False
+
+
+def commit_download(tmp_path: pathlib.Path, file_path: pathlib.Path, total: int) -> int:
+    size = tmp_path.stat().st_size
+    if total >= 0 and size != total:
+        if size > total:
+            discard(tmp_path)
+        raise IOError(f"incomplete download {file_path.name}: {size}/{total} bytes")
+    os.replace(tmp_path, file_path)
+    _etag_path(tmp_path).unlink(missing_ok=True)
+    return size
@@ -0,0 +1,177 @@
+"""
+多账号/多代理轮换
+
+每个身份(PHPSESSID + 代理)有独立的requests会话、限速器和健康统计，
+请求时按最少进行中请求数(least_loaded)或轮询(round_robin)选择身份，
+被限流(429/503)或连接失败的身份暂时移出轮换，连续失败时冷却时间翻倍
+
+与账号相关的接口(关注的最新作品、首页推荐等)固定使用第一个身份(pin)，
+否则翻页时各页可能来自不同账号
+"""
+import threading
+import time
+import requests
+import pkg.metrics as metrics
+from pkg.pixivapi import ratelimit
+from pkg.pixivapi import transport
+
+
+COOLDOWN_BASE = 30.0  # 身份被限流后第一次冷却的秒数
+COOLDOWN_CAP = 15 * 60.0
+
+LEAST_LOADED = "least_loaded"
+ROUND_ROBIN = "round_robin"
+
+_requests = metrics.counter("pixiv_requests_total", "按接口和状态码统计的请求数，连接失败的状态为error")
+_latency = metrics.histogram("pixiv_request_seconds", "请求耗时(到收到响应头为止)")
+_retries = metrics.counter("pixiv_request_retries_total", "重试次数")
+
+
+def _timed_get(identity: "Identity", url: str, headers: dict[str, str], **kwargs) -> requests.Response:
+    name = transport.endpoint(url)
+    start = time.monotonic()
+    status = "error"
+    try:
+        res = identity.session.get(url=transport.rewrite_url(url, identity.hosts), headers=headers, **kwargs)
+        status = res.status_code
+        return res
+    finally:
+        _latency.observe(time.monotonic() - start, endpoint=name)
+        _requests.inc(endpoint=name, status=status)
+
+
+class Identity(object):
+    def __init__(self, name: str, phpsessid: str, proxy: str, limiter: ratelimit.RateLimiter,
+                 transport_config: transport.TransportConfig):
+        self.name = name
+        self.session = transport.new_session(proxy, transport_config)
+        if phpsessid:
+            self.session.cookies.update({"PHPSESSID": phpsessid})
+        self.limiter = limiter
+        self.hosts = transport_config.hosts
+        self.inflight = 0
+        self.requests = 0
+        self.errors = 0
+        self.throttled = 0
+        self.failures = 0  # 连续被限流或失败的次数
+        self.cooldown_until = 0.0
+
+    def stats(self) -> dict:
+        return {
+            "name": self.name,
+            "inflight": self.inflight,
+            "requests": self.requests,
+            "errors": self.errors,
+            "throttled": self.throttled,
+            "cooling": max(0.0, self.cooldown_until - time.monotonic()),
+            "transport": transport.session_stats(self.session),
+        }
+
+
+class IdentityPool(object):
+    def __init__(self, identities: list[Identity], strategy: str = LEAST_LOADED):
+        assert identities, "at least one identity is required"
+        self._identities = identities
+        self._strategy = strategy
+        self._next = 0
+        self._lock = threading.Lock()
+
+    @property
+    def identities(self) -> list[Identity]:
+        return self._identities
+
+    def _available(self, now: float) -> list[Identity]:
+        available = [i for i in self._identities if i.cooldown_until <= now]
+        if available:
+            return available
+        # 全部在冷却时使用最先结束冷却的身份，由限速器负责等待
+        return [min(self._identities, key=lambda i: i.cooldown_until)]
+
+    @property
+    def primary(self) -> Identity:
+        return self._identities[0]
+
+    def acquire(self, pin: bool = False) -> Identity:
+        # pin为True时总是返回第一个身份，即使它在冷却中
+        with self._lock:
+            available = self._available(time.monotonic())
+            if pin:
+                identity = self.primary
+            elif self._strategy == ROUND_ROBIN:
+                identity = available[self._next % len(available)]
+                self._next += 1
+            else:
+                identity = min(available, key=lambda i: (i.inflight, i.requests))
+            identity.inflight += 1
+            return identity
+
+    def release(self, identity: Identity, status_code: int | None):
+        # status_code为None表示连接失败
+        with self._lock:
+            identity.inflight -= 1
+            identity.requests += 1
+            throttled = status_code is None or status_code in ratelimit.THROTTLE_STATUS
+            if status_code is None or status_code >= 400:
+                identity.errors += 1
+            if not throttled:
+                identity.failures = 0
+                return
+            identity.throttled += 1
+            identity.failures += 1
+            cooldown = min(COOLDOWN_CAP, COOLDOWN_BASE * 2 ** (identity.failures - 1))
+            identity.cooldown_until = time.monotonic() + cooldown
+
+    def has_available(self) -> bool:
+        now = time.monotonic()
+        return any(i.cooldown_until <= now for i in self._identities)
+
+    def send(self, url: str, headers: dict[str, str], pin: bool = False, **kwargs) -> requests.Response:
+        """
+        选择一个身份发出请求，需要重试时换一个身份；
+        当前身份被限流而还有其它可用身份时立即重试，否则等待退避时间
+        pin为True时只使用第一个身份(包括重试)，用于结果与账号相关的接口
+        """
+        max_retries = self._identities[0].limiter.max_retries
+        for attempt in range(max_retries + 1):
+            if attempt:
+                _retries.inc(endpoint=transport.endpoint(url))
+            identity = self.acquire(pin)
+            try:
+                res, delay = identity.limiter.attempt(
+                    url, lambda: _timed_get(identity, url, headers, **kwargs), attempt, kwargs.get("stream", False)
+                )
+            except ratelimit.RETRY_EXCEPTIONS:
+                self.release(identity, None)
+                if attempt >= max_retries:
+                    raise
+                res, delay = None, ratelimit.backoff_delay(attempt)
+            else:
+                self.release(identity, res.status_code)
+            if delay is None or attempt >= max_retries:
+                return res
+            if res is not None:
+                res.close()
+            if pin or identity.cooldown_until <= time.monotonic() or not self.has_available():
+                time.sleep(delay)
+
+    def stats(self) -> list[dict]:
+        with self._lock:
+            return [i.stats() for i in self._identities]
+
+
+def new_identity_pool(phpsessids: list[str], proxies: list[str], ajax_rate: float, image_rate: float,
+                      transport_config: transport.TransportConfig, strategy: str = LEAST_LOADED) -> IdentityPool:
+    """
+    账号与代理按顺序配对，数量不同时较少的一方循环使用
+    """
+    phpsessids = phpsessids or [""]
+    proxies = proxies or [""]
+    identities = []
+    for i in range(max(len(phpsessids), len(proxies))):
+        phpsessid = phpsessids[i % len(phpsessids)]
+        proxy = proxies[i % len(proxies)]
+        identities.append(Identity(
+            f"{i}:{phpsessid.split('_')[0]}@{proxy or 'direct'}", phpsessid, proxy,
+            ratelimit.RateLimiter(ajax_rate, image_rate), transport_config,
+        ))
+    return IdentityPool(identities, strategy)
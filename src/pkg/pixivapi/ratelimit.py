@@ -0,0 +1,254 @@
+"""
+请求限速与重试
+
+每类host(ajax接口、图片服务器)各有一个令牌桶限制请求速率，以及一个AIMD并发控制：
+请求正常时缓慢增加允许的并发数，遇到429/5xx时减半并按Retry-After或指数退避(带随机抖动)重试
+Async*为供异步实现使用的asyncio版本，等待时不阻塞事件循环
+"""
+import asyncio
+import email.utils
+import random
+import threading
+import time
+import typing
+import urllib.parse
+import requests
+
+
+MAX_RETRIES = 5
+BACKOFF_BASE = 1.0  # 第一次重试的最大等待秒数，之后每次翻倍
+BACKOFF_CAP = 60.0
+DECREASE_INTERVAL = 1.0  # 两次减小并发上限的最小间隔，避免一批429把上限直接降到最低
+
+AJAX_HOSTS = ("www.pixiv.net", "www.pixivision.net")
+IMAGE_HOSTS = ("i.pximg.net",)
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+RETRY_EXCEPTIONS = (requests.ConnectionError, requests.Timeout)
+THROTTLE_STATUS = {429, 503}
+
+
+class TokenBucket(object):
+    # rate不大于0时不限速，只在pause()期间等待
+    def __init__(self, rate: float, burst: int):
+        self._rate = rate
+        self._burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _take(self) -> float:
+        # 取到令牌时返回0，否则返回需要等待的秒数
+        with self._lock:
+            now = time.monotonic()
+            if self._rate <= 0:
+                return max(0.0, self._paused_until - now)
+            self._tokens = min(self._burst, self._tokens + (now - self._updated) * self._rate)
+            self._updated = now
+            if now >= self._paused_until and self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return max(self._paused_until - now, (1 - self._tokens) / self._rate)
+
+    def acquire(self):
+        while (wait := self._take()) > 0:
+            time.sleep(wait)
+
+    def pause(self, seconds: float):
+        # 服务器要求等待时(Retry-After)，所有使用该桶的请求一起暂停
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+class AimdLimiter(object):
+    def __init__(self, initial: int, minimum: int, maximum: int):
+        self._limit = float(initial)
+        self._minimum = minimum
+        self._maximum = maximum
+        self._inflight = 0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    def _try_acquire(self) -> bool:
+        if self._inflight >= int(self._limit):
+            return False
+        self._inflight += 1
+        return True
+
+    def _release(self, throttled: bool):
+        self._inflight -= 1
+        if throttled:
+            now = time.monotonic()
+            if now - self._last_decrease >= DECREASE_INTERVAL:
+                self._limit = max(self._minimum, self._limit / 2)
+                self._last_decrease = now
+        else:
+            self._limit = min(self._maximum, self._limit + 1 / self._limit)
+
+    def acquire(self):
+        with self._cond:
+            while not self._try_acquire():
+                self._cond.wait()
+
+    def release(self, throttled: bool):
+        with self._cond:
+            self._release(throttled)
+            self._cond.notify_all()
+
+
+class AsyncTokenBucket(TokenBucket):
+    async def acquire(self):
+        while (wait := self._take()) > 0:
+            await asyncio.sleep(wait)
+
+
+class AsyncAimdLimiter(AimdLimiter):
+    # 只能在一个事件循环中使用
+    def __init__(self, initial: int, minimum: int, maximum: int):
+        super().__init__(initial, minimum, maximum)
+        self._cond = asyncio.Condition()
+
+    async def acquire(self):
+        async with self._cond:
+            while not self._try_acquire():
+                await self._cond.wait()
+
+    async def release(self, throttled: bool):
+        async with self._cond:
+            self._release(throttled)
+            self._cond.notify_all()
+
+
+class HostLimiter(typing.NamedTuple):
+    bucket: TokenBucket
+    concurrency: AimdLimiter
+
+
+def retry_after(headers: typing.Mapping[str, str]) -> float | None:
+    value = headers.get("Retry-After")
+    if not value:
+        return None
+    if value.isdigit():
+        return float(value)
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _release_on_close(res: requests.Response, release: typing.Callable[[], None]):
+    # 流式响应的body在返回之后才读取，关闭响应时才释放并发数
+    close = res.close
+    released = False
+
+    def _close():
+        nonlocal released
+        try:
+            close()
+        finally:
+            if not released:
+                released = True
+                release()
+    res.close = _close
+
+
+def _async_release_on_close(res, release: typing.Callable[[], typing.Awaitable]):
+    # _release_on_close的异步版本，对应httpx.Response.aclose
+    aclose = res.aclose
+    released = False
+
+    async def _aclose():
+        nonlocal released
+        try:
+            await aclose()
+        finally:
+            if not released:
+                released = True
+                await release()
+    res.aclose = _aclose
+
+
+def backoff_delay(attempt: int) -> float:
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+
+class RateLimiter(object):
+    bucket_type = TokenBucket
+    concurrency_type = AimdLimiter
+
+    def __init__(self, ajax_rate: float, image_rate: float, max_retries: int = MAX_RETRIES):
+        self._ajax = HostLimiter(self.bucket_type(ajax_rate, max(1, int(ajax_rate))), self.concurrency_type(4, 1, 32))
+        self._image = HostLimiter(self.bucket_type(image_rate, max(1, int(image_rate))), self.concurrency_type(8, 1, 64))
+        self.max_retries = max_retries
+
+    def _host_limiter(self, url: str) -> HostLimiter:
+        host = urllib.parse.urlsplit(url).hostname
+        return self._image if host in IMAGE_HOSTS else self._ajax
+
+    def _keep_slot(self, stream: bool, delay: float | None, attempt: int) -> bool:
+        # 流式响应会返回给调用方读取body时，保持占用并发数直到响应关闭
+        return stream and (delay is None or attempt >= self.max_retries)
+
+    def attempt(self, url: str, do_request: typing.Callable[[], requests.Response], attempt: int,
+                stream: bool = False) -> tuple[requests.Response, float | None]:
+        """
+        在限速下执行一次do_request，返回(响应, 重试前应等待的秒数)，不需要重试时等待秒数为None
+        连接错误时抛出异常，由调用方(identity.IdentityPool.send)决定是否重试
+        stream为True时返回的响应占用一个并发数，调用方必须关闭响应
+        """
+        limiter = self._host_limiter(url)
+        limiter.bucket.acquire()
+        limiter.concurrency.acquire()
+        try:
+            res = do_request()
+        except BaseException:
+            limiter.concurrency.release(True)
+            raise
+        throttled = res.status_code in THROTTLE_STATUS
+        delay = self._retry_delay(limiter, res.status_code, res.headers, attempt)
+        if self._keep_slot(stream, delay, attempt):
+            _release_on_close(res, lambda: limiter.concurrency.release(throttled))
+        else:
+            limiter.concurrency.release(throttled)
+        return res, delay
+
+    @staticmethod
+    def _retry_delay(limiter: HostLimiter, status_code: int, headers: typing.Mapping[str, str], attempt: int) -> float | None:
+        if status_code not in RETRY_STATUS:
+            return None
+        delay = retry_after(headers)
+        if delay is None:
+            return backoff_delay(attempt)
+        limiter.bucket.pause(delay)
+        return delay
+
+
+class AsyncRateLimiter(RateLimiter):
+    """
+    RateLimiter的asyncio版本，attempt为协程，只能在一个事件循环中使用
+    """
+    bucket_type = AsyncTokenBucket
+    concurrency_type = AsyncAimdLimiter
+
+    async def attempt(self, url: str, do_request: typing.Callable[[], typing.Awaitable], attempt: int,
+                      stream: bool = False) -> tuple[typing.Any, float | None]:
+        limiter = self._host_limiter(url)
+        await limiter.bucket.acquire()
+        await limiter.concurrency.acquire()
+        try:
+            res = await do_request()
+        except BaseException:
+            await limiter.concurrency.release(True)
+            raise
+        throttled = res.status_code in THROTTLE_STATUS
+        delay = self._retry_delay(limiter, res.status_code, res.headers, attempt)
+        if self._keep_slot(stream, delay, attempt):
+            _async_release_on_close(res, lambda: limiter.concurrency.release(throttled))
+        else:
+            await limiter.concurrency.release(throttled)
+        return res, delay
@@ -0,0 +1,140 @@
+"""
+HTTP连接池配置
+
+www.pixiv.net、www.pixivision.net、i.pximg.net各自使用独立的连接池，
+同步实现基于requests(HTTP/1.1 keep-alive)，异步实现基于httpx，可选开启HTTP/2
+"""
+import re
+import typing
+import urllib.parse
+import requests
+import requests.adapters
+
+
+PIXIV_ORIGIN = "https://www.pixiv.net"
+PIXIVISION_ORIGIN = "https://www.pixivision.net"
+PXIMG_ORIGIN = "https://i.pximg.net"
+
+
+_ID_RE = re.compile(r"\d+")
+
+
+def endpoint(url: str) -> str:
+    """
+    指标中使用的接口名，路径中的数字替换为{id}，图片服务器只保留路径的第一段
+    如 www.pixiv.net/ajax/illust/{id}、i.pximg.net/img-original
+    """
+    parts = urllib.parse.urlsplit(url)
+    if parts.hostname == "i.pximg.net":
+        return f"{parts.hostname}/{parts.path.lstrip('/').split('/')[0]}"
+    return f"{parts.hostname}{_ID_RE.sub('{id}', parts.path)}"
+
+
+class TransportConfig(typing.NamedTuple):
+    ajax_pool_size: int = 16  # www.pixiv.net保持的连接数
+    pixivision_pool_size: int = 4
+    image_pool_size: int = 64  # i.pximg.net保持的连接数，应不小于图片下载并发数
+    connect_timeout: float = 10.0
+    read_timeout: float = 60.0
+    http2: bool = False  # 仅异步实现支持，需要安装h2
+    image_proxy: bool = True  # 图片下载是否走代理
+    hosts: dict = {}  # 把origin替换为其它地址，如{"https://www.pixiv.net": "http://127.0.0.1:8000/www.pixiv.net"}，用于本地基准测试
+
+    @property
+    def timeout(self) -> tuple[float, float]:
+        return self.connect_timeout, self.read_timeout
+
+    def pool_sizes(self) -> dict[str, int]:
+        return {
+            PIXIV_ORIGIN: self.ajax_pool_size,
+            PIXIVISION_ORIGIN: self.pixivision_pool_size,
+            PXIMG_ORIGIN: self.image_pool_size,
+        }
+
+
+def rewrite_url(url: str, hosts: dict[str, str]) -> str:
+    # 限速、指标等仍按原始url区分，只有实际发出请求时使用替换后的地址
+    for origin, target in hosts.items():
+        if url == origin or url.startswith(origin + "/"):
+            return target.rstrip("/") + url[len(origin):]
+    return url
+
+
+def _proxy_url(proxy: str) -> str:
+    if proxy and "://" not in proxy:
+        return f"http://{proxy}"
+    return proxy
+
+
+def new_session(proxy: str, config: TransportConfig) -> requests.Session:
+    session = requests.session()
+    for origin, size in config.pool_sizes().items():
+        session.mount(rewrite_url(origin, config.hosts), requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=size))
+    if proxy:
+        session.proxies.update({
+            "http": proxy,
+            "https": proxy,
+        })
+        if not config.image_proxy:
+            # requests会丢弃值为None的代理配置，空字符串才表示直连
+            session.proxies[PXIMG_ORIGIN] = ""
+    return session
+
+
+def session_stats(session: requests.Session) -> dict[str, dict[str, int]]:
+    """
+    各连接池新建的连接数与发出的请求数，requests - connections即复用连接的次数
+    """
+    stats = {}
+    for origin in (PIXIV_ORIGIN, PIXIVISION_ORIGIN, PXIMG_ORIGIN):
+        adapter = session.get_adapter(origin)
+        managers = [adapter.poolmanager, *adapter.proxy_manager.values()]
+        connections = requests_cnt = 0
+        for manager in managers:
+            for key in manager.pools.keys():
+                pool = manager.pools.get(key)
+                if pool is None:
+                    continue
+                connections += pool.num_connections
+                requests_cnt += pool.num_requests
+        stats[origin] = {
+            "connections": connections,
+            "requests": requests_cnt,
+            "reused": max(0, requests_cnt - connections),
+        }
+    return stats
+
+
+def new_async_client(proxy: str, config: TransportConfig, **kwargs):
+    import httpx
+    proxy = _proxy_url(proxy) or None
+
+    def _transport(size: int, use_proxy: bool = True) -> httpx.AsyncHTTPTransport:
+        return httpx.AsyncHTTPTransport(
+            http2=config.http2,
+            limits=httpx.Limits(max_connections=size, max_keepalive_connections=size),
+            proxy=proxy if use_proxy else None,
+        )
+
+    mounts = {
+        PIXIV_ORIGIN: _transport(config.ajax_pool_size),
+        PIXIVISION_ORIGIN: _transport(config.pixivision_pool_size),
+        PXIMG_ORIGIN: _transport(config.image_pool_size, config.image_proxy),
+    }
+    return httpx.AsyncClient(
+        mounts=mounts,
+        transport=_transport(config.ajax_pool_size),
+        timeout=httpx.Timeout(config.read_timeout, connect=config.connect_timeout),
+        **kwargs
+    )
+
+
+def async_client_stats(client) -> dict[str, dict[str, int]]:
+    # httpx不统计请求数，只能给出当前保持的连接数
+    stats = {}
+    for pattern, transport in client._mounts.items():
+        pool = getattr(transport, "_pool", None)
+        if pool is None:
+            continue
+        stats[str(pattern.pattern)] = {"connections": len(pool.connections)}
+    return stats
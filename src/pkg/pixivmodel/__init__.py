@@ -6,11 +6,18 @@ from sqlalchemy import SmallInteger
 from sqlalchemy import Integer
 from sqlalchemy import String
 from sqlalchemy import TIMESTAMP
+from sqlalchemy import DateTime
 from sqlalchemy.orm import declarative_base
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy import create_engine
+from sqlalchemy import delete
+from sqlalchemy import inspect
+from sqlalchemy import literal
+from sqlalchemy import select
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
 
 
 # 创建对象的基类:
@@ -54,7 +61,7 @@ class Tag(Base):
         return f'Tag(id={self.tag_id}, name="{self.name}", trans_name="{self.trans_name}")'
 
     tag_id = Column("tagid", Integer, primary_key=True, autoincrement=True)
-    name = Column("tagname", String(128), nullable=False, index=True)
+    name = Column("tagname", String(128), nullable=False, index=True, unique=True)
     trans_name = Column("tagtransname", String(128))
 
     sql_create_time = Column(TIMESTAMP, nullable=False, default=func.current_timestamp())
@@ -123,8 +130,175 @@ class Artwork(Base):
     pixivisions = relationship('Pixivision', secondary=ArtworkPixivision)
 
 
+class ArtworkPage(Base):
+    __tablename__ = 'illust_page'
+
+    def __repr__(self):
+        return f'ArtworkPage(illustid={self.artwork_id}, page={self.idx}, format="{self.format}")'
+
+    artwork_id = Column("illustid", Integer, ForeignKey("illust.illustid"), primary_key=True, nullable=False,
+                        autoincrement=False)
+    idx = Column("page", SmallInteger, primary_key=True, nullable=False, autoincrement=False)
+    format = Column(String(8), nullable=False)  # 文件扩展名，如jpg、png
+    file_size = Column("filesize", Integer, nullable=False)
+
+    sql_create_time = Column(TIMESTAMP, nullable=False, default=func.current_timestamp())
+    sql_update_time = Column(TIMESTAMP, nullable=False, default=func.current_timestamp(),
+                             onupdate=func.current_timestamp())
+
+
+class UgoiraFrame(Base):
+    __tablename__ = 'ugoira_frame'
+
+    def __repr__(self):
+        return f'UgoiraFrame(illustid={self.artwork_id}, frame={self.idx}, delay={self.delay})'
+
+    artwork_id = Column("illustid", Integer, ForeignKey("illust.illustid"), primary_key=True, nullable=False,
+                        autoincrement=False)
+    idx = Column("frame", SmallInteger, primary_key=True, nullable=False, autoincrement=False)
+    file = Column(String(32), nullable=False)  # 帧zip中的文件名
+    delay = Column(Integer, nullable=False)  # 毫秒
+
+    sql_create_time = Column(TIMESTAMP, nullable=False, default=func.current_timestamp())
+    sql_update_time = Column(TIMESTAMP, nullable=False, default=func.current_timestamp(),
+                             onupdate=func.current_timestamp())
+
+
+class UserSync(Base):
+    __tablename__ = 'user_sync'
+
+    def __repr__(self):
+        return f'UserSync(userid={self.user_id}, max_illustid={self.max_artwork_id})'
+
+    user_id = Column("userid", Integer, primary_key=True, nullable=False, autoincrement=False)
+    max_artwork_id = Column("max_illustid", Integer, nullable=False)  # 该id及之前的作品都已处理过
+    artwork_cnt = Column("illust_cnt", Integer, nullable=False)  # 上次同步时用户的作品总数
+
+    sql_create_time = Column(TIMESTAMP, nullable=False, default=func.current_timestamp())
+    sql_update_time = Column(TIMESTAMP, nullable=False, default=func.current_timestamp(),
+                             onupdate=func.current_timestamp())
+
+
+class RankSync(Base):
+    __tablename__ = 'rank_sync'
+
+    def __repr__(self):
+        return f'RankSync(date={self.date}, mode="{self.mode}")'
+
+    date = Column(Integer, primary_key=True, nullable=False, autoincrement=False)  # 8位数字，如20240101
+    mode = Column(String(32), primary_key=True, nullable=False)  # RankType的值
+    artwork_cnt = Column("illust_cnt", Integer, nullable=False)
+
+    sql_create_time = Column(TIMESTAMP, nullable=False, default=func.current_timestamp())
+    sql_update_time = Column(TIMESTAMP, nullable=False, default=func.current_timestamp(),
+                             onupdate=func.current_timestamp())
+
+
+class CrawlJob(Base):
+    __tablename__ = 'crawl_job'
+
+    def __repr__(self):
+        return f'CrawlJob(job_key="{self.job_key}", status="{self.status}")'
+
+    job_key = Column(String(128), primary_key=True, nullable=False)
+    status = Column(String(16), nullable=False, default="running")
+
+    sql_create_time = Column(TIMESTAMP, nullable=False, default=func.current_timestamp())
+    sql_update_time = Column(TIMESTAMP, nullable=False, default=func.current_timestamp(),
+                             onupdate=func.current_timestamp())
+
+
+class CrawlJobItem(Base):
+    __tablename__ = 'crawl_job_item'
+
+    def __repr__(self):
+        return f'CrawlJobItem(job_key="{self.job_key}", {self.item_type}={self.item_id}, status="{self.status}")'
+
+    job_key = Column(String(128), ForeignKey("crawl_job.job_key"), primary_key=True, nullable=False)
+    item_type = Column(String(16), primary_key=True, nullable=False)  # user / artwork
+    item_id = Column(Integer, primary_key=True, nullable=False, autoincrement=False)
+    status = Column(String(16), nullable=False, index=True)  # pending / running / done / skipped / failed
+    attempts = Column(Integer, nullable=False, default=0)
+    error = Column(String(256))
+    lease_owner = Column(String(64))  # 分布式模式下领取该项的worker
+    lease_expire = Column(DateTime, index=True)  # 过期后其它worker可以重新领取
+
+    sql_create_time = Column(TIMESTAMP, nullable=False, default=func.current_timestamp())
+    sql_update_time = Column(TIMESTAMP, nullable=False, default=func.current_timestamp(),
+                             onupdate=func.current_timestamp())
+
+
 def new_session(session_url: str):
-    sql_engine = create_engine(session_url)
+    connect_args = {}
+    if session_url.startswith("sqlite"):
+        # 多个进程同时写同一个sqlite文件时等待锁而不是立即报错
+        connect_args["timeout"] = 30
+    sql_engine = create_engine(session_url, connect_args=connect_args)
     Base.metadata.create_all(sql_engine)
+    _unique_tag_name(sql_engine)
     return sessionmaker(sql_engine)
-    
\ No newline at end of file
+
+
+def _unique_tag_name(engine: Engine):
+    """
+    之前版本的tag.tagname只有普通索引，多个worker同时写入同一个新tag时会插入重复的行
+    合并重复的tag(保留tagid最小的一个)后把索引改为唯一索引，已是唯一索引时不做任何事
+    """
+    tag_index = next(iter(Tag.__table__.indexes))
+    indexes = inspect(engine).get_indexes(Tag.__tablename__)
+    if any(ix["unique"] and ix["column_names"] == ["tagname"] for ix in indexes):
+        return
+    with engine.begin() as conn:
+        duplicates = conn.execute(
+            select(Tag.name, func.min(Tag.tag_id)).group_by(Tag.name).having(func.count() > 1)
+        ).all()
+        for name, keep_id in duplicates:
+            dup_ids = select(Tag.tag_id).where(Tag.name == name, Tag.tag_id != keep_id)
+            linked = select(ArtworkTag.c.illustid).where(ArtworkTag.c.tagid == keep_id)
+            conn.execute(ArtworkTag.insert().from_select(
+                ["tagid", "illustid"],
+                select(literal(keep_id), ArtworkTag.c.illustid)
+                .where(ArtworkTag.c.tagid.in_(dup_ids), ArtworkTag.c.illustid.not_in(linked))
+                .distinct()
+            ))
+            conn.execute(delete(ArtworkTag).where(ArtworkTag.c.tagid.in_(dup_ids)))
+            conn.execute(delete(Tag).where(Tag.tag_id.in_(
+                # mysql不允许在子查询中直接引用正在删除的表
+                select(*dup_ids.subquery().c)
+            )))
+        if any(ix["name"] == tag_index.name for ix in indexes):
+            tag_index.drop(conn)
+        tag_index.create(conn)
+    
+
+def upsert(session: Session, table: Table, rows: list[dict], index_elements: list[str], update_columns: list[str]):
+    """
+    批量插入rows，主键(index_elements)冲突时更新update_columns，update_columns为空时忽略冲突的行
+    根据数据库类型使用ON CONFLICT(sqlite/postgresql)或ON DUPLICATE KEY(mysql)
+    """
+    if not rows:
+        return
+    dialect = session.get_bind().dialect.name
+    if dialect == "mysql":
+        from sqlalchemy.dialects.mysql import insert
+        stmt = insert(table).values(rows)
+        if update_columns:
+            stmt = stmt.on_duplicate_key_update({c: stmt.inserted[c] for c in update_columns})
+        else:
+            stmt = stmt.prefix_with("IGNORE")
+    elif dialect in ("postgresql", "sqlite"):
+        if dialect == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        stmt = insert(table).values(rows)
+        if update_columns:
+            stmt = stmt.on_conflict_do_update(
+                index_elements=index_elements,
+                set_={c: stmt.excluded[c] for c in update_columns}
+            )
+        else:
+            stmt = stmt.on_conflict_do_nothing(index_elements=index_elements)
+    else:
+        raise NotImplementedError(f"upsert is not supported for {dialect}")
+    session.execute(stmt)
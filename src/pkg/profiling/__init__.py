@@ -0,0 +1,329 @@
+"""
+按需性能分析
+
+分析期间(session)，section(name)包住的代码用cProfile分别统计，嵌套的section之间互不重复计算:
+进入内层时暂停外层的profiler，退出时恢复；每个线程各有自己的profiler，导出时按section合并
+python3.12起cProfile基于sys.monitoring，同一时间只能有一个profiler且对所有线程生效，无法按线程、按section分开:
+此时session用一个全进程的profiler，导出为process.prof，section只统计调用次数与耗时
+开启tracemalloc时，在session开始和结束各取一次快照，输出分配增量最多的代码行(tracemalloc是全进程的，不区分section)
+
+没有session时section()只做一次全局变量判断，开销可以忽略
+session由job()按sample_rate抽样开启，或由信号(见install_signal)手动开启/结束，
+结束时写入 {dir}/{时间}-{名称}-{pid}/: 每个section一个.prof文件(pstats格式，可用snakeviz等查看)、
+summary.txt(各section的耗时与热点函数)以及tracemalloc.txt
+"""
+import cProfile
+import datetime
+import io
+import itertools
+import os
+import pathlib
+import pstats
+import random
+import signal
+import sys
+import threading
+import time
+import tracemalloc
+
+PROFILE_DIR = "profiles"
+TOP = 30  # summary中每个section列出的函数数量
+SIGNAL_POLL_INTERVAL = 0.5  # 后台线程检查是否收到信号的间隔(秒)
+PROCESS_WIDE = sys.version_info >= (3, 12)  # 只能使用一个全进程的profiler
+
+_dir = PROFILE_DIR
+_sample_rate = 0.0
+_trace_malloc = False
+_top = TOP
+
+_session: "_Session | None" = None
+_session_lock = threading.Lock()
+_local = threading.local()
+_signal_count = 0  # 信号处理函数只增加计数，由后台线程开启/结束session
+_signal_thread: threading.Thread | None = None
+
+
+def configure(dir: str | None = None, sample_rate: float | None = None, trace_malloc: bool | None = None,
+              top: int | None = None):
+    # 参数为None时保持不变
+    global _dir, _sample_rate, _trace_malloc, _top
+    if dir is not None:
+        _dir = dir
+    if sample_rate is not None:
+        _sample_rate = sample_rate
+    if trace_malloc is not None:
+        _trace_malloc = trace_malloc
+    if top is not None:
+        _top = top
+
+
+class _SectionStats(object):
+    __slots__ = ("calls", "seconds", "profiles")
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.profiles: list[cProfile.Profile] = []
+
+
+class _Session(object):
+    def __init__(self, name: str):
+        self.name = name
+        self.started = datetime.datetime.now()
+        self.sections: dict[str, _SectionStats] = {}
+        self.profiles: dict[tuple[int, str], cProfile.Profile] = {}
+        self.lock = threading.Lock()
+        self.active = 0  # 正在执行的section数，结束时等它们全部退出后再导出
+        self.closing = False
+        self.dumping = False  # 在锁内置位，保证只由一个线程导出
+        self.dumped: pathlib.Path | None = None
+        self.tracemalloc_started = False
+        self.snapshot: tracemalloc.Snapshot | None = None
+        self.process_profile: cProfile.Profile | None = None
+        if PROCESS_WIDE:
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+                self.process_profile = profile
+            except ValueError:
+                import pkg.log as log
+                log.warning(f"profile {name}: another profiler is active, only section timings are recorded")
+        if _trace_malloc:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self.tracemalloc_started = True
+            self.snapshot = tracemalloc.take_snapshot()
+
+    def profile_for(self, name: str) -> cProfile.Profile:
+        # 每个线程、每个section一个profiler，cProfile不能在多个线程中同时使用同一个对象
+        key = (threading.get_ident(), name)
+        with self.lock:
+            profile = self.profiles.get(key)
+            if profile is None:
+                profile = self.profiles[key] = cProfile.Profile()
+                self.sections.setdefault(name, _SectionStats()).profiles.append(profile)
+        return profile
+
+    def record(self, name: str, seconds: float):
+        with self.lock:
+            stats = self.sections.setdefault(name, _SectionStats())
+            stats.calls += 1
+            stats.seconds += seconds
+
+
+class _Section(object):
+    __slots__ = ("name", "session", "profile", "start")
+
+    def __init__(self, name: str, session: _Session):
+        self.name = name
+        self.session = session
+        self.profile: cProfile.Profile | None = None
+        self.start = 0.0
+
+    def __enter__(self):
+        with self.session.lock:
+            self.session.active += 1
+        stack = _local.__dict__.setdefault("stack", [])
+        if not PROCESS_WIDE:
+            if stack and stack[-1].profile is not None:
+                stack[-1].profile.disable()
+            self.profile = self.session.profile_for(self.name)
+            self.profile.enable()
+        stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        if self.profile is not None:
+            self.profile.disable()
+        stack = _local.stack
+        stack.pop()
+        if stack and stack[-1].profile is not None:
+            stack[-1].profile.enable()
+        self.session.record(self.name, elapsed)
+        with self.session.lock:
+            self.session.active -= 1
+            dump = self.session.closing and self.session.active == 0 and not self.session.dumping
+            self.session.dumping |= dump
+        if dump:
+            _dump(self.session)
+        return False
+
+
+class _NoopSection(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP = _NoopSection()
+
+
+def section(name: str):
+    session = _session
+    if session is None or session.closing:
+        return _NOOP
+    return _Section(name, session)
+
+
+def start(name: str) -> "_Session | None":
+    # 返回新开启的session，已有进行中的session时返回None
+    global _session
+    with _session_lock:
+        if _session is not None:
+            return None
+        _session = _Session(name)
+        return _session
+
+
+def stop(session: "_Session | None" = None) -> "_Session | None":
+    """
+    结束当前session，指定session时只在它仍是当前session时结束，还有section在执行时由最后退出的section导出
+    """
+    global _session
+    with _session_lock:
+        if _session is None or (session is not None and _session is not session):
+            return None
+        session, _session = _session, None
+        # 在锁内停止全进程的profiler，之后开启的session才能启用新的profiler
+        if session.process_profile is not None:
+            session.process_profile.disable()
+    with session.lock:
+        session.closing = True
+        dump = session.active == 0 and not session.dumping
+        session.dumping |= dump
+    if dump:
+        _dump(session)
+    return session
+
+
+def active() -> bool:
+    return _session is not None
+
+
+class job(object):
+    """
+    按sample_rate抽样对一次任务进行分析，已有进行中的session(如由信号开启)时不做任何事
+    结束时只结束自己开启的session，期间被信号结束并开启了新session时不影响新的session
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.session: _Session | None = None
+
+    def __enter__(self):
+        if _sample_rate > 0 and random.random() < _sample_rate:
+            self.session = start(self.name)
+        return self
+
+    def __exit__(self, *exc):
+        if self.session is not None:
+            stop(self.session)
+        return False
+
+
+def _write_profiles(name: str, profiles: list[cProfile.Profile], out_dir: pathlib.Path,
+                    lines: list[str], hot_spots: list[tuple[float, str, str]]):
+    # 合并profiles导出为{name}.prof，热点函数追加到lines与hot_spots
+    profiles = [p for p in profiles if p.getstats()]
+    if not profiles:
+        lines.append("")
+        return
+    merged = pstats.Stats(profiles[0])
+    for profile in profiles[1:]:
+        merged.add(profile)
+    file_name = "".join(c if c.isalnum() or c in "-_." else "_" for c in name)
+    merged.dump_stats(out_dir / f"{file_name}.prof")
+    buffer = io.StringIO()
+    merged.stream = buffer
+    merged.sort_stats(pstats.SortKey.TIME).print_stats(_top)
+    lines.append(buffer.getvalue())
+    for func, (_, _, tottime, _, _) in merged.stats.items():
+        hot_spots.append((tottime, name, pstats.func_std_string(func)))
+
+
+def _write_summary(session: _Session, out_dir: pathlib.Path) -> list[str]:
+    lines = [f"profile {session.name} started at {session.started.isoformat(timespec='seconds')}", ""]
+    hot_spots = []
+    for name, stats in sorted(session.sections.items(), key=lambda item: -item[1].seconds):
+        lines.append(f"== {name}: {stats.calls} calls, {stats.seconds:.3f}s (wall, including nested sections)")
+        _write_profiles(name, stats.profiles, out_dir, lines, hot_spots)
+    if session.process_profile is not None:
+        lines.append("== process: all threads, not split by section")
+        _write_profiles("process", [session.process_profile], out_dir, lines, hot_spots)
+    with open(out_dir / "summary.txt", "w", encoding="utf-8") as f:
+        f.write("\n".join(lines))
+    return [f"{name}: {func} {tottime:.3f}s" for tottime, name, func in sorted(hot_spots, reverse=True)[:5]]
+
+
+def _write_tracemalloc(session: _Session, out_dir: pathlib.Path):
+    if session.snapshot is None or not tracemalloc.is_tracing():
+        return
+    stats = tracemalloc.take_snapshot().compare_to(session.snapshot, "lineno")
+    if session.tracemalloc_started:
+        tracemalloc.stop()
+    with open(out_dir / "tracemalloc.txt", "w", encoding="utf-8") as f:
+        f.write("\n".join(str(stat) for stat in stats[:_top]) + "\n")
+
+
+def _dump(session: _Session):
+    import pkg.log as log
+    base = f"{session.started:%Y%m%d-%H%M%S}-{session.name}-{os.getpid()}"
+    out_dir = pathlib.Path(_dir) / base
+    # 同一秒内开始的同名session(如连续发送信号)写入不同的目录
+    for i in itertools.count(1):
+        try:
+            out_dir.mkdir(parents=True)
+            break
+        except FileExistsError:
+            out_dir = pathlib.Path(_dir) / f"{base}.{i}"
+        except OSError as e:
+            log.error(f"dump profile {session.name} failed", error=str(e))
+            return
+    session.dumped = out_dir
+    try:
+        _write_tracemalloc(session, out_dir)
+        hot_spots = _write_summary(session, out_dir)
+    except Exception as e:
+        log.error(f"dump profile {session.name} failed", error=str(e))
+        return
+    log.info(f"profile {session.name} saved to {out_dir}", hot_spots=hot_spots)
+
+
+def _on_signal(signum, frame):
+    # 信号处理函数在主线程中执行，主线程可能正持有session的锁，这里不能加锁
+    global _signal_count
+    _signal_count += 1
+
+
+def _watch_signal():
+    handled = 0
+    while True:
+        time.sleep(SIGNAL_POLL_INTERVAL)
+        while handled < _signal_count:
+            handled += 1
+            if stop() is None:
+                start("signal")
+
+
+def install_signal(signum: int | None = None) -> bool:
+    """
+    收到信号(默认SIGUSR1)时开启分析，再次收到时结束并导出，只能在主线程中调用
+    开启/结束以及导出在后台线程中进行，最多延迟SIGNAL_POLL_INTERVAL秒
+    没有该信号的平台(Windows)返回False
+    """
+    global _signal_thread
+    if signum is None:
+        signum = getattr(signal, "SIGUSR1", None)
+    if signum is None:
+        return False
+    signal.signal(signum, _on_signal)
+    if _signal_thread is None:
+        _signal_thread = threading.Thread(target=_watch_signal, name="profiling-signal", daemon=True)
+        _signal_thread.start()
+    return True
@@ -1,8 +1,16 @@
+import argparse
+import multiprocessing
+import pkg.log as log
+import pkg.profiling as profiling
 import interval.pixiv_crawler as pixiv_crawler
+import interval.distributed as distributed
+import interval.jobqueue as jobqueue
+import interval.storage as storage
 
 
 # 手动调用可以这么做
 # pixiv_crawler.crawler_by_artwork_id(112901397)
+# pixiv_crawler.crawler_by_artwork_ids([112901397, 115812789])
 # pixiv_crawler.crawler_by_user_id(13038350)
 # pixiv_crawler.crawler_by_pixivision_aid(9374)
 # pixiv_crawler.crawler_by_follow_latest(1)
@@ -10,15 +18,88 @@ import interval.pixiv_crawler as pixiv_crawler
 # pixiv_crawler.crawler_by_rank(pixiv_crawler.pixiv_api.RankType.MONTHLY, 20240212, 1)
 # pixiv_crawler.crawler_by_request_recommend()
 # pixiv_crawler.crawler_by_user_bookmark(92803629, 1)
+# pixiv_crawler.crawler_by_rank_all(pixiv_crawler.pixiv_api.RankType.DAILY, 20240212)
+# pixiv_crawler.crawler_by_rank_range([pixiv_crawler.pixiv_api.RankType.DAILY, pixiv_crawler.pixiv_api.RankType.WEEKLY], 20240101, 20241231)
+# pixiv_crawler.crawler_by_follow_latest_all(min_artwork_id=115000000)
+# pixiv_crawler.crawler_by_user_bookmark_all(92803629)
 # pixiv_crawler.crawler_by_tag_popular("ホロライブ")
 # pixiv_crawler.crawler_by_similar_artwork(115812789)
 # pixiv_crawler.crawler_by_similar_user(20015785)
 # pixiv_crawler.crawler_by_recommend_user()
 # pixiv_crawler.crawler_by_request_creator()
+# 动图额外转换为webp(需要pip install Pillow)，在独立的进程池中转换
+# pixiv_crawler.crawler_by_artwork_id(44298467, pixiv_crawler.pixiv_api.new_filter(ugoira_format="webp"))
+# 每天同步关注的用户时只处理新作品
+# pixiv_crawler.crawler_by_user_id(13038350, pixiv_crawler.pixiv_api.new_filter(incremental=True))
+# 指定job_key后中断的任务可以用同样的参数重新执行，从中断处继续
+# pixiv_crawler.crawler_by_similar_user(20015785, pixiv_crawler.pixiv_api.new_filter(job_key="similar-20015785"))
+
+
+# 分布式模式，多个worker可以在不同机器上运行，连接同一个数据库
+# python run.py coordinator --job rank-202402 --seed rank:monthly:20240212:1 --seed user:13038350
+# python run.py worker --job rank-202402 --processes 4  (每个进程的日志写入各自的log-{pid}.txt)
+# 把flat布局的图片目录迁移到配置文件中的storage布局
+# python run.py migrate-storage
+# 根据文件头修正已下载图片的扩展名(之前的版本全部保存为.jpg)
+# python run.py fix-suffixes
+# 运行中 kill -USR1 <pid> 开始性能分析，再次发送时结束并写入配置中profiling.dir下的目录
+
+
+WORKER_LOG_FILE = "log-{pid}.txt"
+
+
+def _run_worker(job_key: str, batch_size: int, lease_seconds: float, log_file: str | None = None):
+    # 每个worker进程各自导出指标，各自响应性能分析的信号；多个worker进程时各写各的日志文件
+    if log_file is not None:
+        log.configure(file=log_file)
+    pixiv_crawler.start_metrics_exporters()
+    profiling.install_signal()
+    distributed.run_worker(job_key, batch_size=batch_size, lease_seconds=lease_seconds)
 
 
 def main():
-    pass
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command")
+    coordinator = subparsers.add_parser("coordinator", help="展开种子并加入任务队列")
+    coordinator.add_argument("--job", required=True)
+    coordinator.add_argument("--seed", action="append", default=[], help="例如 user:13038350、rank:monthly:20240212:1")
+    worker = subparsers.add_parser("worker", help="从任务队列领取artwork并下载")
+    worker.add_argument("--job", required=True)
+    worker.add_argument("--processes", type=int, default=1)
+    worker.add_argument("--batch-size", type=int, default=distributed.BATCH_SIZE)
+    worker.add_argument("--lease", type=float, default=jobqueue.LEASE_SECONDS)
+    subparsers.add_parser("migrate-storage", help="把file_path下flat布局的图片迁移到配置的storage布局")
+    subparsers.add_parser("fix-suffixes", help="根据文件头修正已下载图片的扩展名")
+    args = parser.parse_args()
+    if args.command != "worker":
+        pixiv_crawler.start_metrics_exporters()
+        profiling.install_signal()
+
+    if args.command == "coordinator":
+        distributed.run_coordinator(args.job, args.seed)
+    elif args.command == "migrate-storage":
+        config = pixiv_crawler.config
+        moved = storage.migrate_flat(
+            config.file_path, pixiv_crawler.image_store,
+            lambda n: pixiv_crawler.log.info(f"migrated {n} files")
+        )
+        pixiv_crawler.log.info(f"migrate storage finished", layout=config.storage, moved=moved)
+    elif args.command == "fix-suffixes":
+        pixiv_crawler.fix_image_suffixes()
+    elif args.command == "worker":
+        if args.processes <= 1:
+            _run_worker(args.job, args.batch_size, args.lease)
+            return
+        # 使用spawn，避免子进程继承父进程的数据库连接
+        ctx = multiprocessing.get_context("spawn")
+        processes = [
+            ctx.Process(target=_run_worker, args=(args.job, args.batch_size, args.lease, WORKER_LOG_FILE))
+            for _ in range(args.processes)
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
 
 
 if __name__ == "__main__":
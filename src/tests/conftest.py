@@ -0,0 +1,15 @@
+import pytest
+import pkg.log as log
+import pkg.pixivmodel as model
+
+
+@pytest.fixture(scope="session", autouse=True)
+def log_file(tmp_path_factory):
+    # 日志写入临时目录，不输出到控制台
+    log.configure(file=str(tmp_path_factory.mktemp("log") / "log.txt"), console=False)
+
+
+@pytest.fixture
+def sql(tmp_path):
+    # 每个测试使用独立的sqlite文件
+    return model.new_session(f"sqlite:///{tmp_path / 'db.sqlite'}")
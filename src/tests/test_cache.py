@@ -0,0 +1,77 @@
+import base64
+import os
+import pytest
+from pkg.pixivapi import cache
+from pkg.pixivapi.cache import MetaCache, cache_key
+
+DETAIL_URL = "https://www.pixiv.net/ajax/illust/1000?lang=zh"
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1_000_000.0]
+    monkeypatch.setattr(cache.time, "time", lambda: now[0])
+    return now
+
+
+def _blob(size: int) -> dict:
+    # 随机数据，压缩后的大小与size相近
+    return {"data": base64.b64encode(os.urandom(size)).decode()}
+
+
+def test_ttl_matches_first_rule(tmp_path):
+    meta_cache = MetaCache(str(tmp_path / "cache.sqlite"))
+    assert meta_cache.ttl(DETAIL_URL) == 6 * cache.HOUR
+    assert meta_cache.ttl("https://www.pixiv.net/ajax/illust/1000/ugoira_meta?lang=zh") == 30 * cache.DAY
+    assert meta_cache.ttl("https://www.pixiv.net/ajax/user/1/following") == 0
+
+
+def test_get_put_and_expire(tmp_path, clock):
+    meta_cache = MetaCache(str(tmp_path / "cache.sqlite"))
+    assert meta_cache.get(DETAIL_URL) is None
+    meta_cache.put(DETAIL_URL, {"body": {"title": "标题"}}, 60)
+    assert meta_cache.get(DETAIL_URL) == {"body": {"title": "标题"}}
+    clock[0] += 61
+    assert meta_cache.get(DETAIL_URL) is None
+    assert meta_cache.stats() == {"hits": 1, "misses": 2, "entries": 0, "bytes": 0}
+
+
+def test_cache_key_is_scoped_by_session():
+    url = "https://www.pixiv.net/ajax/follow_latest/illust?p=1"
+    assert cache_key(url) == url
+    assert cache_key(url, "a") == cache_key(url, "a")
+    assert cache_key(url, "a") != cache_key(url, "b")
+    assert "secret" not in cache_key(url, "12345_secret")
+
+
+def test_evicts_least_recently_used(tmp_path, clock):
+    meta_cache = MetaCache(str(tmp_path / "cache.sqlite"), max_bytes=10_000)
+    for i in range(3):
+        meta_cache.put(f"key{i}", _blob(2000), 3600)
+        clock[0] += cache.ATIME_RESOLUTION + 1
+    # 访问key0后它比key1更新
+    assert meta_cache.get("key0") is not None
+    clock[0] += 1
+    meta_cache.put("key3", _blob(4000), 3600)
+    assert meta_cache.stats()["bytes"] <= 9000
+    assert meta_cache.get("key1") is None
+    assert meta_cache.get("key0") is not None
+    assert meta_cache.get("key3") is not None
+
+
+def test_evicts_expired_first(tmp_path, clock):
+    meta_cache = MetaCache(str(tmp_path / "cache.sqlite"), max_bytes=10_000)
+    meta_cache.put("old", _blob(3000), 3600)
+    meta_cache.put("short", _blob(3000), 10)
+    clock[0] += 11
+    meta_cache.put("new", _blob(5000), 3600)
+    assert meta_cache.get("old") is not None
+    assert meta_cache.stats()["entries"] == 2
+
+
+def test_total_bytes_survives_reopen(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    meta_cache = MetaCache(path)
+    meta_cache.put(DETAIL_URL, _blob(1000), 60)
+    meta_cache.put(DETAIL_URL, _blob(500), 60)
+    assert MetaCache(path).stats()["bytes"] == meta_cache.stats()["bytes"]
@@ -0,0 +1,69 @@
+import pytest
+from pkg.pixivapi import download
+
+
+@pytest.fixture
+def paths(tmp_path):
+    file_path = tmp_path / "1000_p0.jpg"
+    return download.temp_path(file_path), file_path
+
+
+def test_resume_headers(paths):
+    tmp_path, _ = paths
+    assert download.resume_headers(tmp_path) == (0, {})
+    tmp_path.write_bytes(b"")
+    assert download.resume_headers(tmp_path) == (0, {})
+    tmp_path.write_bytes(b"x" * 10)
+    assert download.resume_headers(tmp_path) == (10, {"Range": "bytes=10-"})
+    download.begin_write(tmp_path, 10, 206, {"ETag": '"abc"', "Content-Range": "bytes 10-19/20"})
+    assert download.resume_headers(tmp_path) == (10, {"Range": "bytes=10-", "If-Range": '"abc"'})
+
+
+def test_begin_write(paths):
+    tmp_path, _ = paths
+    assert download.begin_write(tmp_path, 0, 200, {"Content-Length": "20"}) == ("wb", 20)
+    assert download.begin_write(tmp_path, 0, 200, {"Content-Length": "20", "Content-Encoding": "gzip"}) == ("wb", -1)
+    # If-Range不匹配时服务器返回200和完整内容，从头写入
+    assert download.begin_write(tmp_path, 10, 200, {}) == ("wb", -1)
+    assert download.begin_write(tmp_path, 10, 206, {"Content-Range": "bytes 10-19/20"}) == ("ab", 20)
+
+
+def test_begin_write_rejects_wrong_range(paths):
+    tmp_path, _ = paths
+    tmp_path.write_bytes(b"x" * 10)
+    with pytest.raises(IOError):
+        download.begin_write(tmp_path, 10, 206, {"Content-Range": "bytes 5-19/20"})
+    assert not tmp_path.exists()
+
+
+def test_range_not_satisfiable(paths):
+    tmp_path, _ = paths
+    tmp_path.write_bytes(b"x" * 20)
+    assert download.range_not_satisfiable(tmp_path, 20, {"Content-Range": "bytes */20"})
+    assert tmp_path.exists()
+    assert not download.range_not_satisfiable(tmp_path, 20, {"Content-Range": "bytes */30"})
+    assert not tmp_path.exists()
+
+
+def test_commit_download(paths):
+    tmp_path, file_path = paths
+    download.begin_write(tmp_path, 0, 200, {"ETag": '"abc"'})
+    tmp_path.write_bytes(b"x" * 20)
+    assert download.commit_download(tmp_path, file_path, 20) == 20
+    assert file_path.read_bytes() == b"x" * 20
+    assert list(file_path.parent.iterdir()) == [file_path]
+
+
+def test_commit_incomplete_download(paths):
+    tmp_path, file_path = paths
+    tmp_path.write_bytes(b"x" * 10)
+    with pytest.raises(IOError):
+        download.commit_download(tmp_path, file_path, 20)
+    # 不完整的临时文件保留，下次续传
+    assert tmp_path.exists() and not file_path.exists()
+    tmp_path.write_bytes(b"x" * 30)
+    with pytest.raises(IOError):
+        download.commit_download(tmp_path, file_path, 20)
+    assert not tmp_path.exists()
+    tmp_path.write_bytes(b"x" * 5)
+    assert download.commit_download(tmp_path, file_path, -1) == 5
@@ -0,0 +1,67 @@
+import threading
+import pytest
+from pkg.pixivapi import iter_pages
+
+
+def _pages(total: int, per_page: int = 2):
+    # fetch_page: 共total页，记录请求过的页码
+    requested = []
+
+    def fetch_page(page: int) -> tuple[list[int], bool]:
+        requested.append(page)
+        if page > total:
+            return [], False
+        return [page * 100 + i for i in range(per_page)], page < total
+    return fetch_page, requested
+
+
+def test_stops_at_last_page():
+    fetch_page, requested = _pages(3)
+    assert list(iter_pages(fetch_page)) == [[100, 101], [200, 201], [300, 301]]
+    assert requested == [1, 2, 3]
+
+
+def test_stops_at_empty_page():
+    # 超出最后一页时返回空列表(has_next仍为True)
+    assert list(iter_pages(lambda page: ([page] if page < 3 else [], True))) == [[1], [2]]
+
+
+def test_max_pages():
+    fetch_page, requested = _pages(10)
+    assert len(list(iter_pages(fetch_page, max_pages=2))) == 2
+    assert requested == [1, 2]
+
+
+def test_prefetches_next_page():
+    fetched = threading.Event()
+
+    def fetch_page(page: int) -> tuple[list[int], bool]:
+        if page == 2:
+            fetched.set()
+        return [page], page < 2
+
+    pages = iter_pages(fetch_page)
+    assert next(pages) == [1]
+    # 处理第1页时第2页已经在后台获取
+    assert fetched.wait(5)
+    assert list(pages) == [[2]]
+
+
+def test_close_early():
+    fetch_page, requested = _pages(100)
+    pages = iter_pages(fetch_page)
+    assert next(pages) == [100, 101]
+    pages.close()
+    assert len(requested) <= 2
+
+
+def test_error_propagates():
+    def fetch_page(page: int) -> tuple[list[int], bool]:
+        if page == 2:
+            raise IOError("page 2")
+        return [page], True
+
+    pages = iter_pages(fetch_page)
+    assert next(pages) == [1]
+    with pytest.raises(IOError, match="page 2"):
+        next(pages)
@@ -0,0 +1,91 @@
+from interval.jobqueue import CrawlJobQueue, DONE, FAILED, ITEM_ARTWORK, PENDING, RUNNING, SKIPPED
+import pkg.pixivmodel as model
+
+
+def _job_status(sql, job_key: str) -> str:
+    with sql() as session:
+        return session.get(model.CrawlJob, job_key).status
+
+
+def test_add_keeps_existing_status(sql):
+    queue = CrawlJobQueue(sql, "job")
+    queue.add(ITEM_ARTWORK, [1, 2])
+    queue.mark(ITEM_ARTWORK, [1], DONE)
+    queue.add(ITEM_ARTWORK, [1, 2, 3])
+    assert queue.ids(ITEM_ARTWORK, (DONE,)) == {1}
+    assert queue.ids(ITEM_ARTWORK, (PENDING,)) == {2, 3}
+
+
+def test_lease_is_exclusive(sql):
+    queue = CrawlJobQueue(sql, "job")
+    queue.add(ITEM_ARTWORK, list(range(1, 6)))
+    assert queue.lease(ITEM_ARTWORK, "a", 3) == [1, 2, 3]
+    assert queue.lease(ITEM_ARTWORK, "b", 3) == [4, 5]
+    assert queue.lease(ITEM_ARTWORK, "c", 3) == []
+    assert queue.remaining(ITEM_ARTWORK) == 5
+
+
+def test_expired_lease_is_taken_over(sql):
+    queue = CrawlJobQueue(sql, "job")
+    queue.add(ITEM_ARTWORK, [1, 2])
+    assert queue.lease(ITEM_ARTWORK, "dead", 2, lease_seconds=-10) == [1, 2]
+    assert queue.lease(ITEM_ARTWORK, "alive", 2) == [1, 2]
+    # 原owner的结果在租约被接管后不再生效
+    queue.complete(ITEM_ARTWORK, "dead", {1: DONE, 2: DONE})
+    assert queue.ids(ITEM_ARTWORK, (RUNNING,)) == {1, 2}
+    queue.complete(ITEM_ARTWORK, "alive", {1: DONE, 2: SKIPPED})
+    assert queue.counts() == {ITEM_ARTWORK: {DONE: 1, SKIPPED: 1}}
+
+
+def test_renew_keeps_lease(sql):
+    queue = CrawlJobQueue(sql, "job")
+    queue.add(ITEM_ARTWORK, [1])
+    assert queue.lease(ITEM_ARTWORK, "a", 1, lease_seconds=-10) == [1]
+    queue.renew(ITEM_ARTWORK, "a")
+    assert queue.lease(ITEM_ARTWORK, "b", 1) == []
+
+
+def test_failed_items_are_retried_until_max_attempts(sql):
+    queue = CrawlJobQueue(sql, "job")
+    queue.add(ITEM_ARTWORK, [1])
+    for _ in range(2):
+        assert queue.lease(ITEM_ARTWORK, "a", 1, max_attempts=2) == [1]
+        queue.complete(ITEM_ARTWORK, "a", {1: FAILED}, "boom")
+    assert queue.lease(ITEM_ARTWORK, "a", 1, max_attempts=2) == []
+    assert queue.remaining(ITEM_ARTWORK, max_attempts=2) == 0
+
+
+def test_finish_running_until_all_items_final(sql):
+    queue = CrawlJobQueue(sql, "job")
+    queue.add(ITEM_ARTWORK, [1, 2])
+    queue.lease(ITEM_ARTWORK, "a", 2)
+    queue.complete(ITEM_ARTWORK, "a", {1: DONE})
+    assert not queue.finish()
+    assert _job_status(sql, "job") == RUNNING
+    queue.complete(ITEM_ARTWORK, "a", {2: DONE})
+    assert queue.finish()
+    assert _job_status(sql, "job") == DONE
+
+
+def test_finish_with_exhausted_failures(sql):
+    queue = CrawlJobQueue(sql, "job")
+    queue.add(ITEM_ARTWORK, [1, 2])
+    queue.lease(ITEM_ARTWORK, "a", 2, max_attempts=1)
+    queue.complete(ITEM_ARTWORK, "a", {1: DONE, 2: FAILED})
+    # 还可以重试的失败项未结束
+    assert not queue.finish(max_attempts=2)
+    assert queue.finish(max_attempts=1)
+    assert _job_status(sql, "job") == FAILED
+
+
+def test_finish_empty_job(sql):
+    queue = CrawlJobQueue(sql, "job")
+    assert queue.finish()
+    assert _job_status(sql, "job") == DONE
+
+
+def test_jobs_are_isolated(sql):
+    CrawlJobQueue(sql, "a").add(ITEM_ARTWORK, [1])
+    queue = CrawlJobQueue(sql, "b")
+    assert queue.lease(ITEM_ARTWORK, "w", 10) == []
+    assert queue.remaining(ITEM_ARTWORK) == 0
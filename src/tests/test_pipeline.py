@@ -0,0 +1,105 @@
+import threading
+import pytest
+from interval.pipeline import Pipeline, Stage
+
+
+def _double(x):
+    return x * 2
+
+
+def _odd_only(x):
+    return x if x % 2 else None
+
+
+class Recorder(object):
+    def __init__(self, stop_on_error: bool = False):
+        self.finished: list[tuple[object, bool]] = []
+        self.errors: list[tuple[object, Exception]] = []
+        self._stop_on_error = stop_on_error
+        self._lock = threading.Lock()
+
+    def on_finish(self, item, completed: bool):
+        with self._lock:
+            self.finished.append((item, completed))
+
+    def on_error(self, item, e: Exception) -> bool:
+        with self._lock:
+            self.errors.append((item, e))
+        return not self._stop_on_error
+
+
+def _fail_on(value):
+    def handler(x):
+        if x == value:
+            raise ValueError(f"bad {x}")
+        return x
+    return handler
+
+
+def test_items_pass_all_stages():
+    recorder = Recorder()
+    pipeline = Pipeline([Stage("filter", _odd_only, 2), Stage("double", _double, 3)],
+                        recorder.on_finish, recorder.on_error)
+    pipeline.run(range(10))
+    # 被过滤的项以原值结束，经过所有阶段的项以最后一个阶段的结果结束
+    expected = [(x, False) for x in range(0, 10, 2)] + [(x * 2, True) for x in range(1, 10, 2)]
+    assert sorted(recorder.finished) == sorted(expected)
+    stats = pipeline.stats()
+    assert stats["filter"]["processed"] == 5 and stats["filter"]["dropped"] == 5
+    assert stats["double"]["processed"] == 5
+
+
+def test_errors_continue_when_on_error_returns_true():
+    recorder = Recorder()
+    pipeline = Pipeline([Stage("check", _fail_on(3), 2)], recorder.on_finish, recorder.on_error)
+    pipeline.run(range(6))
+    assert [item for item, _ in recorder.errors] == [3]
+    assert sorted(item for item, _ in recorder.finished) == [0, 1, 2, 4, 5]
+    assert pipeline.stats()["check"]["failed"] == 1
+    assert not pipeline.stopped
+
+
+def test_stop_when_on_error_returns_false():
+    recorder = Recorder(stop_on_error=True)
+    pipeline = Pipeline([Stage("check", _fail_on(3), 1, queue_size=1), Stage("double", _double)],
+                        recorder.on_finish, recorder.on_error)
+    # 停止后不再读取剩余的项
+    pipeline.run(iter(range(1000)))
+    assert pipeline.stopped
+    assert len(recorder.errors) == 1
+    assert len(recorder.finished) < 100
+
+
+def test_callback_error_is_raised_from_run():
+    def on_finish(item, completed):
+        if item == 2:
+            raise RuntimeError("on_finish failed")
+
+    pipeline = Pipeline([Stage("a", lambda x: x, 2, queue_size=1), Stage("b", lambda x: x, 2, queue_size=1)],
+                        on_finish, lambda item, e: True)
+    # 回调出错后流水线停止，不会因上游阻塞而挂起
+    with pytest.raises(RuntimeError, match="on_finish failed"):
+        pipeline.run(range(1000))
+    assert pipeline.stopped
+
+
+def test_on_error_exception_is_raised_from_run():
+    def on_error(item, e):
+        raise RuntimeError("on_error failed")
+
+    pipeline = Pipeline([Stage("check", _fail_on(0))], lambda item, completed: None, on_error)
+    with pytest.raises(RuntimeError, match="on_error failed"):
+        pipeline.run(range(100))
+
+
+def test_input_error_stops_workers():
+    def items():
+        yield 1
+        raise KeyError("input")
+
+    recorder = Recorder()
+    pipeline = Pipeline([Stage("a", lambda x: x, 2)], recorder.on_finish, recorder.on_error)
+    with pytest.raises(KeyError):
+        pipeline.run(items())
+    assert recorder.finished == [(1, True)]
+    assert not any(t.name.startswith("a-") for t in threading.enumerate())
@@ -0,0 +1,54 @@
+from sqlalchemy import create_engine, inspect, select, text
+import pkg.pixivmodel as model
+
+
+def _users(sql) -> dict[int, str]:
+    with sql() as session:
+        return {u.user_id: u.user_name for u in session.scalars(select(model.User))}
+
+
+def test_upsert_updates_columns(sql):
+    with sql() as session:
+        model.upsert(session, model.User.__table__, [{"userid": 1, "username": "a"}], ["userid"], ["username"])
+        model.upsert(session, model.User.__table__, [{"userid": 1, "username": "b"}, {"userid": 2, "username": "c"}],
+                     ["userid"], ["username"])
+        session.commit()
+    assert _users(sql) == {1: "b", 2: "c"}
+
+
+def test_upsert_ignores_conflicts_without_update_columns(sql):
+    with sql() as session:
+        model.upsert(session, model.User.__table__, [{"userid": 1, "username": "a"}], ["userid"], [])
+        model.upsert(session, model.User.__table__, [{"userid": 1, "username": "b"}], ["userid"], [])
+        model.upsert(session, model.User.__table__, [], ["userid"], [])
+        session.commit()
+    assert _users(sql) == {1: "a"}
+
+
+def test_unique_tag_name_merges_duplicates(tmp_path):
+    # 构造旧版本的库：tagname只有普通索引，存在重复的tag(sqlite默认不检查外键，不需要插入作品)
+    url = f"sqlite:///{tmp_path / 'db.sqlite'}"
+    engine = create_engine(url)
+    model.Base.metadata.create_all(engine)
+    index = next(iter(model.Tag.__table__.indexes))
+    with engine.begin() as conn:
+        conn.execute(text(f"DROP INDEX {index.name}"))
+        conn.execute(text(f"CREATE INDEX {index.name} ON tag (tagname)"))
+        conn.execute(model.Tag.__table__.insert(), [
+            {"tagid": 1, "tagname": "a"}, {"tagid": 2, "tagname": "a"},
+            {"tagid": 3, "tagname": "b"}, {"tagid": 4, "tagname": "a"},
+        ])
+        links = [(1, 10), (2, 10), (2, 11), (4, 11), (3, 11)]
+        conn.execute(model.ArtworkTag.insert(), [{"tagid": tag_id, "illustid": illust_id} for tag_id, illust_id in links])
+    engine.dispose()
+
+    sql = model.new_session(url)
+    with sql() as session:
+        assert session.execute(select(model.Tag.tag_id, model.Tag.name).order_by(model.Tag.tag_id)).all() == [
+            (1, "a"), (3, "b")]
+        links = session.execute(select(model.ArtworkTag.c.tagid, model.ArtworkTag.c.illustid)).all()
+        assert sorted(links) == [(1, 10), (1, 11), (3, 11)]
+    indexes = inspect(sql.kw["bind"]).get_indexes(model.Tag.__tablename__)
+    assert any(ix["unique"] and ix["column_names"] == ["tagname"] for ix in indexes)
+    # 已是唯一索引时再次打开不做任何事
+    model.new_session(url)
@@ -0,0 +1,149 @@
+import asyncio
+import email.utils
+import time
+import pytest
+import requests
+from pkg.pixivapi import ratelimit
+from pkg.pixivapi.ratelimit import AimdLimiter, AsyncRateLimiter, RateLimiter, TokenBucket
+
+AJAX_URL = "https://www.pixiv.net/ajax/illust/1000"
+IMAGE_URL = "https://i.pximg.net/img-original/img/1000_p0.jpg"
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(ratelimit.time, "monotonic", lambda: now[0])
+    return now
+
+
+class FakeResponse(object):
+    def __init__(self, status_code: int = 200, headers: dict | None = None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+    async def aclose(self):
+        self.closed = True
+
+
+def test_token_bucket_burst_then_rate(clock):
+    bucket = TokenBucket(2, 2)
+    assert bucket._take() == 0
+    assert bucket._take() == 0
+    assert bucket._take() == pytest.approx(0.5)
+    clock[0] += 0.5
+    assert bucket._take() == 0
+
+
+def test_token_bucket_zero_rate_is_unlimited(clock):
+    bucket = TokenBucket(0, 1)
+    assert all(bucket._take() == 0 for _ in range(100))
+    bucket.pause(3)
+    assert bucket._take() == pytest.approx(3)
+    clock[0] += 3
+    assert bucket._take() == 0
+
+
+def test_token_bucket_pause(clock):
+    bucket = TokenBucket(10, 10)
+    bucket.pause(2)
+    bucket.pause(1)
+    assert bucket._take() == pytest.approx(2)
+
+
+def test_aimd_increase_and_decrease(clock):
+    limiter = AimdLimiter(4, 1, 5)
+    for _ in range(4):
+        limiter.acquire()
+    assert not limiter._try_acquire()
+    for _ in range(4):
+        limiter.release(False)
+    # 每次成功增加1/limit，约limit次成功后上限加1，不超过maximum
+    assert limiter.limit == 4
+    for _ in range(4):
+        limiter.acquire()
+        limiter.release(False)
+    assert limiter.limit == 5
+    limiter.acquire()
+    limiter.release(True)
+    assert limiter._limit == pytest.approx(2.5)
+    # DECREASE_INTERVAL内的多次429只减半一次
+    limiter.acquire()
+    limiter.release(True)
+    assert limiter._limit == pytest.approx(2.5)
+    for _ in range(3):
+        clock[0] += ratelimit.DECREASE_INTERVAL
+        limiter.acquire()
+        limiter.release(True)
+    assert limiter.limit == 1
+
+
+def test_retry_after():
+    assert ratelimit.retry_after({}) is None
+    assert ratelimit.retry_after({"Retry-After": "7"}) == 7
+    assert ratelimit.retry_after({"Retry-After": "soon"}) is None
+    date = email.utils.formatdate(time.time() + 30, usegmt=True)
+    assert ratelimit.retry_after({"Retry-After": date}) == pytest.approx(30, abs=2)
+
+
+def test_attempt_uses_host_limiter():
+    limiter = RateLimiter(0, 0)
+    assert limiter._host_limiter(AJAX_URL) is limiter._ajax
+    assert limiter._host_limiter(IMAGE_URL) is limiter._image
+
+
+def test_attempt_retry_delay(monkeypatch):
+    monkeypatch.setattr(ratelimit, "backoff_delay", lambda attempt: 0.25)
+    limiter = RateLimiter(0, 0)
+    assert limiter.attempt(AJAX_URL, lambda: FakeResponse(200), 0)[1] is None
+    assert limiter.attempt(AJAX_URL, lambda: FakeResponse(404), 0)[1] is None
+    assert limiter.attempt(AJAX_URL, lambda: FakeResponse(500), 0)[1] == 0.25
+    assert limiter.attempt(AJAX_URL, lambda: FakeResponse(429, {"Retry-After": "5"}), 0)[1] == 5
+    assert limiter._ajax.bucket._take() > 4
+
+
+def test_stream_holds_slot_until_close():
+    limiter = RateLimiter(0, 0)
+    concurrency = limiter._image.concurrency
+    res, delay = limiter.attempt(IMAGE_URL, lambda: FakeResponse(200), 0, stream=True)
+    assert delay is None and concurrency._inflight == 1
+    res.close()
+    res.close()
+    assert res.closed and concurrency._inflight == 0
+    # 需要重试的流式响应不返回给调用方读取，立即释放
+    limiter.attempt(IMAGE_URL, lambda: FakeResponse(503), 0, stream=True)
+    assert concurrency._inflight == 0
+
+
+def test_release_on_exception():
+    limiter = RateLimiter(0, 0)
+
+    def fail():
+        raise requests.ConnectionError()
+
+    with pytest.raises(requests.ConnectionError):
+        limiter.attempt(AJAX_URL, fail, 0)
+    assert limiter._ajax.concurrency._inflight == 0
+    assert limiter._ajax.concurrency.limit == 2
+
+
+def test_async_stream_holds_slot_until_close():
+    async def run():
+        limiter = AsyncRateLimiter(0, 0)
+        concurrency = limiter._image.concurrency
+
+        async def do_request():
+            return FakeResponse(200)
+
+        res, delay = await limiter.attempt(IMAGE_URL, do_request, 0, stream=True)
+        assert delay is None and concurrency._inflight == 1
+        await res.aclose()
+        assert res.closed and concurrency._inflight == 0
+        await limiter.attempt(AJAX_URL, do_request, 0)
+        assert limiter._ajax.concurrency._inflight == 0
+
+    asyncio.run(run())
@@ -0,0 +1,120 @@
+import os
+import pytest
+from interval import storage
+from interval.storage import ImagePage
+
+
+def _write(file_path, data: bytes = b"x"):
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+    file_path.write_bytes(data)
+    return len(data)
+
+
+@pytest.fixture
+def scans(monkeypatch):
+    # 记录existing()扫描的目录
+    scanned = []
+    scandir = os.scandir
+    monkeypatch.setattr(storage.os, "scandir", lambda path: scanned.append(path) or scandir(path))
+    return scanned
+
+
+@pytest.mark.parametrize("layout", [storage.FLAT, storage.SHARDED, storage.CONTENT])
+def test_store_and_find(tmp_path, layout):
+    image_storage = storage.new_storage(layout, tmp_path)
+    page = image_storage.store(1000, 0, ".png", lambda p: _write(p, b"abc"))
+    assert page == ImagePage(0, "png", 3)
+    assert image_storage.find(1000, 0) == image_storage.path(1000, 0, ".png")
+    assert image_storage.find(1000, 1) is None
+    assert list(image_storage.iter_files()) == [(1000, 0, image_storage.path(1000, 0, ".png"))]
+    # 空文件视为未下载
+    _write(image_storage.path(1000, 1), b"")
+    assert image_storage.find(1000, 1) is None
+
+
+def test_layout_paths(tmp_path):
+    assert storage.new_storage(storage.FLAT, tmp_path).path(1000, 2) == tmp_path / "1000_2.jpg"
+    sharded = storage.new_storage(storage.SHARDED, tmp_path).path(1000, 2, ".png")
+    assert sharded.name == "1000_2.png"
+    assert len(sharded.relative_to(tmp_path).parts) == 3
+    with pytest.raises(ValueError):
+        storage.new_storage("unknown", tmp_path)
+
+
+@pytest.mark.parametrize("layout", [storage.FLAT, storage.SHARDED])
+def test_existing(tmp_path, layout, scans):
+    image_storage = storage.new_storage(layout, tmp_path)
+    pages = [(1000, idx) for idx in range(storage.STAT_PAGES + 4)] + [(2000, 0), (3000, 0)]
+    for artwork_id, idx in pages[::2]:
+        _write(image_storage.path(artwork_id, idx, ".png"))
+    _write(image_storage.path(2000, 0), b"")
+    assert image_storage.existing(pages) == set(pages[::2])
+    # 只有分片布局扫描目录(页数较多的那一个)，flat布局逐页stat
+    assert scans == ([image_storage.path(1000, 0).parent] if layout == storage.SHARDED else [])
+
+
+def test_content_dedupe(tmp_path):
+    image_storage = storage.new_storage(storage.CONTENT, tmp_path)
+    image_storage.store(1000, 0, ".jpg", lambda p: _write(p, b"same"))
+    image_storage.store(2000, 0, ".jpg", lambda p: _write(p, b"same"))
+    image_storage.store(3000, 0, ".jpg", lambda p: _write(p, b"other"))
+    assert os.path.samefile(image_storage.path(1000, 0), image_storage.path(2000, 0))
+    assert not os.path.samefile(image_storage.path(1000, 0), image_storage.path(3000, 0))
+    # objects目录不参与遍历
+    assert sorted(artwork_id for artwork_id, _, _ in image_storage.iter_files()) == [1000, 2000, 3000]
+
+
+def test_migrate_flat(tmp_path):
+    for name in ("1000_0.jpg", "1000_1.png", "2000_0.jpg", "notes.txt"):
+        _write(tmp_path / name)
+    image_storage = storage.new_storage(storage.SHARDED, tmp_path)
+    assert storage.migrate_flat(tmp_path, image_storage) == 3
+    assert image_storage.find(1000, 1) == image_storage.path(1000, 1, ".png")
+    assert (tmp_path / "notes.txt").exists()
+    assert storage.migrate_flat(tmp_path, image_storage) == 0
+
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"\x00" * 8
+GIF = b"GIF89a" + b"\x00" * 10
+
+
+def test_suffix_from_url():
+    assert storage.suffix_from_url("https://i.pximg.net/img-original/img/1000_p0.PNG") == ".png"
+    assert storage.suffix_from_url("https://i.pximg.net/img-original/img/1000_p0.jpeg?x=1") == ".jpg"
+    assert storage.suffix_from_url("https://i.pximg.net/img-original/img/1000_p0") is None
+    assert storage.suffix_from_url("https://i.pximg.net/img-original/img/1000_p0.bmp") is None
+
+
+def test_sniff_suffix():
+    assert storage.sniff_suffix(PNG) == ".png"
+    assert storage.sniff_suffix(b"RIFF\x00\x00\x00\x00WEBPVP8 ") == ".webp"
+    assert storage.sniff_suffix(b"\x00" * 16) is None
+
+
+def test_store_sniffs_unknown_suffix(tmp_path):
+    image_storage = storage.new_storage(storage.FLAT, tmp_path)
+    assert image_storage.store(1000, 0, None, lambda p: _write(p, PNG)) == ImagePage(0, "png", len(PNG))
+    assert image_storage.find(1000, 0) == tmp_path / "1000_0.png"
+    assert not (tmp_path / "1000_0.jpg").exists()
+    # 无法识别时使用默认扩展名
+    assert image_storage.store(1000, 1, None, lambda p: _write(p, b"?")).format == "jpg"
+
+
+def test_fix_suffixes(tmp_path):
+    image_storage = storage.new_storage(storage.SHARDED, tmp_path)
+    _write(image_storage.path(1000, 0), PNG)
+    _write(image_storage.path(1000, 1, ".png"), PNG)
+    _write(image_storage.path(1000, 2), b"unknown")
+    # 改名的目标已存在时保留两个文件，只返回已存在的那个
+    _write(image_storage.path(2000, 0), GIF)
+    _write(image_storage.path(2000, 0, ".gif"), GIF)
+    results = sorted(storage.fix_suffixes(image_storage))
+    assert results == [
+        (1000, ImagePage(0, "png", len(PNG)), True),
+        (1000, ImagePage(1, "png", len(PNG)), False),
+        (1000, ImagePage(2, "jpg", 7), False),
+        (2000, ImagePage(0, "gif", len(GIF)), False),
+    ]
+    assert image_storage.find(1000, 0) == image_storage.path(1000, 0, ".png")
+    assert image_storage.path(2000, 0).exists()
+    assert not any(renamed for _, _, renamed in storage.fix_suffixes(image_storage))